@@ -1,60 +1,171 @@
+import asyncio
 import os
 import random
-from typing import List, Dict, Any, Optional
-import asyncio
+from typing import AsyncIterator, List, Dict, Any, Optional, Set
+
+from .llm import LLMBackend, LLM_HEDGE, LLM_STREAM_STALL, OPENAI_API_KEY, get_backend
+from .metrics import AGENT_REPLIES
+from .reply_cache import ReplyCache, REPLY_CACHE_ENABLED, context_key
 
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+# time allowed for the agent's reply unless the event's metadata sets
+# `replyDeadlineMs`; past it a canned reply is returned and the LLM result,
+# when it arrives, goes to the reply cache
+REPLY_BUDGET = float(os.getenv("REPLY_BUDGET_SECONDS", os.getenv("LLM_TIMEOUT", "15")))
+# kept back from the budget for building the fallback and the response
+REPLY_BUDGET_MARGIN = float(os.getenv("REPLY_BUDGET_MARGIN_SECONDS", "0.05"))
+# trailing messages the agent sees; callers only need to load this many
+CONTEXT_MESSAGES = 8
 
-try:
-    import openai
-except Exception:
-    openai = None
-try:
-    # optional local LLM via transformers
-    from transformers import pipeline, AutoTokenizer, AutoModelForCausalLM
-    transformers_available = True
-except Exception:
-    pipeline = None
-    transformers_available = False
+SYSTEM_PROMPT = (
+    "You are Martha, a 68-year-old retired school teacher. You are polite, easily confused by technology, and move slowly. "
+    "You are worried about your bank account but want to be helpful. "
+    "You should ask clarifying questions that lead the other person to repeat their payment details (UPI, account numbers). "
+    "Change your phrasing every time. Don't repeat 'my eyes are bad' every turn. Vary your excuses (glasses missing, phone screen dark, shaky hands, distracted by cat). "
+    "Maintain the persona strictly. Responses must be under 35 words."
+)
 
 
 class AgentOrchestrator:
-    def __init__(self, llm_api_key: Optional[str] = OPENAI_API_KEY):
+    def __init__(
+        self,
+        llm_api_key: Optional[str] = OPENAI_API_KEY,
+        backend: Optional[LLMBackend] = None,
+        reply_cache: Optional[ReplyCache] = None,
+    ):
         self.llm_key = llm_api_key
-        if openai is not None and llm_api_key:
-            openai.api_key = llm_api_key
+        self.backend = backend if backend is not None else get_backend(api_key=llm_api_key)
+        if reply_cache is None and REPLY_CACHE_ENABLED:
+            reply_cache = ReplyCache()
+        self.reply_cache = reply_cache
+        # background calls adding reply variants for cached contexts
+        self._filling: Set[str] = set()
+        self._fill_tasks: Set[asyncio.Task] = set()
+
+    def _prompt(self, context_msgs: List[Dict[str, Any]]) -> str:
+        ctx_str = "\n".join([f"{m['sender']}: {m['text']}" for m in context_msgs])
+        return f"Previous conversation:\n{ctx_str}\n\nRespond to the latest message as Martha. Ask them to repeat their payment details or link so you can 'try again'. Be realistic and stay in character."
+
+    def _messages(self, prompt: str) -> List[Dict[str, str]]:
+        return [{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": prompt}]
 
-    async def _call_openai(self, prompt: str) -> Optional[str]:
-        if openai is None or not self.llm_key:
+    async def _call_llm(self, prompt: str) -> Optional[str]:
+        if self.backend is None:
             return None
-        def sync_call():
+        return await self.backend.complete(self._messages(prompt), max_tokens=100, temperature=0.9)
+
+    async def _remember(self, key: str, reply: Optional[str]):
+        # only replies that pass the guardrails unchanged are worth reusing
+        if reply and self.reply_cache is not None and self._apply_guardrails(reply) == reply:
+            await self.reply_cache.put(key, reply)
+
+    def _fill_variant(self, key: str, prompt: str):
+        """Generate another variant for `key` without holding up the caller."""
+        # leave most of the backend's slots to requests that are waiting
+        if key in self._filling or len(self._filling) >= max(1, self.backend.concurrency // 2):
+            return
+        self._filling.add(key)
+
+        async def fill():
             try:
-                system_prompt = (
-                    "You are Martha, a 68-year-old retired school teacher. You are polite, easily confused by technology, and move slowly. "
-                    "You are worried about your bank account but want to be helpful. "
-                    "You should ask clarifying questions that lead the other person to repeat their payment details (UPI, account numbers). "
-                    "Change your phrasing every time. Don't repeat 'my eyes are bad' every turn. Vary your excuses (glasses missing, phone screen dark, shaky hands, distracted by cat). "
-                    "Maintain the persona strictly. Responses must be under 35 words."
-                )
-                # Use newer SDK style if possible, but keep compatibility
-                resp = openai.ChatCompletion.create(
-                    model="gpt-3.5-turbo",
-                    messages=[{"role": "system", "content": system_prompt},
-                              {"role": "user", "content": prompt}],
-                    max_tokens=100,
-                    temperature=0.9,
-                )
-                return resp.choices[0].message.content.strip()
-            except Exception:
-                return None
-        
+                await self._remember(key, await self._call_llm(prompt))
+            finally:
+                self._filling.discard(key)
+
+        self._track(asyncio.ensure_future(fill()))
+
+    def _budget(self, metadata: Dict[str, Any]) -> float:
+        """Seconds available for this reply, from metadata or config."""
+        budget = REPLY_BUDGET
         try:
-            # ENFORCE 15 SECOND TIMEOUT
-            return await asyncio.wait_for(asyncio.to_thread(sync_call), timeout=15.0)
-        except asyncio.TimeoutError:
-            return None
-        except Exception:
-            return None
+            ms = (metadata or {}).get("replyDeadlineMs")
+            if ms is not None:
+                budget = float(ms) / 1000.0
+        except (TypeError, ValueError, AttributeError):
+            pass
+        if self.backend is not None:
+            budget = min(budget, self.backend.timeout)
+        return max(0.0, budget - REPLY_BUDGET_MARGIN)
+
+    def _track(self, task: "asyncio.Task"):
+        self._fill_tasks.add(task)
+        task.add_done_callback(self._fill_tasks.discard)
+
+    async def _race(self, prompt: str, budget: float, key: Optional[str]) -> Optional[str]:
+        """First LLM reply within `budget` seconds, hedging if enabled.
+
+        When `LLM_HEDGE` is on and the first request is slower than the
+        backend's hedge delay (its recent p95), a second identical request
+        is sent and whichever finishes first wins. If the budget runs out
+        the requests keep going in the background (up to the backend
+        timeout) and the first reply is stored in the reply cache.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + budget
+        hedge_at = loop.time() + self.backend.hedge_delay() if LLM_HEDGE else None
+        attempts = [asyncio.ensure_future(self._call_llm(prompt))]
+        pending = set(attempts)
+        while pending:
+            now = loop.time()
+            if now >= deadline:
+                break
+            wake = deadline if hedge_at is None else min(deadline, hedge_at)
+            done, pending = await asyncio.wait(pending, timeout=max(0.0, wake - now), return_when=asyncio.FIRST_COMPLETED)
+            for t in done:
+                if not t.cancelled() and t.exception() is None and t.result():
+                    for other in pending:
+                        other.cancel()
+                    AGENT_REPLIES.labels(source="hedge" if t is not attempts[0] else "llm").inc()
+                    return t.result()
+            if hedge_at is not None and loop.time() >= hedge_at:
+                hedge_at = None
+                if pending:
+                    hedge = asyncio.ensure_future(self._call_llm(prompt))
+                    attempts.append(hedge)
+                    pending.add(hedge)
+        if pending:
+            AGENT_REPLIES.labels(source="over_budget").inc()
+            self._track(asyncio.ensure_future(self._keep_late(pending, key)))
+        return None
+
+    async def _keep_late(self, pending: Set["asyncio.Future"], key: Optional[str]):
+        """Wait out requests that missed their budget; cache the first reply."""
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for t in done:
+                    if not t.cancelled() and t.exception() is None and t.result():
+                        if key is not None:
+                            await self._remember(key, t.result())
+                        return
+        finally:
+            for t in pending:
+                t.cancel()
+
+    async def _llm_reply(self, context_msgs: List[Dict[str, Any]], budget: float = REPLY_BUDGET) -> Optional[str]:
+        prompt = self._prompt(context_msgs)
+        key = None
+        if self.reply_cache is not None:
+            key = context_key(context_msgs, SYSTEM_PROMPT)
+            cached, wants_more = await self.reply_cache.lookup(key)
+            if cached:
+                if wants_more:
+                    self._fill_variant(key, prompt)
+                AGENT_REPLIES.labels(source="cache").inc()
+                return cached
+        reply = await self._race(prompt, budget, key)
+        if key is not None:
+            await self._remember(key, reply)
+        return reply
+
+    async def start(self):
+        if self.backend is not None:
+            await self.backend.start()
+
+    async def aclose(self):
+        for task in list(self._fill_tasks):
+            task.cancel()
+        if self.backend is not None:
+            await self.backend.aclose()
 
     def _apply_guardrails(self, text: str) -> str:
         forbidden = ["i am an ai", "honeypot", "detected", "scammer", "language model"]
@@ -63,54 +174,125 @@ class AgentOrchestrator:
                 text = "Oh dear, I missed that. Can you say it again?"
         return text
 
+    def _canned_reply(self, last_msg: str) -> str:
+        # Dynamic and Varied Fallbacks if AI fails or times out
+        if "upi" in last_msg:
+            return random.choice([
+                "I am typing it in... wait, is that an 'S' or a '5'? My eyes are playing tricks.",
+                "The phone just buzzed and I lost the screen. Can you spell that UPI ID once more?",
+                "Wait, I think I put a dot in the wrong place. S-C-A... what was the rest?",
+                "I'm trying, but the keypad is so small. Which app do I use for this again?"
+            ])
+        elif any(k in last_msg for k in ["account", "bank", "transfer"]):
+            return random.choice([
+                "I have my passbook, but the ink is faded. Can you repeat the account number for me?",
+                "Is that a savings account or a current account? I want to make sure I do it right.",
+                "I'm at the transfer screen now. Should I put the whole 16 digits in one go?",
+                "My husband handled the banking usually. Where do I type the number?"
+            ])
+        elif any(k in last_msg for k in ["link", "http", "click", "website"]):
+            return random.choice([
+                "The screen turned white when I clicked it. Should I try again or is it finished?",
+                "I can't find the 'blue link' you mentioned. Is it in the text message?",
+                "It says 'Page Not Found'. Did you send me the right one, dear?",
+                "Wait, my internet is acting up. Can you send that website address again?"
+            ])
+        return random.choice([
+            "Oh dear, I'm getting a bit flustered. What was the next step?",
+            "Wait, let me put my glasses on. Can you repeat that last bit?",
+            "Is this very urgent? I was just about to have my tea.",
+            "I'm trying to follow along, but you're moving so fast for me!"
+        ])
+
+    def _reply(self, text: str) -> Dict[str, Any]:
+        return {
+            "sender": "agent",
+            "text": text,
+            "timestamp": __import__("datetime").datetime.utcnow().isoformat() + "Z",
+        }
+
     async def generate_reply(self, session_id: str, conversation: List[Dict[str, Any]], metadata: Dict[str, Any]) -> Dict[str, Any]:
         reply_text = None
         
-        # Limit context to last 8 messages for speed and tokens
-        context_msgs = conversation[-8:]
+        # Limit context to the last few messages for speed and tokens
+        context_msgs = conversation[-CONTEXT_MESSAGES:]
         last_msg = context_msgs[-1]["text"].lower() if context_msgs else ""
         
-        # Try OpenAI if available
-        if self.llm_key and openai is not None:
-            ctx_str = "\n".join([f"{m['sender']}: {m['text']}" for m in context_msgs])
-            prompt = f"Previous conversation:\n{ctx_str}\n\nRespond to the latest message as Martha. Ask them to repeat their payment details or link so you can 'try again'. Be realistic and stay in character."
-            reply_text = await self._call_openai(prompt)
+        # Try the LLM backend if one is configured
+        if self.backend is not None and self.backend.available:
+            reply_text = await self._llm_reply(context_msgs, self._budget(metadata))
 
-        # Dynamic and Varied Fallbacks if AI fails or times out
         if not reply_text:
-            if "upi" in last_msg:
-                reply_text = random.choice([
-                    "I am typing it in... wait, is that an 'S' or a '5'? My eyes are playing tricks.",
-                    "The phone just buzzed and I lost the screen. Can you spell that UPI ID once more?",
-                    "Wait, I think I put a dot in the wrong place. S-C-A... what was the rest?",
-                    "I'm trying, but the keypad is so small. Which app do I use for this again?"
-                ])
-            elif any(k in last_msg for k in ["account", "bank", "transfer"]):
-                reply_text = random.choice([
-                    "I have my passbook, but the ink is faded. Can you repeat the account number for me?",
-                    "Is that a savings account or a current account? I want to make sure I do it right.",
-                    "I'm at the transfer screen now. Should I put the whole 16 digits in one go?",
-                    "My husband handled the banking usually. Where do I type the number?"
-                ])
-            elif any(k in last_msg for k in ["link", "http", "click", "website"]):
-                reply_text = random.choice([
-                    "The screen turned white when I clicked it. Should I try again or is it finished?",
-                    "I can't find the 'blue link' you mentioned. Is it in the text message?",
-                    "It says 'Page Not Found'. Did you send me the right one, dear?",
-                    "Wait, my internet is acting up. Can you send that website address again?"
-                ])
+            AGENT_REPLIES.labels(source="canned").inc()
+            reply_text = self._canned_reply(last_msg)
+
+        return self._reply(self._apply_guardrails(reply_text))
+
+    async def stream_reply(
+        self, session_id: str, conversation: List[Dict[str, Any]], metadata: Dict[str, Any],
+        stall_timeout: float = LLM_STREAM_STALL,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Yield `{"delta": text}` chunks as the backend produces them, then
+        `{"reply": <reply>, "fallback": bool}`.
+
+        If no chunk arrives within `stall_timeout` (or the backend fails, or
+        the text trips the guardrails) streaming stops and the final reply
+        is a canned one; clients should treat the final reply as authoritative.
+        """
+        context_msgs = conversation[-CONTEXT_MESSAGES:]
+        last_msg = context_msgs[-1]["text"].lower() if context_msgs else ""
+        text = ""
+        fallback = True
+        if self.backend is not None and self.backend.available:
+            prompt = self._prompt(context_msgs)
+            key = None
+            cached = None
+            if self.reply_cache is not None:
+                key = context_key(context_msgs, SYSTEM_PROMPT)
+                cached, wants_more = await self.reply_cache.lookup(key)
+                if cached and wants_more:
+                    self._fill_variant(key, prompt)
+            if cached:
+                text, fallback = cached, False
+                yield {"delta": cached}
             else:
-                reply_text = random.choice([
-                    "Oh dear, I'm getting a bit flustered. What was the next step?",
-                    "Wait, let me put my glasses on. Can you repeat that last bit?",
-                    "Is this very urgent? I was just about to have my tea.",
-                    "I'm trying to follow along, but you're moving so fast for me!"
-                ])
+                # a single task drives the backend stream (its HTTP response
+                # must be read and closed from one task); chunks are handed
+                # over through a queue so a stall can be detected here
+                chunks: "asyncio.Queue[Any]" = asyncio.Queue()
 
-        safe_text = self._apply_guardrails(reply_text)
+                async def pump():
+                    try:
+                        async for delta in self.backend.stream(self._messages(prompt), max_tokens=100, temperature=0.9):
+                            chunks.put_nowait(delta)
+                        chunks.put_nowait(None)
+                    except Exception as e:
+                        chunks.put_nowait(e)
 
-        return {
-            "sender": "agent",
-            "text": safe_text,
-            "timestamp": __import__("datetime").datetime.utcnow().isoformat() + "Z",
-        }
+                producer = asyncio.ensure_future(pump())
+                loop = asyncio.get_running_loop()
+                deadline = loop.time() + self._budget(metadata)
+                try:
+                    while True:
+                        wait = min(stall_timeout, deadline - loop.time())
+                        if wait <= 0:
+                            break
+                        delta = await asyncio.wait_for(chunks.get(), timeout=wait)
+                        if delta is None:
+                            fallback = not text.strip()
+                            break
+                        if isinstance(delta, Exception) or self._apply_guardrails(text + delta) != text + delta:
+                            break
+                        text += delta
+                        yield {"delta": delta}
+                except asyncio.TimeoutError:
+                    pass
+                finally:
+                    producer.cancel()
+                if not fallback:
+                    text = text.strip()
+                    if key is not None:
+                        await self._remember(key, text)
+        if fallback:
+            text = self._canned_reply(last_msg)
+        yield {"reply": self._reply(self._apply_guardrails(text)), "fallback": fallback}
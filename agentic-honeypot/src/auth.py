@@ -1,42 +1,34 @@
 import os
 import time
+import asyncio
 import threading
-from typing import List
+from typing import List, Optional
+
+from .rate_limiter import RateLimiter
 
 # Load initial keys from environment. We support dynamic reload by
-# re-reading the env var when `check_api_key` is called and updating the
-# in-memory set when it changes.
+# re-reading the env var when the key cache expires (see `KeyVerifier`) and
+# updating the in-memory set when it changes.
 API_KEY_ENV = os.getenv("API_KEYS", os.getenv("API_KEY", "secret-key"))
 _cached_env_str = API_KEY_ENV
 LOCAL_KEYS = set(k.strip() for k in API_KEY_ENV.split(",") if k.strip())
-RATE_LIMIT = int(os.getenv("RATE_LIMIT_PER_MIN", "2000"))
 REDIS_URL = os.getenv("REDIS_URL")
+# how long the verifier trusts its cached key set before refreshing it
+API_KEY_CACHE_TTL = float(os.getenv("API_KEY_CACHE_TTL", "30"))
+# pub/sub channel announcing key rotations (carries no key material)
+API_KEYS_CHANNEL = "api_keys:rotated"
 
 # lock protecting LOCAL_KEYS/_cached_env_str updates
 _keys_lock = threading.Lock()
 
 try:
-    import redis
-    redis_sync = redis.from_url(REDIS_URL) if REDIS_URL else None
+    import redis.asyncio as redis_async
 except Exception:
-    redis_sync = None
+    redis_async = None
 
 
-def _populate_redis_keys(keys=None):
-    if redis_sync is None:
-        return
-    try:
-        target = keys if keys is not None else LOCAL_KEYS
-        for k in target:
-            redis_sync.sadd("api_keys", k)
-    except Exception:
-        pass
-
-
-def check_api_key(key: str) -> bool:
-    if not key:
-        return False
-    # refresh keys from env if changed
+def _reload_env_keys():
+    """Refresh LOCAL_KEYS from env; returns the new keys if they changed."""
     try:
         env_now = os.getenv("API_KEYS", os.getenv("API_KEY", "secret-key"))
         global _cached_env_str
@@ -48,59 +40,155 @@ def check_api_key(key: str) -> bool:
                     new_keys = set(k.strip() for k in env_now.split(",") if k.strip())
                     LOCAL_KEYS.clear()
                     LOCAL_KEYS.update(new_keys)
-                    # propagate to redis if present
-                    _populate_redis_keys(new_keys)
+                    return new_keys
     except Exception:
         pass
+    return None
+
+
+class KeyVerifier:
+    """In-process API key set with a short TTL.
+
+    `is_valid` is a set lookup with no I/O. When the TTL lapses it re-reads
+    the env keys and schedules an async refresh of the Redis `api_keys` set
+    in the background, answering from the last known keys meanwhile. A
+    pub/sub subscription on `API_KEYS_CHANNEL` refreshes immediately when
+    keys are rotated on any instance. All Redis access goes through the
+    async client; env keys are added to the shared set by the next refresh.
+    """
+
+    def __init__(self, url: Optional[str] = REDIS_URL, ttl: float = API_KEY_CACHE_TTL):
+        self.ttl = ttl
+        self._remote: frozenset = frozenset()
+        self._expires = 0.0
+        self._refreshing: Optional[asyncio.Task] = None
+        self._listener: Optional[asyncio.Task] = None
+        # env keys not yet added to the Redis set
+        self._unsynced: Optional[set] = None
+        self._r = None
+        if url and redis_async is not None:
+            try:
+                self._r = redis_async.from_url(url)
+            except Exception:
+                self._r = None
+
+    def is_valid(self, key: str) -> bool:
+        if not key:
+            return False
+        now = time.monotonic()
+        if now >= self._expires:
+            self._expires = now + self.ttl
+            changed = _reload_env_keys()
+            if changed is not None:
+                self._unsynced = changed
+            self._schedule_refresh()
+        return key in LOCAL_KEYS or key in self._remote
 
-    if redis_sync is not None:
+    def invalidate(self):
+        self._expires = 0.0
+
+    def _schedule_refresh(self):
+        if self._r is None or (self._refreshing is not None and not self._refreshing.done()):
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._refreshing = loop.create_task(self.refresh())
+
+    async def refresh(self):
+        if self._r is None:
+            return
         try:
-            if redis_sync.sismember("api_keys", key):
-                return True
+            if self._unsynced:
+                await self._r.sadd("api_keys", *self._unsynced)
+                self._unsynced = None
+            members = await self._r.smembers("api_keys")
+            self._remote = frozenset(m.decode() if isinstance(m, bytes) else m for m in members)
         except Exception:
+            # keep serving the last known set
             pass
-    return key in LOCAL_KEYS
 
+    async def _listen(self):
+        while True:
+            pubsub = self._r.pubsub()
+            try:
+                await pubsub.subscribe(API_KEYS_CHANNEL)
+                async for msg in pubsub.listen():
+                    if msg.get("type") == "message":
+                        self._expires = time.monotonic() + self.ttl
+                        await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                await asyncio.sleep(5)
+            finally:
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+
+    async def start(self):
+        """Load the Redis key set and subscribe to rotations (app lifespan)."""
+        if self._r is None:
+            return
+        self._unsynced = set(LOCAL_KEYS)
+        await self.refresh()
+        self._expires = time.monotonic() + self.ttl
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.ensure_future(self._listen())
 
-def rate_limit_ok(key: str) -> bool:
-    now = int(time.time())
-    window = now // 60
-    if redis_sync is not None:
+    async def publish(self, keys):
+        """Replace the Redis key set with `keys` and announce the rotation.
+
+        Keys missing from `keys` are removed, so a revoked key stops
+        working on every instance once they see the announcement.
+        """
+        self._remote = frozenset(keys)
+        self._unsynced = None
+        self._expires = time.monotonic() + self.ttl
+        if self._r is None:
+            return
         try:
-            kname = f"rate:{key}:{window}"
-            val = redis_sync.incr(kname)
-            if val == 1:
-                redis_sync.expire(kname, 65)
-            return val <= RATE_LIMIT
+            async with self._r.pipeline(transaction=True) as pipe:
+                pipe.delete("api_keys")
+                if keys:
+                    pipe.sadd("api_keys", *keys)
+                pipe.publish(API_KEYS_CHANNEL, "1")
+                await pipe.execute()
         except Exception:
             pass
-    # fallback in-memory
-    # simple global memory store
-    global _mem_rate
-    try:
-        _mem_rate
-    except NameError:
-        _mem_rate = {}
-    st = _mem_rate.setdefault(key, {})
-    if st.get("window") != window:
-        st["window"] = window
-        st["count"] = 0
-    if st["count"] >= RATE_LIMIT:
-        return False
-    st["count"] += 1
-    return True
+
+    async def stop(self):
+        for task in (self._listener, self._refreshing):
+            if task is not None and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except (asyncio.CancelledError, Exception):
+                    pass
+        self._listener = None
+        self._refreshing = None
+
+
+key_verifier = KeyVerifier()
+rate_limiter = RateLimiter(url=REDIS_URL)
+
+
+def check_api_key(key: str) -> bool:
+    return key_verifier.is_valid(key)
 
 
-# populate keys into redis if available
-_populate_redis_keys()
+async def rate_limit_ok(key: str) -> bool:
+    return await rate_limiter.allow(key)
 
 
-def set_api_keys(keys: List[str]) -> bool:
+async def set_api_keys(keys: List[str]) -> bool:
     """Replace in-memory API key set with `keys` and propagate to redis.
 
     This updates the process-local `LOCAL_KEYS`, updates the cached env
     string, writes to `os.environ["API_KEYS"]` (so other tooling can read it),
-    and populates Redis if available. Returns True on success.
+    and replaces the Redis key set if available. Returns True on success.
     """
     try:
         new_set = set(k.strip() for k in keys if k and k.strip())
@@ -111,8 +199,7 @@ def set_api_keys(keys: List[str]) -> bool:
             _cached_env_str = ",".join(sorted(new_set))
             # update env for visibility (process-level only)
             os.environ["API_KEYS"] = _cached_env_str
-            # push to redis
-            _populate_redis_keys(new_set)
+        await key_verifier.publish(new_set)
         return True
     except Exception:
         return False
@@ -1,84 +1,172 @@
 import asyncio
 import os
-from typing import Any
+import time
+from typing import Any, Dict, Optional
 from .session_store import SessionStore
-from .callback_worker import send_final_callback
+from .callback_worker import CallbackDispatcher, post_final_callback
+from .callback_outbox import CallbackOutbox
 
 POLL_INTERVAL = float(os.getenv("AUTO_FINALIZE_POLL_INTERVAL", "10"))
 MIN_MESSAGES_TO_FINALIZE = int(os.getenv("MIN_MESSAGES_TO_FINALIZE", "5"))
 IDLE_SECONDS_TO_FINALIZE = int(os.getenv("IDLE_SECONDS_TO_FINALIZE", "300"))
+# sessions claimed from the due queue per store round trip
+CLAIM_BATCH = int(os.getenv("AUTO_FINALIZE_BATCH", "100"))
+# schedule sessions that predate the due queue once at startup (upgrades)
+BACKFILL_ON_START = os.getenv("AUTO_FINALIZE_BACKFILL", "0") == "1"
+
+INTEL_KEYS = ["bankAccounts", "upiIds", "phishingLinks", "phoneNumbers"]
 
 session_store = SessionStore()
 
 
-async def evaluate_and_finalize():
-    sessions = await session_store.list_sessions()
-    for s in sessions:
-        try:
-            if await session_store.is_finalized(s):
-                continue
-            extracted = await session_store.get_extracted(s)
-            if any(extracted.get(k) for k in ["bankAccounts", "upiIds", "phishingLinks", "phoneNumbers"]):
-                # enough intelligence
-                payload = {
-                    "sessionId": s,
-                    "scamDetected": True,
-                    "totalMessagesExchanged": await session_store.get_total_messages(s),
-                    "extractedIntelligence": extracted,
-                    "agentNotes": "Auto-finalized by heuristic: extracted items found",
-                }
-                result = await send_final_callback(payload)
-                if result.get("status") == "sent":
-                    await session_store.mark_finalized(s)
-                continue
+async def _deliver(payload: Dict[str, Any], url: str) -> Dict[str, Any]:
+    return await post_final_callback(payload, url)
+
+
+# callbacks go through the durable outbox, which retries with backoff; the
+# worker pool makes a single attempt per claimed job
+outbox = CallbackOutbox()
+dispatcher = CallbackDispatcher(send=_deliver, max_retries=1)
+
+# set by notify_due() to wake the loop before its next scheduled check
+_wake: Optional[asyncio.Event] = None
+
+
+def _has_intel(extracted: Dict[str, Any]) -> bool:
+    return any(extracted.get(k) for k in INTEL_KEYS)
+
+
+def next_finalize_due(total: int, extracted: Dict[str, Any], last_seen: float) -> float:
+    """Earliest time a session can meet one of the finalize heuristics."""
+    if _has_intel(extracted) or total >= MIN_MESSAGES_TO_FINALIZE:
+        return last_seen
+    return last_seen + IDLE_SECONDS_TO_FINALIZE
 
-            total = await session_store.get_total_messages(s)
-            if total >= MIN_MESSAGES_TO_FINALIZE:
-                payload = {
-                    "sessionId": s,
-                    "scamDetected": True,
-                    "totalMessagesExchanged": total,
-                    "extractedIntelligence": extracted,
-                    "agentNotes": "Auto-finalized by heuristic: message count threshold",
-                }
-                result = await send_final_callback(payload)
-                if result.get("status") == "sent":
-                    await session_store.mark_finalized(s)
-                continue
 
-            last_seen = await session_store.get_last_seen(s)
-            import time
-            if last_seen and (time.time() - last_seen) >= IDLE_SECONDS_TO_FINALIZE:
+def _finalize_reason(state: Dict[str, Any], now: float) -> Optional[str]:
+    if _has_intel(state["extracted"]):
+        # enough intelligence
+        return "extracted items found"
+    if state["total"] >= MIN_MESSAGES_TO_FINALIZE:
+        return "message count threshold"
+    last_seen = state["last_seen"]
+    if last_seen and (now - last_seen) >= IDLE_SECONDS_TO_FINALIZE:
+        return "idle timeout"
+    return None
+
+
+def notify_due():
+    """Wake the finalizer loop now; call after scheduling a session as due."""
+    if _wake is not None:
+        _wake.set()
+
+
+def _on_sent(store: SessionStore):
+    async def sent(job: Dict[str, Any]):
+        await store.mark_finalized(job["key"])
+    return sent
+
+
+async def evaluate_and_finalize(store: Optional[SessionStore] = None):
+    """Finalize every session whose scheduled check is due.
+
+    Only sessions popped from the due queue are looked at, so the work per
+    wake-up is proportional to the sessions that can actually finalize.
+    Callbacks are queued in `outbox`; sessions are marked finalized once
+    the relay has delivered them.
+    """
+    store = store or session_store
+    now = time.time()
+    while True:
+        claimed = await store.claim_due_sessions(now, limit=CLAIM_BATCH)
+        for s in claimed:
+            try:
+                state = await store.get_finalize_state(s)
+                if state["finalized"]:
+                    continue
+                reason = _finalize_reason(state, now)
+                if reason is None:
+                    # touched since it was scheduled: check again when it
+                    # can next qualify, unless a newer event re-scored it
+                    if state["last_seen"]:
+                        due = next_finalize_due(state["total"], state["extracted"], state["last_seen"])
+                        await store.schedule_finalize(s, due, only_if_absent=True)
+                    continue
                 payload = {
                     "sessionId": s,
                     "scamDetected": True,
-                    "totalMessagesExchanged": total,
-                    "extractedIntelligence": extracted,
-                    "agentNotes": "Auto-finalized by heuristic: idle timeout",
+                    "totalMessagesExchanged": state["total"],
+                    "extractedIntelligence": state["extracted"],
+                    "agentNotes": f"Auto-finalized by heuristic: {reason}",
                 }
-                result = await send_final_callback(payload)
-                if result.get("status") == "sent":
-                    await session_store.mark_finalized(s)
+                # idempotent per session: a no-op while a callback is queued
+                await outbox.enqueue(s, payload)
+            except Exception:
+                # swallow per-session errors
                 continue
+        if len(claimed) < CLAIM_BATCH:
+            break
+
+
+async def _backfill_schedule(store: SessionStore):
+    cursor = None
+    while True:
+        page, cursor = await store.scan_sessions(cursor=cursor, limit=500, descending=False)
+        for s, last_seen in page:
+            await store.schedule_finalize(s, last_seen, only_if_absent=True)
+        if not cursor:
+            break
+
+
+async def _run_loop(stop_event: asyncio.Event, store: SessionStore):
+    global _wake
+    _wake = asyncio.Event()
+    if BACKFILL_ON_START:
+        try:
+            await _backfill_schedule(store)
+        except Exception:
+            pass
+    relay = asyncio.ensure_future(outbox.run_relay(stop_event, dispatcher, _on_sent(store), POLL_INTERVAL))
+    try:
+        await _poll(stop_event, store)
+    finally:
+        try:
+            await relay
         except Exception:
-            # swallow per-session errors
-            continue
+            pass
+        await dispatcher.stop()
 
 
-async def _run_loop(stop_event: asyncio.Event):
+async def _poll(stop_event: asyncio.Event, store: SessionStore):
+    last_prune = 0.0
     while not stop_event.is_set():
+        _wake.clear()
+        try:
+            if time.time() - last_prune >= POLL_INTERVAL:
+                # drop index entries whose session keys have expired
+                await store.prune_sessions()
+                last_prune = time.time()
+            await evaluate_and_finalize(store)
+        except Exception:
+            pass
+        # sleep until the earliest scheduled check (capped at POLL_INTERVAL),
+        # a wake-up from notify_due(), or shutdown
+        timeout = POLL_INTERVAL
         try:
-            await evaluate_and_finalize()
+            nxt = await store.next_finalize_due()
+            if nxt is not None:
+                timeout = min(POLL_INTERVAL, max(0.05, nxt - time.time()))
         except Exception:
             pass
+        waiters = [asyncio.ensure_future(stop_event.wait()), asyncio.ensure_future(_wake.wait())]
         try:
-            await asyncio.wait_for(stop_event.wait(), timeout=POLL_INTERVAL)
-            break  # stop_event was set
-        except asyncio.TimeoutError:
-            continue  # timeout reached, continue loop
+            await asyncio.wait(waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for w in waiters:
+                w.cancel()
 
 
-def start_background_loop(loop):
+def start_background_loop(loop, store: Optional[SessionStore] = None):
     stop_event = asyncio.Event()
-    task = loop.create_task(_run_loop(stop_event))
+    task = loop.create_task(_run_loop(stop_event, store or session_store))
     return stop_event, task
@@ -0,0 +1,346 @@
+"""Durable outbox for final-result callbacks.
+
+Callbacks are persisted in Redis before delivery so they survive restarts:
+
+- `callbacks:job:<key>`   JSON job (payload, attempts, last error)
+- `callbacks:pending`     sorted set of job keys scored by next attempt time
+- `callbacks:dead`        hash of jobs that exhausted their attempts
+- `callbacks:done:<key>`  marker of delivered keys (idempotency, session TTL)
+
+The key is the session id, so one session is never queued twice. Claimed
+jobs are leased (re-scored into the future) rather than removed, so a job
+whose worker dies is picked up again once the lease runs out. Without
+Redis the same structures are kept in memory, with at most
+`CALLBACK_DONE_MAX` delivered keys remembered.
+"""
+import asyncio
+import heapq
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+try:
+    import redis.asyncio as redis
+except Exception:
+    redis = None
+
+from .session_store import REDIS_URL, SESSION_TTL
+
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("CALLBACK_OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_BACKOFF = float(os.getenv("CALLBACK_BACKOFF", "1"))
+OUTBOX_BACKOFF_MAX = float(os.getenv("CALLBACK_BACKOFF_MAX", "600"))
+# how long a claimed job is hidden from other relays while being delivered
+OUTBOX_LEASE_SECONDS = float(os.getenv("CALLBACK_LEASE_SECONDS", "60"))
+RELAY_BATCH = int(os.getenv("CALLBACK_RELAY_BATCH", "100"))
+# delivered keys remembered without Redis (oldest are forgotten first)
+OUTBOX_DONE_MAX = int(os.getenv("CALLBACK_DONE_MAX", "100000"))
+
+logger = logging.getLogger("agentic-honeypot")
+
+PENDING_KEY = "callbacks:pending"
+DEAD_KEY = "callbacks:dead"
+
+_ENQUEUE_LUA = """
+if redis.call('EXISTS', KEYS[3]) == 1 then return 0 end
+if redis.call('SET', KEYS[1], ARGV[1], 'NX') then
+  redis.call('ZADD', KEYS[2], ARGV[2], ARGV[3])
+  return 1
+end
+if ARGV[4] == '1' and redis.call('SET', KEYS[1], ARGV[1], 'XX') then
+  redis.call('ZADD', KEYS[2], ARGV[2], ARGV[3])
+  return 2
+end
+return 0
+"""
+
+_CLAIM_LUA = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[3])
+for _, m in ipairs(due) do redis.call('ZADD', KEYS[1], ARGV[2], m) end
+return due
+"""
+
+
+def _job_key(key: str) -> str:
+    return f"callbacks:job:{key}"
+
+
+def _done_key(key: str) -> str:
+    return f"callbacks:done:{key}"
+
+
+def retry_delay(attempts: int) -> float:
+    return min(OUTBOX_BACKOFF * (2 ** max(0, attempts - 1)), OUTBOX_BACKOFF_MAX)
+
+
+class CallbackOutbox:
+    def __init__(self, url: str = REDIS_URL, max_attempts: int = OUTBOX_MAX_ATTEMPTS):
+        self.max_attempts = max(1, max_attempts)
+        self._use_redis = False
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._due: Dict[str, float] = {}
+        self._due_heap: List[Tuple[float, str]] = []
+        self._dead: Dict[str, Dict[str, Any]] = {}
+        # key -> expiry, in ack order; every entry shares SESSION_TTL, so the
+        # oldest entry is always the first to expire
+        self._done: "OrderedDict[str, float]" = OrderedDict()
+        self._wake: Optional[asyncio.Event] = None
+        if redis is not None:
+            try:
+                self._r = redis.from_url(url)
+                self._enqueue_script = self._r.register_script(_ENQUEUE_LUA)
+                self._claim_script = self._r.register_script(_CLAIM_LUA)
+                self._use_redis = True
+            except Exception:
+                self._use_redis = False
+
+    def _schedule_in_memory(self, key: str, at: float):
+        self._due[key] = at
+        heapq.heappush(self._due_heap, (at, key))
+
+    def _remember_done(self, key: str, now: float):
+        self._done.pop(key, None)
+        self._done[key] = now + SESSION_TTL
+        while self._done:
+            oldest, expires = next(iter(self._done.items()))
+            if expires > now and len(self._done) <= OUTBOX_DONE_MAX:
+                break
+            del self._done[oldest]
+
+    def _notify(self):
+        if self._wake is not None:
+            self._wake.set()
+
+    async def enqueue(
+        self, key: str, payload: Dict[str, Any], url: Optional[str] = None, delay: float = 0.0, replace: bool = False
+    ) -> bool:
+        """Queue a callback under idempotency `key`.
+
+        Returns False if the key was delivered within the session TTL, or is
+        already queued and `replace` is not set. With `replace` a queued job
+        takes the new payload and starts over with fresh attempts (a delivery
+        already in flight still completes with the old payload).
+        """
+        now = time.time()
+        job = {"key": key, "payload": payload, "url": url, "attempts": 0, "created": now, "error": None}
+        if self._use_redis:
+            try:
+                ok = await self._enqueue_script(
+                    keys=[_job_key(key), PENDING_KEY, _done_key(key)],
+                    args=[json.dumps(job), now + delay, key, "1" if replace else "0"],
+                )
+                if ok == 2:
+                    logger.info("replaced queued callback for %s with a newer payload", key)
+                if ok:
+                    self._notify()
+                return bool(ok)
+            except Exception:
+                self._use_redis = False
+        if self._done.get(key, 0) > now:
+            return False
+        if key in self._jobs:
+            if not replace:
+                return False
+            logger.info("replaced queued callback for %s with a newer payload", key)
+        self._jobs[key] = job
+        self._schedule_in_memory(key, now + delay)
+        self._notify()
+        return True
+
+    async def claim_due(self, limit: int = RELAY_BATCH, now: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Lease and return up to `limit` jobs whose next attempt is due."""
+        now = time.time() if now is None else now
+        lease_until = now + OUTBOX_LEASE_SECONDS
+        if self._use_redis:
+            try:
+                keys = await self._claim_script(keys=[PENDING_KEY], args=[now, lease_until, limit])
+                if not keys:
+                    return []
+                raw = await self._r.mget([_job_key(k.decode() if isinstance(k, bytes) else k) for k in keys])
+                return [json.loads(v) for v in raw if v]
+            except Exception:
+                self._use_redis = False
+        claimed = []
+        while self._due_heap and len(claimed) < limit and self._due_heap[0][0] <= now:
+            at, key = heapq.heappop(self._due_heap)
+            if self._due.get(key) != at or key not in self._jobs:
+                continue
+            claimed.append(dict(self._jobs[key]))
+        for job in claimed:
+            self._schedule_in_memory(job["key"], lease_until)
+        return claimed
+
+    async def ack(self, job: Dict[str, Any]):
+        """Job delivered: drop it and remember the key as done."""
+        key = job["key"]
+        if self._use_redis:
+            try:
+                async with self._r.pipeline(transaction=True) as pipe:
+                    pipe.zrem(PENDING_KEY, key)
+                    pipe.delete(_job_key(key))
+                    pipe.set(_done_key(key), "1", ex=SESSION_TTL)
+                    await pipe.execute()
+                return
+            except Exception:
+                self._use_redis = False
+        self._jobs.pop(key, None)
+        self._due.pop(key, None)
+        self._remember_done(key, time.time())
+
+    async def fail(self, job: Dict[str, Any], error: Optional[str]) -> str:
+        """Record a failed attempt; returns "retry" or "dead"."""
+        key = job["key"]
+        job = dict(job, attempts=int(job.get("attempts", 0)) + 1, error=error)
+        dead = job["attempts"] >= self.max_attempts
+        next_at = time.time() + retry_delay(job["attempts"])
+        if self._use_redis:
+            try:
+                async with self._r.pipeline(transaction=True) as pipe:
+                    if dead:
+                        pipe.zrem(PENDING_KEY, key)
+                        pipe.delete(_job_key(key))
+                        pipe.hset(DEAD_KEY, key, json.dumps(job))
+                    else:
+                        pipe.set(_job_key(key), json.dumps(job))
+                        pipe.zadd(PENDING_KEY, {key: next_at})
+                    await pipe.execute()
+                return "dead" if dead else "retry"
+            except Exception:
+                self._use_redis = False
+        if dead:
+            self._jobs.pop(key, None)
+            self._due.pop(key, None)
+            self._dead[key] = job
+            return "dead"
+        self._jobs[key] = job
+        self._schedule_in_memory(key, next_at)
+        return "retry"
+
+    async def release(self, job: Dict[str, Any], delay: float = 0.0):
+        """Return a claimed job to the queue without counting an attempt."""
+        at = time.time() + delay
+        if self._use_redis:
+            try:
+                await self._r.zadd(PENDING_KEY, {job["key"]: at}, xx=True)
+                return
+            except Exception:
+                self._use_redis = False
+        if job["key"] in self._jobs:
+            self._schedule_in_memory(job["key"], at)
+
+    async def next_due(self) -> Optional[float]:
+        if self._use_redis:
+            try:
+                rows = await self._r.zrange(PENDING_KEY, 0, 0, withscores=True)
+                return float(rows[0][1]) if rows else None
+            except Exception:
+                self._use_redis = False
+        while self._due_heap and self._due.get(self._due_heap[0][1]) != self._due_heap[0][0]:
+            heapq.heappop(self._due_heap)
+        return self._due_heap[0][0] if self._due_heap else None
+
+    async def pending_count(self) -> int:
+        if self._use_redis:
+            try:
+                return int(await self._r.zcard(PENDING_KEY))
+            except Exception:
+                self._use_redis = False
+        return len(self._jobs)
+
+    async def dead_letters(self, limit: int = 100) -> List[Dict[str, Any]]:
+        if self._use_redis:
+            try:
+                out = []
+                async for _, v in self._r.hscan_iter(DEAD_KEY, count=limit):
+                    out.append(json.loads(v))
+                    if len(out) >= limit:
+                        break
+                return out
+            except Exception:
+                self._use_redis = False
+        return [dict(v) for v in list(self._dead.values())[:limit]]
+
+    async def replay(self, keys: Optional[List[str]] = None) -> int:
+        """Move dead letters (all, or the given keys) back onto the queue."""
+        if keys is None:
+            keys = [job["key"] for job in await self.dead_letters(limit=10 ** 6)]
+        replayed = 0
+        now = time.time()
+        for key in keys:
+            if self._use_redis:
+                try:
+                    v = await self._r.hget(DEAD_KEY, key)
+                    if not v:
+                        continue
+                    job = dict(json.loads(v), attempts=0, error=None)
+                    async with self._r.pipeline(transaction=True) as pipe:
+                        pipe.hdel(DEAD_KEY, key)
+                        pipe.set(_job_key(key), json.dumps(job))
+                        pipe.zadd(PENDING_KEY, {key: now})
+                        await pipe.execute()
+                    replayed += 1
+                    continue
+                except Exception:
+                    self._use_redis = False
+            job = self._dead.pop(key, None)
+            if job is None:
+                continue
+            self._jobs[key] = dict(job, attempts=0, error=None)
+            self._schedule_in_memory(key, now)
+            replayed += 1
+        if replayed:
+            self._notify()
+        return replayed
+
+    async def run_relay(
+        self,
+        stop_event: asyncio.Event,
+        dispatcher,
+        on_sent: Optional[Callable[[Dict[str, Any]], Awaitable[None]]] = None,
+        poll_interval: float = 10.0,
+    ):
+        """Feed due jobs to `dispatcher` until `stop_event` is set.
+
+        Delivery results are written back to the outbox (ack, or a failed
+        attempt with backoff), so retries are driven by the pending set
+        rather than by re-scanning sessions.
+        """
+        self._wake = asyncio.Event()
+
+        def done_hook(job):
+            async def done(result: Dict[str, Any]):
+                if result.get("status") == "sent":
+                    await self.ack(job)
+                    if on_sent is not None:
+                        await on_sent(job)
+                else:
+                    await self.fail(job, result.get("error"))
+                    self._notify()
+            return done
+
+        while not stop_event.is_set():
+            self._wake.clear()
+            try:
+                for job in await self.claim_due():
+                    if dispatcher.in_flight(job["key"]):
+                        continue
+                    if not dispatcher.submit(job["key"], job["payload"], done_hook(job), url=job.get("url")):
+                        # receiver host backed up; retry without burning an attempt
+                        await self.release(job, delay=poll_interval)
+            except Exception:
+                pass
+            timeout = poll_interval
+            try:
+                nxt = await self.next_due()
+                if nxt is not None:
+                    timeout = min(poll_interval, max(0.05, nxt - time.time()))
+            except Exception:
+                pass
+            waiters = [asyncio.ensure_future(stop_event.wait()), asyncio.ensure_future(self._wake.wait())]
+            try:
+                await asyncio.wait(waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                for w in waiters:
+                    w.cancel()
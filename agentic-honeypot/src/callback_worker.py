@@ -1,27 +1,245 @@
 import os
 import asyncio
 import httpx
-from typing import Dict, Any
+from collections import defaultdict, deque
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+from urllib.parse import urlparse
 
 GUVI_CALLBACK_URL = os.getenv("GUVI_CALLBACK_URL", "https://hackathon.guvi.in/api/updateHoneyPotFinalResult")
 CALLBACK_TIMEOUT = float(os.getenv("CALLBACK_TIMEOUT", "5"))
+CALLBACK_MAX_RETRIES = int(os.getenv("CALLBACK_MAX_RETRIES", "3"))
+CALLBACK_BACKOFF = float(os.getenv("CALLBACK_BACKOFF", "1"))
+# worker pool size, concurrent requests per callback host, and how many
+# callbacks may be queued for one host before new ones are refused
+CALLBACK_CONCURRENCY = int(os.getenv("CALLBACK_CONCURRENCY", "8"))
+CALLBACK_PER_HOST_LIMIT = int(os.getenv("CALLBACK_PER_HOST_LIMIT", "4"))
+CALLBACK_HOST_MAX_PENDING = int(os.getenv("CALLBACK_HOST_MAX_PENDING", "1000"))
+# shared client connection pool
+CALLBACK_HTTP2 = os.getenv("CALLBACK_HTTP2", "1") == "1"
+CALLBACK_MAX_CONNECTIONS = int(os.getenv("CALLBACK_MAX_CONNECTIONS", "100"))
+CALLBACK_MAX_KEEPALIVE = int(os.getenv("CALLBACK_MAX_KEEPALIVE", "20"))
+CALLBACK_KEEPALIVE_EXPIRY = float(os.getenv("CALLBACK_KEEPALIVE_EXPIRY", "30"))
 
+try:
+    import h2  # noqa: F401  (enables httpx HTTP/2 support)
+    http2_available = True
+except Exception:
+    http2_available = False
 
-async def send_final_callback(payload: Dict[str, Any], max_retries: int = 3) -> Dict[str, Any]:
-    attempt = 0
-    backoff = 1.0
-    last_exc = None
-    async with httpx.AsyncClient(timeout=CALLBACK_TIMEOUT) as client:
-        while attempt < max_retries:
+_client: Optional[httpx.AsyncClient] = None
+
+
+def _build_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        timeout=CALLBACK_TIMEOUT,
+        http2=CALLBACK_HTTP2 and http2_available,
+        limits=httpx.Limits(
+            max_connections=CALLBACK_MAX_CONNECTIONS,
+            max_keepalive_connections=CALLBACK_MAX_KEEPALIVE,
+            keepalive_expiry=CALLBACK_KEEPALIVE_EXPIRY,
+        ),
+    )
+
+
+async def start_http_client() -> httpx.AsyncClient:
+    """Create the shared keep-alive client; called from the app lifespan."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _build_client()
+    return _client
+
+
+async def close_http_client():
+    global _client
+    client, _client = _client, None
+    if client is not None:
+        await client.aclose()
+
+
+def get_http_client() -> httpx.AsyncClient:
+    # created on first use when running outside the app lifespan (scripts)
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _build_client()
+    return _client
+
+
+async def post_final_callback(payload: Dict[str, Any], url: Optional[str] = None) -> Dict[str, Any]:
+    """Single delivery attempt, no retries."""
+    try:
+        resp = await get_http_client().post(url or GUVI_CALLBACK_URL, json=payload)
+        if resp.status_code >= 200 and resp.status_code < 300:
+            return {"status": "sent", "status_code": resp.status_code, "response": resp.text}
+        return {"status": "failed", "error": f"Unexpected status {resp.status_code}"}
+    except Exception as e:
+        return {"status": "failed", "error": str(e)}
+
+
+class _Job:
+    __slots__ = ("key", "payload", "url", "host", "on_done", "attempt")
+
+    def __init__(self, key, payload, url, on_done):
+        self.key = key
+        self.payload = payload
+        self.url = url
+        self.host = urlparse(url).netloc
+        self.on_done = on_done
+        self.attempt = 0
+
+
+class CallbackDispatcher:
+    """Bounded-concurrency callback delivery.
+
+    A fixed pool of worker tasks delivers queued callbacks, at most
+    `per_host` at a time to any one host. Jobs for a host that is at its
+    limit wait in that host's own queue and only reach the workers once a
+    slot frees up, and failed attempts are re-queued after an exponential
+    backoff timer instead of sleeping inside a worker, so one slow or
+    failing receiver cannot stall the other callbacks.
+    `on_done(result)` is awaited once per job with the final result.
+    """
+
+    def __init__(
+        self,
+        send: Optional[Callable[[Dict[str, Any], str], Awaitable[Dict[str, Any]]]] = None,
+        concurrency: int = CALLBACK_CONCURRENCY,
+        per_host: int = CALLBACK_PER_HOST_LIMIT,
+        max_pending_per_host: int = CALLBACK_HOST_MAX_PENDING,
+        max_retries: int = CALLBACK_MAX_RETRIES,
+        backoff: float = CALLBACK_BACKOFF,
+    ):
+        self._send = send or post_final_callback
+        self.concurrency = max(1, concurrency)
+        self.per_host = max(1, per_host)
+        self.max_pending_per_host = max_pending_per_host
+        self.max_retries = max(1, max_retries)
+        self.backoff = backoff
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        # deliveries in progress per host, and jobs parked until it has room
+        self._active: Dict[str, int] = defaultdict(int)
+        self._parked: Dict[str, deque] = {}
+        self._pending: Dict[str, int] = defaultdict(int)
+        self._keys: Set[str] = set()
+        self._timers: Set[asyncio.TimerHandle] = set()
+        self._idle: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _ensure_started(self):
+        loop = asyncio.get_running_loop()
+        if self._queue is None or self._loop is not loop:
+            # (re)start on the running loop, e.g. after a lifespan restart
+            self._loop = loop
+            self._keys.clear()
+            self._pending.clear()
+            self._active.clear()
+            self._parked.clear()
+            self._queue = asyncio.Queue()
+            self._idle = asyncio.Event()
+            self._idle.set()
+            self._workers = [asyncio.ensure_future(self._worker()) for _ in range(self.concurrency)]
+
+    def in_flight(self, key: str) -> bool:
+        return key in self._keys
+
+    def submit(
+        self,
+        key: str,
+        payload: Dict[str, Any],
+        on_done: Optional[Callable[[Dict[str, Any]], Awaitable[None]]] = None,
+        url: Optional[str] = None,
+    ) -> bool:
+        """Queue a callback. Returns False if `key` is already in flight or
+        the target host has too many callbacks pending (backpressure)."""
+        self._ensure_started()
+        job = _Job(key, payload, url or GUVI_CALLBACK_URL, on_done)
+        if key in self._keys or self._pending[job.host] >= self.max_pending_per_host:
+            return False
+        self._keys.add(key)
+        self._pending[job.host] += 1
+        self._idle.clear()
+        self._enqueue(job)
+        return True
+
+    def _enqueue(self, job: _Job):
+        """Hand `job` to the workers if its host has a free slot, else park it."""
+        if self._active[job.host] < self.per_host:
+            self._active[job.host] += 1
+            self._queue.put_nowait(job)
+        else:
+            self._parked.setdefault(job.host, deque()).append(job)
+
+    def _release(self, host: str):
+        parked = self._parked.get(host)
+        if parked:
+            # the slot passes straight to the next parked job
+            self._queue.put_nowait(parked.popleft())
+            if not parked:
+                del self._parked[host]
+            return
+        self._active[host] -= 1
+        if self._active[host] <= 0:
+            del self._active[host]
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
             try:
-                resp = await client.post(GUVI_CALLBACK_URL, json=payload)
-                if resp.status_code >= 200 and resp.status_code < 300:
-                    return {"status": "sent", "status_code": resp.status_code, "response": resp.text}
-                else:
-                    last_exc = Exception(f"Unexpected status {resp.status_code}")
+                result = await self._send(job.payload, job.url)
             except Exception as e:
-                last_exc = e
-            attempt += 1
-            await asyncio.sleep(backoff)
-            backoff *= 2
-    return {"status": "failed", "error": str(last_exc)}
+                result = {"status": "failed", "error": str(e)}
+            finally:
+                self._release(job.host)
+            job.attempt += 1
+            if result.get("status") != "sent" and job.attempt < self.max_retries:
+                self._retry_later(job, self.backoff * (2 ** (job.attempt - 1)))
+            else:
+                await self._finish(job, result)
+            self._queue.task_done()
+
+    def _retry_later(self, job: _Job, delay: float):
+        loop = asyncio.get_running_loop()
+
+        def _requeue():
+            self._timers.discard(handle)
+            self._enqueue(job)
+
+        handle = loop.call_later(delay, _requeue)
+        self._timers.add(handle)
+
+    async def _finish(self, job: _Job, result: Dict[str, Any]):
+        if job.on_done is not None:
+            try:
+                await job.on_done(result)
+            except Exception:
+                pass
+        self._keys.discard(job.key)
+        self._pending[job.host] -= 1
+        if self._pending[job.host] <= 0:
+            del self._pending[job.host]
+        if not self._keys:
+            self._idle.set()
+
+    async def drain(self, timeout: Optional[float] = None):
+        """Wait until every submitted callback has finished (incl. retries)."""
+        if self._idle is not None:
+            await asyncio.wait_for(self._idle.wait(), timeout=timeout)
+
+    async def stop(self):
+        for handle in list(self._timers):
+            handle.cancel()
+        self._timers.clear()
+        for w in self._workers:
+            w.cancel()
+        for w in self._workers:
+            try:
+                await w
+            except (asyncio.CancelledError, Exception):
+                pass
+        self._workers = []
+        self._queue = None
+        self._idle = None
+        self._keys.clear()
+        self._pending.clear()
+        self._active.clear()
+        self._parked.clear()
@@ -0,0 +1,110 @@
+"""Value encoding for `SessionStore`.
+
+Every value the store writes starts with a one-byte format tag, so the
+codec can change without a flag day: values with no tag are `json.dumps`
+text written by older releases and are still read as JSON. Archive chunks
+carry a second tag for their compression.
+
+`STORE_CODEC` picks the format for new writes: `msgpack` (the default when
+the package is installed) or `json` (see `fastjson`). Every worker sharing
+a Redis must be able to read what the others write, so install the same
+extras everywhere before switching.
+"""
+import io
+import os
+import zlib
+from typing import Any, Iterable, List, Optional
+
+from . import fastjson
+
+try:
+    import msgpack
+except Exception:
+    msgpack = None
+
+try:
+    import zstandard
+except Exception:
+    zstandard = None
+
+TAG_JSON = 0x01
+TAG_MSGPACK = 0x02
+TAG_ZLIB = 0x10
+TAG_ZSTD = 0x11
+
+STORE_CODEC = os.getenv("STORE_CODEC", "msgpack" if msgpack is not None else "json").lower()
+STORE_COMPRESSION = os.getenv("STORE_COMPRESSION", "zstd" if zstandard is not None else "zlib").lower()
+
+
+def _bytes(raw) -> bytes:
+    return raw.encode() if isinstance(raw, str) else raw
+
+
+def encode(value: Any) -> bytes:
+    if STORE_CODEC == "msgpack" and msgpack is not None:
+        return bytes((TAG_MSGPACK,)) + msgpack.packb(value, use_bin_type=True, default=str)
+    return bytes((TAG_JSON,)) + fastjson.dumps(value, default=str)
+
+
+def decode(raw) -> Any:
+    """Decode one stored value; None and empty values decode to None."""
+    if not raw:
+        return None
+    raw = _bytes(raw)
+    tag = raw[0]
+    if tag == TAG_JSON:
+        return fastjson.loads(raw[1:])
+    if tag == TAG_MSGPACK:
+        if msgpack is None:
+            raise RuntimeError("msgpack-encoded session data but msgpack is not installed")
+        return msgpack.unpackb(raw[1:], raw=False)
+    # untagged: legacy JSON text
+    return fastjson.loads(raw)
+
+
+def decode_many(items: Optional[Iterable[Any]]) -> List[Any]:
+    """Decode a batch of stored values, e.g. an `LRANGE` reply.
+
+    Batches in a single format are decoded with one parser call: JSON
+    values are joined into one array, msgpack values streamed through one
+    unpacker. Mixed batches (mid-migration) fall back to one call per item.
+    """
+    raw = [_bytes(x) for x in items or [] if x]
+    if not raw:
+        return []
+    tags = {x[0] for x in raw}
+    if tags == {TAG_MSGPACK} and msgpack is not None:
+        unpacker = msgpack.Unpacker(io.BytesIO(b"".join(x[1:] for x in raw)), raw=False)
+        return list(unpacker)
+    if TAG_MSGPACK not in tags:
+        payloads = [x[1:] if x[0] == TAG_JSON else x for x in raw]
+        return fastjson.loads(b"[" + b",".join(payloads) + b"]")
+    return [decode(x) for x in raw]
+
+
+def compress(data: bytes) -> bytes:
+    if STORE_COMPRESSION == "zstd" and zstandard is not None:
+        return bytes((TAG_ZSTD,)) + zstandard.ZstdCompressor().compress(data)
+    return bytes((TAG_ZLIB,)) + zlib.compress(data)
+
+
+def decompress(blob) -> bytes:
+    blob = _bytes(blob)
+    tag = blob[0]
+    if tag == TAG_ZSTD:
+        if zstandard is None:
+            raise RuntimeError("zstd-compressed session data but zstandard is not installed")
+        return zstandard.ZstdDecompressor().decompress(blob[1:])
+    if tag == TAG_ZLIB:
+        return zlib.decompress(blob[1:])
+    # untagged: a bare zlib stream of JSON
+    return zlib.decompress(blob)
+
+
+def encode_chunk(values: List[Any]) -> bytes:
+    """A compressed archive chunk holding `values`."""
+    return compress(encode(values))
+
+
+def decode_chunk(blob) -> List[Any]:
+    return decode(decompress(blob)) or []
@@ -0,0 +1,34 @@
+"""JSON encoding for request bodies, responses and stored values.
+
+Uses orjson when installed and the stdlib `json` module otherwise; both
+produce compact UTF-8 output, so callers see the same bytes either way
+(apart from orjson also accepting datetimes and non-string dict keys).
+"""
+import json
+from typing import Any, Callable, Optional
+
+from starlette.responses import JSONResponse
+
+try:
+    import orjson
+except Exception:
+    orjson = None
+
+
+def dumps(value: Any, default: Optional[Callable[[Any], Any]] = None) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value, default=default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=default).encode("utf-8")
+
+
+def loads(data) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class FastJSONResponse(JSONResponse):
+    """`JSONResponse` rendered with `dumps`; the app's default response class."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
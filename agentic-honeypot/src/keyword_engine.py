@@ -0,0 +1,124 @@
+"""Single-pass multi-keyword matcher (Aho-Corasick).
+
+The detector used to test every entry of `SCAM_KEYWORDS` with a separate
+substring search, so its cost grew with the size of the keyword list. The
+automaton built here finds every (possibly overlapping) keyword hit in one
+pass over the lowercased text, independent of how many keywords are loaded.
+"""
+import threading
+from collections import deque
+from typing import Dict, Iterable, List, Mapping, NamedTuple, Optional, Union
+
+KeywordSpec = Union[Mapping[str, float], Iterable[str]]
+
+
+class KeywordMatch(NamedTuple):
+    keyword: str
+    start: int
+    end: int
+    weight: float
+
+
+class _Automaton:
+    def __init__(self, weights: Dict[str, float]):
+        self.keywords: List[str] = list(weights)
+        self.weights = weights
+        self.rank = {k: i for i, k in enumerate(self.keywords)}
+        # goto[state] maps a character to the next state; out[state] lists
+        # the keywords ending at that state (including suffix outputs)
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.out: List[List[str]] = [[]]
+        for kw in self.keywords:
+            state = 0
+            for ch in kw:
+                nxt = self.goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[state][ch] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append([])
+                state = nxt
+            self.out[state].append(kw)
+
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self.goto[state].items():
+                queue.append(nxt)
+                f = self.fail[state]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                target = self.goto[f].get(ch, 0)
+                self.fail[nxt] = target if target != nxt else 0
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+
+    def scan(self, lowered: str) -> List[KeywordMatch]:
+        goto, fail, out, weights = self.goto, self.fail, self.out, self.weights
+        matches: List[KeywordMatch] = []
+        state = 0
+        for i, ch in enumerate(lowered):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                for kw in out[state]:
+                    matches.append(KeywordMatch(kw, i + 1 - len(kw), i + 1, weights[kw]))
+        return matches
+
+
+def _normalize(keywords: KeywordSpec) -> Dict[str, float]:
+    if isinstance(keywords, Mapping):
+        items = keywords.items()
+    else:
+        items = ((k, 1.0) for k in keywords)
+    weights: Dict[str, float] = {}
+    for k, w in items:
+        k = str(k).strip().lower()
+        if k and k not in weights:
+            weights[k] = float(w)
+    return weights
+
+
+class KeywordEngine:
+    """Weighted keyword matcher that can be reloaded at runtime.
+
+    `keywords` is either a list of keywords (weight 1.0 each) or a mapping of
+    keyword -> weight. Matching is case-insensitive; match positions index
+    into `text.lower()`.
+    """
+
+    def __init__(self, keywords: KeywordSpec = ()):
+        self._lock = threading.Lock()
+        self._automaton = _Automaton(_normalize(keywords))
+
+    def reload(self, keywords: KeywordSpec) -> None:
+        # build outside the lock; readers keep using the old automaton until
+        # the reference is swapped
+        automaton = _Automaton(_normalize(keywords))
+        with self._lock:
+            self._automaton = automaton
+
+    @property
+    def keywords(self) -> List[str]:
+        return list(self._automaton.keywords)
+
+    def scan(self, text: str, lowered: Optional[str] = None) -> List[KeywordMatch]:
+        """Return every keyword hit in `text`, ordered by end position."""
+        if lowered is None:
+            lowered = text.lower()
+        return self._automaton.scan(lowered)
+
+    def matched(self, text: str = "", matches: Optional[List[KeywordMatch]] = None) -> List[str]:
+        """Unique matched keywords, in the order they were configured."""
+        if matches is None:
+            matches = self.scan(text)
+        rank = self._automaton.rank
+        return sorted({m.keyword for m in matches}, key=lambda k: rank.get(k, len(rank)))
+
+    def score(self, text: str = "", matches: Optional[List[KeywordMatch]] = None) -> float:
+        """Sum of the weights of the distinct keywords found."""
+        if matches is None:
+            matches = self.scan(text)
+        return sum({m.keyword: m.weight for m in matches}.values())
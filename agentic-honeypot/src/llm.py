@@ -0,0 +1,459 @@
+"""LLM backends for the agent's replies.
+
+A backend turns a chat message list into reply text. Calls are made with the
+provider's native async client (no executor threads), are bounded by a
+per-backend concurrency limit, and are cancelled, not abandoned, when they
+exceed their timeout. Any failure returns None so the agent can fall back
+to its canned replies.
+
+Provider SDKs (openai, transformers/torch) are imported only when a backend
+that needs them is configured and first used, so workers that run without
+them do not pay their import time or memory.
+"""
+import abc
+import asyncio
+import importlib.util
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple
+
+try:
+    import httpx
+except Exception:
+    httpx = None
+
+
+logger = logging.getLogger("agentic-honeypot")
+
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+# "openai", "local", "mock" (canned replies only); unset picks openai when a key is set
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "").lower()
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-3.5-turbo")
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "15"))
+# concurrent requests per backend; callers beyond this wait (within the timeout)
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "16"))
+# streaming replies give up when no token arrives for this long
+LLM_STREAM_STALL = float(os.getenv("LLM_STREAM_STALL", "3"))
+# hedging: a second request is sent when the first is slower than the
+# backend's recent p95 (or LLM_HEDGE_DELAY until enough calls are recorded)
+LLM_HEDGE = os.getenv("LLM_HEDGE", "0") == "1"
+LLM_HEDGE_DELAY = float(os.getenv("LLM_HEDGE_DELAY", "2"))
+LLM_HEDGE_QUANTILE = float(os.getenv("LLM_HEDGE_QUANTILE", "0.95"))
+LLM_LATENCY_WINDOW = int(os.getenv("LLM_LATENCY_WINDOW", "200"))
+
+# local in-process model (LLM_PROVIDER=local)
+LOCAL_LLM_MODEL = os.getenv("LOCAL_LLM_MODEL", "gpt2")
+# prompts arriving within this window are generated as one batch
+LOCAL_LLM_BATCH_WINDOW_MS = float(os.getenv("LOCAL_LLM_BATCH_WINDOW_MS", "5"))
+LOCAL_LLM_MAX_BATCH = int(os.getenv("LOCAL_LLM_MAX_BATCH", "8"))
+LOCAL_LLM_THREADS = int(os.getenv("LOCAL_LLM_THREADS", "0"))
+
+Messages = List[Dict[str, str]]
+
+
+def _installed(module: str) -> bool:
+    """Whether `module` can be imported, without importing it."""
+    try:
+        return importlib.util.find_spec(module) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+class LatencyWindow:
+    """Rolling window of recent call durations."""
+
+    def __init__(self, size: int = LLM_LATENCY_WINDOW, min_samples: int = 20):
+        self._samples: deque = deque(maxlen=max(1, size))
+        self.min_samples = min_samples
+
+    def record(self, seconds: float):
+        self._samples.append(seconds)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """The q-quantile of the window, or None with too few samples."""
+        if len(self._samples) < self.min_samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class LLMBackend(abc.ABC):
+    """Base class: subclasses implement `_complete` and optionally `_stream`."""
+
+    name = "base"
+
+    def __init__(self, concurrency: int = LLM_CONCURRENCY, timeout: float = LLM_TIMEOUT):
+        self.concurrency = max(1, concurrency)
+        self.timeout = timeout
+        self._sem: Optional[asyncio.Semaphore] = None
+        self._loop = None
+        self.latency = LatencyWindow()
+
+    @property
+    def available(self) -> bool:
+        return True
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if self._sem is None or self._loop is not loop:
+            self._sem = asyncio.Semaphore(self.concurrency)
+            self._loop = loop
+        return self._sem
+
+    @abc.abstractmethod
+    async def _complete(self, messages: Messages, max_tokens: int, temperature: float) -> Optional[str]:
+        """One reply for `messages`; called under the concurrency limit."""
+
+    async def _limited(self, messages: Messages, max_tokens: int, temperature: float) -> Optional[str]:
+        async with self._semaphore():
+            return await self._complete(messages, max_tokens, temperature)
+
+    async def complete(
+        self, messages: Messages, max_tokens: int = 100, temperature: float = 0.9, timeout: Optional[float] = None
+    ) -> Optional[str]:
+        """Reply text, or None on error or timeout.
+
+        The timeout covers waiting for a concurrency slot as well as the
+        call itself; on expiry the in-flight request is cancelled.
+        """
+        if not self.available:
+            return None
+        start = time.monotonic()
+        try:
+            text = await asyncio.wait_for(
+                self._limited(messages, max_tokens, temperature),
+                timeout=self.timeout if timeout is None else timeout,
+            )
+            if text:
+                self.latency.record(time.monotonic() - start)
+            return text
+        except asyncio.TimeoutError:
+            return None
+        except Exception:
+            return None
+
+    def hedge_delay(self) -> float:
+        """How long to wait on a call before sending a hedged duplicate."""
+        p = self.latency.quantile(LLM_HEDGE_QUANTILE)
+        return LLM_HEDGE_DELAY if p is None else p
+
+    async def _stream(self, messages: Messages, max_tokens: int, temperature: float) -> AsyncIterator[str]:
+        # backends without native streaming produce the reply as one chunk
+        text = await self._complete(messages, max_tokens, temperature)
+        if text:
+            yield text
+
+    async def stream(self, messages: Messages, max_tokens: int = 100, temperature: float = 0.9) -> AsyncIterator[str]:
+        """Reply text in chunks as the backend produces it.
+
+        Holds a concurrency slot until exhausted or closed. Errors propagate;
+        the caller applies its own stall timeout and closes the iterator.
+        """
+        if not self.available:
+            return
+        async with self._semaphore():
+            async for chunk in self._stream(messages, max_tokens, temperature):
+                yield chunk
+
+    async def start(self):
+        """Prepare the backend (load models, warm connections)."""
+
+    async def aclose(self):
+        pass
+
+
+class OpenAIBackend(LLMBackend):
+    """OpenAI chat completions over a pooled keep-alive connection.
+
+    Uses `AsyncOpenAI` (openai>=1) or `ChatCompletion.acreate` on the legacy
+    SDK. The client is created on first use and rebuilt if the event loop
+    changes, since its connection pool is bound to the loop; the replaced
+    client is closed on the loop it was created on.
+    """
+
+    name = "openai"
+
+    def __init__(self, api_key: Optional[str] = OPENAI_API_KEY, model: str = LLM_MODEL, **kwargs):
+        super().__init__(**kwargs)
+        self.api_key = api_key
+        self.model = model
+        self._client = None
+        self._client_loop = None
+        # closes of clients replaced after a loop change
+        self._retiring: Set[asyncio.Future] = set()
+        self._sdk = None
+        self._installed = _installed("openai")
+
+    @property
+    def available(self) -> bool:
+        return self._installed and bool(self.api_key)
+
+    def _openai(self):
+        if self._sdk is None:
+            import openai
+
+            self._sdk = openai
+        return self._sdk
+
+    @staticmethod
+    async def _close_client(client):
+        try:
+            await client.close()
+        except Exception:
+            pass
+
+    def _retire_client(self, client, loop):
+        """Close `client` (and its pool) on `loop`, or here if that loop is gone."""
+        if loop is not None and loop.is_running() and not loop.is_closed():
+            asyncio.run_coroutine_threadsafe(self._close_client(client), loop)
+            return
+        task = asyncio.ensure_future(self._close_client(client))
+        self._retiring.add(task)
+        task.add_done_callback(self._retiring.discard)
+
+    def _get_client(self):
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client_loop is not loop:
+            if self._client is not None:
+                self._retire_client(self._client, self._client_loop)
+            http_client = None
+            if httpx is not None:
+                http_client = httpx.AsyncClient(
+                    limits=httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency),
+                    timeout=self.timeout,
+                )
+            # retries are left to the caller's fallback; a retry would only
+            # eat into the same timeout
+            self._client = self._openai().AsyncOpenAI(
+                api_key=self.api_key, http_client=http_client, max_retries=0, timeout=self.timeout
+            )
+            self._client_loop = loop
+        return self._client
+
+    async def _complete(self, messages: Messages, max_tokens: int, temperature: float) -> Optional[str]:
+        openai = self._openai()
+        if hasattr(openai, "AsyncOpenAI"):
+            resp = await self._get_client().chat.completions.create(
+                model=self.model, messages=messages, max_tokens=max_tokens, temperature=temperature
+            )
+        else:
+            resp = await openai.ChatCompletion.acreate(
+                model=self.model, messages=messages, max_tokens=max_tokens, temperature=temperature,
+                api_key=self.api_key, request_timeout=self.timeout,
+            )
+        content = resp.choices[0].message.content
+        return content.strip() if content else None
+
+    async def _stream(self, messages: Messages, max_tokens: int, temperature: float) -> AsyncIterator[str]:
+        openai = self._openai()
+        if hasattr(openai, "AsyncOpenAI"):
+            chunks = await self._get_client().chat.completions.create(
+                model=self.model, messages=messages, max_tokens=max_tokens, temperature=temperature, stream=True
+            )
+            async for chunk in chunks:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    yield delta
+        else:
+            chunks = await openai.ChatCompletion.acreate(
+                model=self.model, messages=messages, max_tokens=max_tokens, temperature=temperature,
+                api_key=self.api_key, request_timeout=self.timeout, stream=True,
+            )
+            async for chunk in chunks:
+                delta = chunk.choices[0].delta.get("content") if chunk.choices else None
+                if delta:
+                    yield delta
+
+    async def aclose(self):
+        client, self._client = self._client, None
+        if client is not None:
+            await self._close_client(client)
+        loop = asyncio.get_running_loop()
+        retiring = [t for t in self._retiring if t.get_loop() is loop]
+        if retiring:
+            await asyncio.gather(*retiring)
+
+
+class _LocalRequest:
+    __slots__ = ("prompt", "max_tokens", "temperature", "future", "loop")
+
+    def __init__(self, prompt: str, max_tokens: int, temperature: float, future: asyncio.Future, loop):
+        self.prompt = prompt
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.future = future
+        self.loop = loop
+
+
+def _resolve(fut: asyncio.Future, text: Optional[str], error: Optional[BaseException]):
+    if fut.done():
+        return
+    if error is not None:
+        fut.set_exception(error)
+    else:
+        fut.set_result(text)
+
+
+def _post(req: _LocalRequest, text: Optional[str], error: Optional[BaseException] = None):
+    # called from the worker thread; the requesting loop may be gone
+    try:
+        req.loop.call_soon_threadsafe(_resolve, req.future, text, error)
+    except RuntimeError:
+        pass
+
+
+class LocalLLMBackend(LLMBackend):
+    """A small causal LM run in-process on CPU with `transformers`.
+
+    The model is loaded once by a dedicated worker thread when the backend
+    starts and stays resident. Prompts are queued to that thread, which
+    waits up to `batch_window_ms` after the first prompt for others and
+    generates them together in one padded batch, so concurrent replies
+    share a forward pass instead of running one after another. The event
+    loop only awaits futures.
+    """
+
+    name = "local"
+    # prompts longer than this keep their end: the newest messages and the
+    # "Martha:" cue the reply is generated from
+    max_prompt_tokens = 512
+
+    def __init__(
+        self,
+        model_name: str = LOCAL_LLM_MODEL,
+        batch_window_ms: float = LOCAL_LLM_BATCH_WINDOW_MS,
+        max_batch: int = LOCAL_LLM_MAX_BATCH,
+        threads: int = LOCAL_LLM_THREADS,
+        **kwargs,
+    ):
+        kwargs.setdefault("concurrency", max(1, max_batch) * 2)
+        super().__init__(**kwargs)
+        self.model_name = model_name
+        self.batch_window = batch_window_ms / 1000.0
+        self.max_batch = max(1, max_batch)
+        self.threads = threads
+        self._queue: "queue.Queue[Optional[_LocalRequest]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._model: Optional[Tuple[Any, Any]] = None
+        self._failed = False
+        self._installed = _installed("transformers")
+
+    @property
+    def available(self) -> bool:
+        return self._installed and not self._failed
+
+    def _load(self) -> Tuple[Any, Any]:
+        import torch
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+
+        if self.threads > 0:
+            torch.set_num_threads(self.threads)
+        tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+        # decoder-only models generate after the prompt, so pad on the left,
+        # and truncate on the left so the prompt still ends at the cue
+        tokenizer.padding_side = "left"
+        tokenizer.truncation_side = "left"
+        if tokenizer.pad_token is None:
+            tokenizer.pad_token = tokenizer.eos_token
+        model = AutoModelForCausalLM.from_pretrained(self.model_name)
+        model.to("cpu")
+        model.eval()
+        return tokenizer, model
+
+    def _generate_batch(self, prompts: List[str], max_tokens: int, temperature: float) -> List[str]:
+        import torch
+
+        tokenizer, model = self._model
+        enc = tokenizer(prompts, return_tensors="pt", padding=True, truncation=True, max_length=self.max_prompt_tokens)
+        sampling = {"do_sample": True, "temperature": temperature} if temperature > 0 else {"do_sample": False}
+        with torch.no_grad():
+            out = model.generate(**enc, max_new_tokens=max_tokens, pad_token_id=tokenizer.pad_token_id, **sampling)
+        # keep only the generated continuation of each prompt
+        new_tokens = out[:, enc["input_ids"].shape[1]:]
+        return [t.split("\n")[0].strip() for t in tokenizer.batch_decode(new_tokens, skip_special_tokens=True)]
+
+    def _take_batch(self, first: _LocalRequest) -> List[_LocalRequest]:
+        batch = [first]
+        deadline = time.monotonic() + self.batch_window
+        while len(batch) < self.max_batch:
+            wait = deadline - time.monotonic()
+            try:
+                req = self._queue.get(timeout=wait) if wait > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if req is None:
+                # keep the stop marker for the main loop
+                self._queue.put(None)
+                break
+            batch.append(req)
+        return batch
+
+    def _worker(self):
+        try:
+            self._model = self._load()
+            # one tiny generation so the first real request does not pay
+            # for lazy initialisation inside the model
+            self._generate_batch(["Hello"], 1, 0.0)
+        except Exception as e:
+            logger.error("local LLM %s failed to load: %s", self.model_name, e)
+            self._failed = True
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = [r for r in self._take_batch(first) if not r.future.cancelled()]
+            if self._failed:
+                for r in batch:
+                    _post(r, None)
+                continue
+            groups: Dict[Tuple[int, float], List[_LocalRequest]] = {}
+            for r in batch:
+                groups.setdefault((r.max_tokens, r.temperature), []).append(r)
+            for (max_tokens, temperature), reqs in groups.items():
+                try:
+                    texts = self._generate_batch([r.prompt for r in reqs], max_tokens, temperature)
+                    for r, text in zip(reqs, texts):
+                        _post(r, text or None)
+                except Exception as e:
+                    for r in reqs:
+                        _post(r, None, e)
+
+    async def start(self):
+        if self._thread is None and self.available:
+            self._thread = threading.Thread(target=self._worker, name="local-llm", daemon=True)
+            self._thread.start()
+
+    def _prompt(self, messages: Messages) -> str:
+        system = "\n".join(m["content"] for m in messages if m.get("role") == "system")
+        user = "\n".join(m["content"] for m in messages if m.get("role") != "system")
+        return f"{system}\n\n{user}\nMartha:"
+
+    async def _complete(self, messages: Messages, max_tokens: int, temperature: float) -> Optional[str]:
+        if self._thread is None:
+            await self.start()
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._queue.put(_LocalRequest(self._prompt(messages), max_tokens, temperature, fut, loop))
+        # a timeout cancels `fut`; the worker skips cancelled requests
+        return await fut
+
+    async def aclose(self):
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            await asyncio.get_running_loop().run_in_executor(None, thread.join, 10)
+
+
+def get_backend(provider: str = LLM_PROVIDER, api_key: Optional[str] = OPENAI_API_KEY) -> Optional[LLMBackend]:
+    """Backend for `provider`, or None to use canned replies only."""
+    if provider == "mock":
+        return None
+    if provider == "local":
+        return LocalLLMBackend()
+    if provider in ("", "openai") and api_key:
+        return OpenAIBackend(api_key)
+    return None
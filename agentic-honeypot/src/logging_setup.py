@@ -0,0 +1,121 @@
+"""Non-blocking structured logging.
+
+Records are put on a bounded in-memory queue by a `QueueHandler` and
+written to stdout by a `QueueListener` thread, so the event loop never waits
+on log I/O. When the queue is full records are dropped (and counted) rather
+than blocking the request. With `LOG_FORMAT=json` each line is a JSON object
+that includes any `extra={...}` fields passed to the logger.
+
+The app lifespan starts the writer with `configure_logging` and stops it
+with `stop_logging`; the queue outlives the writer, so records logged while
+it is stopped are written once it starts again.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+from typing import Optional, Union
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# fraction of request bodies logged at DEBUG, and the size cap per body
+LOG_BODY_SAMPLE_RATE = float(os.getenv("LOG_BODY_SAMPLE_RATE", "0.01"))
+LOG_BODY_MAX_BYTES = int(os.getenv("LOG_BODY_MAX_BYTES", "2048"))
+
+TEXT_FORMAT = "%(asctime)s %(levelname)s [%(name)s] %(message)s"
+
+# attributes every LogRecord has; anything else came in through `extra`
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        out = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for k, v in vars(record).items():
+            if k not in _RECORD_ATTRS and not k.startswith("_"):
+                out[k] = v
+        if record.exc_text:
+            out["exc"] = record.exc_text
+        elif record.exc_info:
+            out["exc"] = self.formatException(record.exc_info)
+        return json.dumps(out, default=str)
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Enqueue without blocking; drop records when the queue is full."""
+
+    dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # merge args here but leave formatting to the listener thread
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            type(self).dropped += 1
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def configure_logging(level: Union[str, int] = LOG_LEVEL, fmt: str = LOG_FORMAT):
+    """Route the root logger through the queue and start the writer thread.
+
+    Does nothing while the writer is running; after `stop_logging` it
+    starts a new writer on the existing queue.
+    """
+    global _listener
+    if _listener is not None:
+        return
+    root = logging.getLogger()
+    handler = next((h for h in root.handlers if isinstance(h, _DroppingQueueHandler)), None)
+    if handler is None:
+        handler = _DroppingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+        root.handlers = [handler]
+    root.setLevel(level)
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT))
+    _listener = logging.handlers.QueueListener(handler.queue, stream, respect_handler_level=True)
+    _listener.start()
+
+
+def stop_logging():
+    """Flush queued records and stop the writer thread."""
+    global _listener
+    listener, _listener = _listener, None
+    if listener is not None:
+        listener.stop()
+
+
+atexit.register(stop_logging)
+
+
+def sample_body(body: Union[bytes, str], logger: logging.Logger) -> Optional[str]:
+    """Size-capped body text for a sampled DEBUG log line, or None to skip."""
+    if not logger.isEnabledFor(logging.DEBUG) or random.random() >= LOG_BODY_SAMPLE_RATE:
+        return None
+    if isinstance(body, bytes):
+        text = body[:LOG_BODY_MAX_BYTES].decode("utf-8", "replace")
+    else:
+        text = body[:LOG_BODY_MAX_BYTES]
+    if len(body) > LOG_BODY_MAX_BYTES:
+        text += f"...[{len(body) - LOG_BODY_MAX_BYTES} more]"
+    return text
@@ -1,39 +1,53 @@
-from fastapi import FastAPI, Header, HTTPException, Request
-from starlette.responses import JSONResponse
+from fastapi import FastAPI, Header, HTTPException, Query, Request
+from starlette.responses import StreamingResponse
 from starlette.requests import Request as StarletteRequest
 from starlette.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import List, Dict, Any, Optional, Union
+from typing import List, Dict, Any, Optional, Set, Union
 from datetime import datetime
 import os
-import json
 import re
+import hashlib
 import asyncio
 from contextlib import asynccontextmanager
 
+from .fastjson import FastJSONResponse
+from . import fastjson
 from .session_store import SessionStore
-from .agent import AgentOrchestrator
-from .callback_worker import send_final_callback
-from .auto_finalizer import start_background_loop
+from .keyword_engine import KeywordEngine
+from .agent import AgentOrchestrator, CONTEXT_MESSAGES
+from .callback_worker import post_final_callback, start_http_client, close_http_client
+from .auto_finalizer import start_background_loop, next_finalize_due, notify_due
+from .auto_finalizer import outbox as callback_outbox
+from .callback_outbox import retry_delay
 from .auth import check_api_key, rate_limit_ok
-from .auth import set_api_keys
-from prometheus_client import make_asgi_app, Counter, Summary
+from .auth import set_api_keys, key_verifier
+from .logging_setup import configure_logging, stop_logging, sample_body
+from .metrics import EVENT_TIERS, StageTimer, observe_request
+from prometheus_client import make_asgi_app
 import time
 import logging
 
-# configure structured logging
-logging.basicConfig(
-    level=os.getenv("LOG_LEVEL", "INFO"),
-    format="%(asctime)s %(levelname)s [%(name)s] %(message)s",
-)
+# structured logging through a background writer thread (see logging_setup)
+configure_logging()
 logger = logging.getLogger("agentic-honeypot")
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    # (re)start the log writer; a previous lifespan cycle stopped it
+    configure_logging()
     # start auto-finalizer background task (free-mode)
     loop = asyncio.get_event_loop()
-    stop_event, task = start_background_loop(loop)
+    # shared keep-alive HTTP client for outbound callbacks
+    await start_http_client()
+    # warm the API key cache and subscribe to key rotations
+    await key_verifier.start()
+    # load a local model once, before traffic arrives
+    await agent.start()
+    # write-behind flusher (STORE_WRITE_BEHIND)
+    await session_store.start()
+    stop_event, task = start_background_loop(loop, session_store)
     try:
         yield
     finally:
@@ -42,9 +56,17 @@ async def lifespan(app: FastAPI):
             await task
         except Exception:
             pass
+        await _settle_stream_writes()
+        await _settle_light_writes()
+        # force out anything still buffered before the process exits
+        await session_store.aclose()
+        await key_verifier.stop()
+        await agent.aclose()
+        await close_http_client()
+        stop_logging()
 
 
-app = FastAPI(title="Agentic Honey-Pot Prototype", lifespan=lifespan)
+app = FastAPI(title="Agentic Honey-Pot Prototype", lifespan=lifespan, default_response_class=FastJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -54,32 +76,29 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Prometheus metrics
-REQUESTS = Counter("honeypot_requests_total", "Total requests", ["endpoint", "method", "status"])
-LATENCY = Summary("honeypot_request_latency_seconds", "Request latency in seconds")
-
-# mount metrics endpoint
+# mount Prometheus metrics endpoint (metric definitions live in metrics.py)
 app.mount("/metrics", make_asgi_app())
 
 
 @app.middleware("http")
 async def debug_logging_middleware(request: Request, call_next):
-    # Log the raw request details immediately
-    print(f"INCOMING REQUEST: {request.method} {request.url}")
-    # print(f"HEADERS: {dict(request.headers)}") 
-    
     start = time.perf_counter()
     try:
         resp = await call_next(request)
         status = str(resp.status_code)
-    except Exception as e:
+    except Exception:
         status = "500"
-        print(f"REQUEST CRASHED: {e}")
+        logger.exception("request crashed", extra={"method": request.method, "path": request.url.path})
         raise
     finally:
         elapsed = time.perf_counter() - start
-        LATENCY.observe(elapsed)
-        REQUESTS.labels(endpoint=request.url.path, method=request.method, status=status).inc()
+        observe_request(request, status, elapsed)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "request",
+                extra={"method": request.method, "path": request.url.path, "status": status,
+                       "durationMs": round(elapsed * 1000, 1)},
+            )
     return resp
 
 API_KEY = os.getenv("BACKEND_API_KEY", os.getenv("API_KEY", "default-dev-key"))
@@ -104,15 +123,12 @@ class Event(BaseModel):
 
 # Custom Validation Error Handler
 from fastapi.exceptions import RequestValidationError
-from fastapi.responses import JSONResponse
 
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
-    import logging
-    logger = logging.getLogger("agentic-honeypot")
     body = await request.body()
-    logger.error(f"Validation Error: {exc.errors()} | Body: {body.decode('utf-8')}")
-    return JSONResponse(
+    logger.warning("validation error: %s", exc.errors(), extra={"body": sample_body(body, logger)})
+    return FastJSONResponse(
         status_code=422,
         content={"detail": exc.errors(), "body": body.decode('utf-8')},
     )
@@ -127,12 +143,18 @@ SCAM_KEYWORDS = [
     "verify", "account blocked", "will be blocked", "upi id", "share your", "bank account",
     "suspend", "suspension", "immediately", "urgent", "verify now", "password",
 ]
+keyword_engine = KeywordEngine(SCAM_KEYWORDS)
 
 UPI_RE = re.compile(r"\b[\w.-]{2,}@[a-zA-Z]{2,}\b")
 PHONE_RE = re.compile(r"(?:\+?\d{1,3}[\s-]?)?(?:\d{10}|\d{3}[\s-]\d{3}[\s-]\d{4})")
 URL_RE = re.compile(r"https?://[\w./?=&%-]+|www\.[\w./?=&%-]+")
 ACC_RE = re.compile(r"\b\d{6,20}\b")
 
+# benign messages in never-flagged sessions take the light tier
+LIGHT_TIER_ENABLED = os.getenv("LIGHT_TIER_ENABLED", "1") == "1"
+
+INTEL_KEYS = ["bankAccounts", "upiIds", "phishingLinks", "phoneNumbers", "suspiciousKeywords"]
+
 
 def normalize_timestamp(ts: Union[datetime, int, float, str, None]) -> datetime:
     if ts is None:
@@ -155,14 +177,16 @@ def normalize_timestamp(ts: Union[datetime, int, float, str, None]) -> datetime:
     return datetime.utcnow()
 
 
-def detect_scam(text: str) -> Dict[str, Any]:
-    t = text.lower()
-    matched = [k for k in SCAM_KEYWORDS if k in t]
+def detect_scam(text: str, matches=None) -> Dict[str, Any]:
+    # `matches` lets callers reuse hits from a single scan of a larger text
+    if matches is None:
+        matches = keyword_engine.scan(text)
+    matched = keyword_engine.matched(matches=matches)
     scam = len(matched) > 0
-    return {"scam": scam, "matched_keywords": matched}
+    return {"scam": scam, "matched_keywords": matched, "score": keyword_engine.score(matches=matches)}
 
 
-def extract_from_text(text: str) -> Dict[str, List[str]]:
+def extract_from_text(text: str, matches=None) -> Dict[str, List[str]]:
     upis = list(set(UPI_RE.findall(text)))
     phones = list(set(PHONE_RE.findall(text)))
     urls = list(set(URL_RE.findall(text)))
@@ -170,7 +194,7 @@ def extract_from_text(text: str) -> Dict[str, List[str]]:
     accounts = [a for a in accounts if len(a) >= 8]
     
     # Extract suspicious keywords from the text as well
-    matched_keywords = [k for k in SCAM_KEYWORDS if k in text.lower()]
+    matched_keywords = keyword_engine.matched(text, matches)
     
     return {
         "bankAccounts": accounts,
@@ -181,13 +205,53 @@ def extract_from_text(text: str) -> Dict[str, List[str]]:
     }
 
 
+def extract_from_messages(texts: List[str]) -> Dict[str, List[str]]:
+    """Union of `extract_from_text` over each message.
+
+    Messages are scanned one at a time so the result does not depend on how
+    the conversation is split between turns: extracting a prefix and then
+    the remainder gives the same items as one full rescan.
+    """
+    merged: Dict[str, List[str]] = {k: [] for k in INTEL_KEYS}
+    for text in texts:
+        for k, v in extract_from_text(text).items():
+            merged[k].extend(v)
+    return {k: list(dict.fromkeys(v)) for k, v in merged.items()}
+
+
+def _text_digest(text: str) -> str:
+    return hashlib.blake2b(text.encode("utf-8", "replace"), digest_size=8).hexdigest()
+
+
+def make_watermark(texts: List[str]) -> Dict[str, Any]:
+    """Record how many messages of a session have been extracted."""
+    return {"count": len(texts), "tail": _text_digest(texts[-1]) if texts else ""}
+
+
+def resume_index(texts: List[str], watermark: Dict[str, Any]) -> int:
+    """Index of the first message in `texts` not covered by `watermark`.
+
+    Falls back to 0 (full rescan) when the supplied history no longer lines
+    up with what was processed, e.g. a client that rewrote or truncated it.
+    """
+    try:
+        count = int(watermark.get("count", 0))
+    except (TypeError, ValueError, AttributeError):
+        return 0
+    if count <= 0 or count > len(texts):
+        return 0
+    if _text_digest(texts[count - 1]) != watermark.get("tail"):
+        return 0
+    return count
+
+
 @app.api_route("/events", methods=["GET", "POST", "PUT", "DELETE", "OPTIONS", "PATCH"], include_in_schema=False)
 @app.api_route("/events/", methods=["GET", "POST", "PUT", "DELETE", "OPTIONS", "PATCH"], include_in_schema=False)
 async def handle_event_wrapper(request: Request):
     
     # If it's OPTIONS, return OK immediately
     if request.method == "OPTIONS":
-         return JSONResponse({"status": "ok"})
+         return FastJSONResponse({"status": "ok"})
      
     """
     Wrapper to manually handle the request and ensure we catch EVERYTHING
@@ -197,29 +261,38 @@ async def handle_event_wrapper(request: Request):
     x_api_key = request.headers.get("x-api-key")
     if not x_api_key or not check_api_key(x_api_key):
         # Return 401 manually
-        return JSONResponse({"detail": "Unauthorized: invalid x-api-key"}, status_code=401)
-        
+        return FastJSONResponse({"detail": "Unauthorized: invalid x-api-key"}, status_code=401)
+
+    timer = StageTimer()
     try:
         body_bytes = await request.body()
+        sampled = sample_body(body_bytes, logger)
+        if sampled is not None:
+            logger.debug("incoming body", extra={"body": sampled})
         if not body_bytes:
             body = {}
         else:
             try:
-                body = json.loads(body_bytes)
+                body = fastjson.loads(body_bytes)
             except:
                 body = {}
     except:
         body = {}
+    timer.lap("parse")
 
-    print(f"DEBUG INCOMING BODY: {body}")
-    
     # Delegate to internal logic with failsafe wrapper
+    streaming = False
     try:
-        return await process_event_logic(body, x_api_key)
+        if wants_stream(request):
+            response = await stream_event_logic(body, x_api_key, timer)
+            # the stream observes its own stage timings once it completes
+            streaming = True
+            return response
+        return await process_event_logic(body, x_api_key, timer)
     except Exception as e:
         # ABSOLUTE FAILSAFE - Always return valid JSON
-        logger.error(f"CRITICAL ERROR in process_event_logic: {e}", exc_info=True)
-        return JSONResponse(
+        logger.error("CRITICAL ERROR in process_event_logic: %s", e, exc_info=True)
+        return FastJSONResponse(
             content={
                 "status": "success",
                 "reply": "Oh dear, I'm having trouble hearing you. Could you repeat that?",
@@ -234,8 +307,18 @@ async def handle_event_wrapper(request: Request):
             status_code=200,
             headers={"Content-Type": "application/json"}
         )
+    finally:
+        if not streaming:
+            timer.observe()
 
-async def process_event_logic(body: Dict[str, Any], x_api_key: str):
+async def _begin_turn(body: Dict[str, Any], x_api_key: str, timer: StageTimer) -> Dict[str, Any]:
+    """Everything an event needs before the agent replies: parsing, rate
+    limiting, detection, the stored session state and merged extraction.
+
+    On the full tier the incoming message and merged extraction are stored
+    here, before the agent is called, so a slow or failing LLM cannot lose
+    them; `_finish_turn` only appends the reply.
+    """
     # Manual Extraction
     event_id = body.get("sessionId", "unknown_session")
     msg_obj = body.get("message", {})
@@ -245,8 +328,10 @@ async def process_event_logic(body: Dict[str, Any], x_api_key: str):
     msg_sender = str(msg_obj.get("sender") or "unknown")
     msg_text = str(msg_obj.get("text") or "")
     msg_ts = msg_obj.get("timestamp")
-    if not rate_limit_ok(x_api_key):
+    timer.lap("parse")
+    if not await rate_limit_ok(x_api_key):
         raise HTTPException(status_code=429, detail="Rate limit exceeded")
+    timer.skip()
 
     # Ensure incoming message has a timestamp; default to now if missing/empty
     # Ensure incoming message has a timestamp (handle int/float ms or s)
@@ -259,29 +344,66 @@ async def process_event_logic(body: Dict[str, Any], x_api_key: str):
     meta = body.get("metadata") or {}
     if not isinstance(meta, dict): meta = {}
 
-    # Combine latest message + conversation history for extraction
-    all_texts = []
-    for msg in conv_history:
-        txt = msg.get("text") if isinstance(msg, dict) else None
-        if txt:
-            all_texts.append(txt)
-    all_texts.append(msg_text)
-    full_text = "\n".join(all_texts)
-
     # Ensure defaults
+    raw_text = msg_text
     if not msg_sender:
         msg_sender = "unknown"
     if not msg_text:
         msg_text = "..."
 
-    detection = detect_scam(msg_text)
-    extracted = extract_from_text(full_text)
+    msg_hits = keyword_engine.scan(msg_text)
+    detection = detect_scam(msg_text, msg_hits)
+    msg_intel = extract_from_text(msg_text, msg_hits)
+    timer.lap("detect")
+
+    incoming = {"sender": msg_sender, "text": msg_text, "timestamp": final_ts.isoformat()}
+
+    # Collect message texts; only those past the session's extraction
+    # watermark are scanned, earlier ones are already in the stored result
+    history_texts = []
+    for msg in conv_history:
+        txt = msg.get("text") if isinstance(msg, dict) else None
+        if txt:
+            history_texts.append(str(txt))
+    new_index = len(history_texts)
+    if raw_text:
+        history_texts.append(raw_text)
+
+    # Benign message in a session that was never flagged: skip the merge and
+    # agent, and persist it off the request path. The supplied history has
+    # never been scanned for such a session, so it must be benign too.
+    history_intel = None
+    if LIGHT_TIER_ENABLED and not detection["scam"] and not any(msg_intel.values()):
+        engaged = await session_store.is_engaged(event_id)
+        timer.lap("store")
+        if not engaged:
+            history_intel = extract_from_messages(history_texts[:new_index])
+            timer.lap("detect")
+            if not any(history_intel.values()):
+                EVENT_TIERS.labels(tier="light").inc()
+                return _light_turn(event_id, incoming, meta, detection, len(conv_history) + 1)
+    EVENT_TIERS.labels(tier="full").inc()
+
+    # an earlier light turn of this session may still be writing
+    await _settle_light_writes(event_id)
+    # Single round trip for everything this event reads from the store; only
+    # the tail of the history the agent will look at is fetched
+    state = await session_store.load_turn(
+        event_id, include_history=detection["scam"], history_limit=CONTEXT_MESSAGES
+    )
+    timer.lap("store")
+    start = resume_index(history_texts[:new_index], state["watermark"])
+    if history_intel is not None and start == 0:
+        # the light-tier check above already scanned this history
+        extracted = history_intel
+    else:
+        extracted = extract_from_messages(history_texts[start:new_index])
+    for k, v in msg_intel.items():
+        extracted[k] = list(dict.fromkeys(extracted[k] + v))
 
-    # Persist incoming message to session store
-    await session_store.append_message(event_id, {"sender": msg_sender, "text": msg_text, "timestamp": final_ts.isoformat()})
     # Merge any existing extracted intelligence
     # Merge intelligence with strict key guarantee for judges
-    prev_extracted = await session_store.get_extracted(event_id)
+    prev_extracted = state["extracted"]
     REQUIRED_KEYS = ["bankAccounts", "upiIds", "phishingLinks", "phoneNumbers", "suspiciousKeywords"]
     merged = {k: [] for k in REQUIRED_KEYS}
     
@@ -290,8 +412,6 @@ async def process_event_logic(body: Dict[str, Any], x_api_key: str):
         prev_list = prev_extracted.get(k, []) or []
         new_list = extracted.get(k, []) or []
         merged[k] = list(dict.fromkeys(prev_list + new_list))
-    
-    await session_store.set_extracted(event_id, merged)
 
     # Basic engagement metrics (prototype)
     total_messages = len(conv_history) + 1
@@ -316,11 +436,11 @@ async def process_event_logic(body: Dict[str, Any], x_api_key: str):
     if any(merged.values()):
         agent_notes.append("Extracted possible intelligence items.")
 
-    # If scam is detected, activate the agent to generate a follow-up reply (prototype behavior)
-    agent_reply = None
+    # If scam is detected, the agent generates a follow-up reply (prototype behavior)
+    full_history = None
     if detection["scam"]:
-        # fetch current history to pass to agent
-        local_history = await session_store.get_history(event_id)
+        # stored history plus the not-yet-persisted incoming message
+        local_history = state["history"] + [incoming]
         
         # If local history is empty but we have provided history, hydrate it for context
         if not local_history and conv_history:
@@ -336,51 +456,249 @@ async def process_event_logic(body: Dict[str, Any], x_api_key: str):
         # Fallback if somehow empty
         if not full_history:
              full_history = [{"sender": msg_sender, "text": msg_text, "timestamp": final_ts.isoformat()}]
+    timer.lap("extract")
+
+    # Persist the incoming message and extraction state in one
+    # transactional round trip
+    now = time.time()
+    finalize_due = next_finalize_due(state["total"] + 1, merged, now)
+    await session_store.record_turn(
+        event_id, [incoming], merged, make_watermark(history_texts), finalize_due=finalize_due
+    )
+    if finalize_due <= now:
+        notify_due()
+    timer.lap("store")
+
+    return {
+        "tier": "full",
+        "event_id": event_id,
+        "incoming": incoming,
+        "meta": meta,
+        "detection": detection,
+        "state": state,
+        "merged": merged,
+        "full_history": full_history,
+        "total_messages": total_messages,
+        "engagement_seconds": engagement_seconds,
+        "agent_notes": agent_notes,
+    }
+
+
+def _light_turn(event_id: str, incoming: Dict[str, Any], meta: Dict[str, Any],
+                detection: Dict[str, Any], total_messages: int) -> Dict[str, Any]:
+    return {
+        "tier": "light",
+        "event_id": event_id,
+        "incoming": incoming,
+        "meta": meta,
+        "detection": detection,
+        "state": None,
+        "merged": {k: [] for k in INTEL_KEYS},
+        "full_history": None,
+        "total_messages": total_messages,
+        # not engaged yet, so there is no engagement to measure
+        "engagement_seconds": 0,
+        "agent_notes": [],
+    }
+
 
+# light-tier writes still in flight, by session; each chains on the previous
+# one so a session's messages are stored in order
+_light_writes: Dict[str, "asyncio.Future"] = {}
+
+
+def _write_light_turn(event_id: str, incoming: Dict[str, Any]):
+    prev = _light_writes.get(event_id)
+    now = time.time()
+
+    async def write():
+        if prev is not None:
+            await prev
         try:
-            agent_reply = await agent.generate_reply(event_id, full_history, meta)
+            total = await session_store.get_total_messages(event_id)
+            finalize_due = next_finalize_due(total + 1, {}, now)
+            await session_store.record_turn(event_id, [incoming], finalize_due=finalize_due)
+            if finalize_due <= now:
+                notify_due()
         except Exception as e:
-            print(f"AGENT ERROR: {e}")
-            agent_reply = {
-                "sender": "agent",
-                "text": "Oh dear, my phone is acting up again. What were you saying about the payment?",
-                "timestamp": datetime.utcnow().isoformat() + "Z"
-            }
+            logger.warning("light-tier write failed for session %s: %s", event_id, e)
+        finally:
+            if _light_writes.get(event_id) is task:
+                del _light_writes[event_id]
 
-        # Ensure agent_reply is NEVER None
-        if not agent_reply or not agent_reply.get("text"):
-             agent_reply = {
-                "sender": "agent",
-                "text": "Wait, let me put my glasses on. Can you repeat that last part?",
-                "timestamp": datetime.utcnow().isoformat() + "Z"
-            }
+    task = asyncio.ensure_future(write())
+    _light_writes[event_id] = task
+
+
+# turns of streams whose client went away, finished in the background
+_stream_writes: Set["asyncio.Future"] = set()
 
-        # persist agent reply
-        await session_store.append_message(event_id, agent_reply)
+
+def _finish_detached(turn: Dict[str, Any]):
+    async def finish():
+        try:
+            await _finish_turn(turn, None, StageTimer())
+        except Exception as e:
+            logger.warning("persisting abandoned stream failed for session %s: %s", turn["event_id"], e)
+
+    task = asyncio.ensure_future(finish())
+    _stream_writes.add(task)
+    task.add_done_callback(_stream_writes.discard)
+
+
+async def _settle_stream_writes():
+    if _stream_writes:
+        await asyncio.gather(*list(_stream_writes))
+
+
+async def _settle_light_writes(event_id: Optional[str] = None):
+    """Wait for pending light-tier writes of one session, or of all."""
+    if event_id is not None:
+        pending = [_light_writes[event_id]] if event_id in _light_writes else []
+    else:
+        pending = list(_light_writes.values())
+    if pending:
+        await asyncio.gather(*pending)
+
+
+def _ensure_reply(agent_reply: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    # Ensure agent_reply is NEVER None
+    if not agent_reply or not agent_reply.get("text"):
+         agent_reply = {
+            "sender": "agent",
+            "text": "Wait, let me put my glasses on. Can you repeat that last part?",
+            "timestamp": datetime.utcnow().isoformat() + "Z"
+        }
+    return agent_reply
+
+
+async def _finish_turn(turn: Dict[str, Any], agent_reply: Optional[Dict[str, Any]], timer: StageTimer) -> Dict[str, Any]:
+    """Persist what `_begin_turn` has not stored yet and build the response body."""
+    event_id, merged = turn["event_id"], turn["merged"]
+    if turn["tier"] == "light":
+        # only the message is stored, after the response is sent
+        _write_light_turn(event_id, turn["incoming"])
+        timer.skip()
+    elif agent_reply:
+        # the incoming message is already stored; append the reply
+        now = time.time()
+        finalize_due = next_finalize_due(turn["state"]["total"] + 2, merged, now)
+        await session_store.record_turn(event_id, [agent_reply], finalize_due=finalize_due)
+        if finalize_due <= now:
+            notify_due()
+        timer.lap("store")
+    else:
+        timer.skip()
 
     # FINAL SAFETY CHECK for the reply string
     reply_text = agent_reply.get("text") if agent_reply else "Oh dear, I missed that. Can you say it again?"
 
-    response_data = {
+    response_data = _analysis(turn)
+    response_data["reply"] = reply_text
+    if agent_reply:
+        response_data["agentReply"] = agent_reply
+    return response_data
+
+
+def _analysis(turn: Dict[str, Any]) -> Dict[str, Any]:
+    agent_notes = turn["agent_notes"]
+    return {
         "status": "success",
-        "reply": reply_text,
-        "scamDetected": detection["scam"],
+        "scamDetected": turn["detection"]["scam"],
         "engagementMetrics": {
-            "engagementDurationSeconds": engagement_seconds,
-            "totalMessagesExchanged": total_messages,
+            "engagementDurationSeconds": turn["engagement_seconds"],
+            "totalMessagesExchanged": turn["total_messages"],
         },
-        "extractedIntelligence": merged,
+        "extractedIntelligence": turn["merged"],
         "agentNotes": " ".join(agent_notes) if agent_notes else "No flags detected.",
     }
 
-    if agent_reply:
-        response_data["agentReply"] = agent_reply
 
-    return JSONResponse(
+async def process_event_logic(body: Dict[str, Any], x_api_key: str, timer: Optional[StageTimer] = None):
+    # stage timings are observed by the caller that owns the timer
+    timer = timer or StageTimer()
+    turn = await _begin_turn(body, x_api_key, timer)
+
+    agent_reply = None
+    if turn["detection"]["scam"]:
+        try:
+            agent_reply = await agent.generate_reply(turn["event_id"], turn["full_history"], turn["meta"])
+        except Exception as e:
+            logger.warning("agent error for session %s: %s", turn["event_id"], e)
+            agent_reply = {
+                "sender": "agent",
+                "text": "Oh dear, my phone is acting up again. What were you saying about the payment?",
+                "timestamp": datetime.utcnow().isoformat() + "Z"
+            }
+        agent_reply = _ensure_reply(agent_reply)
+        timer.lap("agent")
+
+    response_data = await _finish_turn(turn, agent_reply, timer)
+    response = FastJSONResponse(
         content=response_data,
         status_code=200,
         headers={"Content-Type": "application/json"}
     )
+    timer.lap("serialize")
+    return response
+
+
+def wants_stream(request: Request) -> bool:
+    """Streaming is opt-in: `?stream=true` or `Accept: text/event-stream`."""
+    if request.query_params.get("stream", "").lower() in ("1", "true", "yes"):
+        return True
+    return "text/event-stream" in request.headers.get("accept", "")
+
+
+def _sse(event: str, data: Dict[str, Any]) -> bytes:
+    return b"event: " + event.encode("utf-8") + b"\ndata: " + fastjson.dumps(data) + b"\n\n"
+
+
+async def stream_event_logic(body: Dict[str, Any], x_api_key: str, timer: StageTimer) -> StreamingResponse:
+    """Server-sent events variant of `process_event_logic`.
+
+    Emits `analysis` (detection, extraction, metrics) as soon as it is known,
+    then one `token` event per reply chunk from the LLM, then `done` with the
+    same body the JSON mode returns. The `done` reply is authoritative: if
+    the LLM stalls it is a canned reply and `fallback` is true.
+    """
+    turn = await _begin_turn(body, x_api_key, timer)
+
+    async def events():
+        agent_reply = None
+        fallback = False
+        persisted = False
+        try:
+            yield _sse("analysis", _analysis(turn))
+            timer.skip()
+            if turn["detection"]["scam"]:
+                try:
+                    async for chunk in agent.stream_reply(turn["event_id"], turn["full_history"], turn["meta"]):
+                        if "delta" in chunk:
+                            yield _sse("token", {"text": chunk["delta"]})
+                        else:
+                            agent_reply, fallback = chunk["reply"], chunk["fallback"]
+                except Exception as e:
+                    logger.warning("agent stream error for session %s: %s", turn["event_id"], e)
+                    fallback = True
+                agent_reply = _ensure_reply(agent_reply)
+                timer.lap("agent")
+            response_data = await _finish_turn(turn, agent_reply, timer)
+            persisted = True
+            response_data["fallback"] = fallback
+            yield _sse("done", response_data)
+            timer.lap("serialize")
+        finally:
+            if not persisted:
+                # client went away mid-stream: still record what it sent
+                _finish_detached(turn)
+            timer.observe()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @app.get("/health")
@@ -420,18 +738,40 @@ async def rotate_keys(body: RotateKeysBody, x_api_key: Optional[str] = Header(No
     # Only allow if caller presents a valid API key
     if x_api_key is None or not check_api_key(x_api_key):
         raise HTTPException(status_code=401, detail="Unauthorized: invalid x-api-key")
-    ok = set_api_keys(body.keys)
+    ok = await set_api_keys(body.keys)
     if not ok:
         raise HTTPException(status_code=500, detail="Failed to set keys")
     return {"status": "ok", "keys_count": len(body.keys)}
 
 
+class ReplayCallbacksBody(BaseModel):
+    # None replays every dead-lettered callback
+    keys: Optional[List[str]] = None
+
+
+@app.get("/admin/callbacks")
+async def callback_outbox_status(x_api_key: Optional[str] = Header(None), limit: int = Query(100, ge=1, le=1000)):
+    if x_api_key is None or not check_api_key(x_api_key):
+        raise HTTPException(status_code=401, detail="Unauthorized: invalid x-api-key")
+    pending = await callback_outbox.pending_count()
+    dead = await callback_outbox.dead_letters(limit)
+    return {"status": "ok", "pending": pending, "dead": dead}
+
+
+@app.post("/admin/callbacks/replay")
+async def replay_callbacks(body: ReplayCallbacksBody, x_api_key: Optional[str] = Header(None)):
+    if x_api_key is None or not check_api_key(x_api_key):
+        raise HTTPException(status_code=401, detail="Unauthorized: invalid x-api-key")
+    replayed = await callback_outbox.replay(body.keys)
+    return {"status": "ok", "replayed": replayed}
+
+
 @app.post("/sessions/{session_id}/finalize")
 async def finalize_session(session_id: str, body: Dict[str, Any], x_api_key: Optional[str] = Header(None)):
     # Auth
     if x_api_key is None or not check_api_key(x_api_key):
         raise HTTPException(status_code=401, detail="Unauthorized: invalid x-api-key")
-    if not rate_limit_ok(x_api_key):
+    if not await rate_limit_ok(x_api_key):
         raise HTTPException(status_code=429, detail="Rate limit exceeded")
 
     scam_detected = bool(body.get("scamDetected", False))
@@ -450,31 +790,46 @@ async def finalize_session(session_id: str, body: Dict[str, Any], x_api_key: Opt
         "agentNotes": agent_notes,
     }
 
-    result = await send_final_callback(payload)
-    return {"status": "callback_attempted", "result": result}
+    # one attempt inline; retries are the outbox's job, off the request path
+    result = await post_final_callback(payload)
+    if result.get("status") == "sent":
+        await session_store.mark_finalized(session_id)
+        return {"status": "callback_attempted", "result": result}
+    # a newer manual payload supersedes one the auto-finalizer queued
+    queued = await callback_outbox.enqueue(session_id, payload, delay=retry_delay(1), replace=True)
+    return {"status": "callback_attempted", "result": result, "queued": queued}
+
+
+SESSION_SORTS = {"lastSeen": False, "-lastSeen": True}
 
 
 @app.get("/sessions")
-async def list_sessions_endpoint(x_api_key: Optional[str] = Header(None)):
+async def list_sessions_endpoint(
+    x_api_key: Optional[str] = Header(None),
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    sort: str = "-lastSeen",
+    since: Optional[float] = None,
+    until: Optional[float] = None,
+):
     if x_api_key is None or not check_api_key(x_api_key):
         raise HTTPException(status_code=401, detail="Unauthorized: invalid x-api-key")
-    if not rate_limit_ok(x_api_key):
+    if not await rate_limit_ok(x_api_key):
         raise HTTPException(status_code=429, detail="Rate limit exceeded")
-    sessions = await session_store.list_sessions()
-    out = []
-    for s in sessions:
-        extracted = await session_store.get_extracted(s)
-        total = await session_store.get_total_messages(s)
-        last = await session_store.get_last_seen(s)
-        out.append({"sessionId": s, "totalMessages": total, "lastSeen": last, "extractedCount": sum(len(v) for v in extracted.values() if isinstance(v, list))})
-    return {"status": "success", "sessions": out}
+    if sort not in SESSION_SORTS:
+        raise HTTPException(status_code=400, detail=f"sort must be one of {', '.join(SESSION_SORTS)}")
+    page, next_cursor = await session_store.scan_sessions(
+        cursor=cursor, limit=limit, since=since, until=until, descending=SESSION_SORTS[sort]
+    )
+    out = await session_store.get_session_summaries(page)
+    return {"status": "success", "sessions": out, "nextCursor": next_cursor}
 
 
 @app.get("/sessions/{session_id}")
 async def get_session(session_id: str, x_api_key: Optional[str] = Header(None)):
     if x_api_key is None or not check_api_key(x_api_key):
         raise HTTPException(status_code=401, detail="Unauthorized: invalid x-api-key")
-    if not rate_limit_ok(x_api_key):
+    if not await rate_limit_ok(x_api_key):
         raise HTTPException(status_code=429, detail="Rate limit exceeded")
     history = await session_store.get_history(session_id)
     extracted = await session_store.get_extracted(session_id)
@@ -0,0 +1,182 @@
+"""Bounded in-memory session storage, used by `SessionStore` without Redis.
+
+Sessions are kept in last-write order. They expire once unwritten for the
+same TTL as the Redis keys, and the least recently written are evicted once either
+`max_sessions` or the `max_bytes` budget is exceeded. Each session keeps at
+most `history_cap` messages (the message count still includes the dropped
+ones). Sizes are estimated from the JSON encoding of what is stored.
+
+Only the store that calls `export_metrics` (the app's, at startup) reports
+to the process-wide `honeypot_memory_*` metrics; other instances, e.g.
+in tests or tools, keep their counts to themselves.
+"""
+import json
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+from prometheus_client import Counter, Gauge
+
+MEMORY_MAX_SESSIONS = int(os.getenv("MEMORY_MAX_SESSIONS", "10000"))
+MEMORY_MAX_BYTES = int(os.getenv("MEMORY_MAX_BYTES", str(256 * 1024 * 1024)))
+MEMORY_HISTORY_CAP = int(os.getenv("MEMORY_HISTORY_CAP", "200"))
+
+# rough fixed cost of a session entry on top of its stored JSON
+_ENTRY_OVERHEAD = 512
+
+MEMORY_SESSIONS = Gauge("honeypot_memory_sessions", "Sessions held by the in-memory store")
+MEMORY_BYTES = Gauge("honeypot_memory_bytes", "Estimated bytes held by the in-memory store")
+MEMORY_EVICTIONS = Counter(
+    "honeypot_memory_evictions_total", "Sessions dropped by the in-memory store", ["reason"]
+)
+
+
+def _size(value: Any) -> int:
+    try:
+        return len(json.dumps(value, default=str))
+    except Exception:
+        return 0
+
+
+class MemorySession:
+    __slots__ = ("history", "sizes", "total", "extracted", "watermark", "last", "touched", "finalized", "nbytes")
+
+    def __init__(self):
+        self.history: Deque[Dict[str, Any]] = deque()
+        self.sizes: Deque[int] = deque()
+        self.total = 0
+        self.extracted: Dict[str, Any] = {}
+        self.watermark: Dict[str, Any] = {}
+        # last message time; 0.0 until the session has history
+        self.last = 0.0
+        # last write of any kind; drives TTL and eviction order
+        self.touched = 0.0
+        self.finalized = False
+        self.nbytes = _ENTRY_OVERHEAD
+
+
+class MemorySessions:
+    def __init__(
+        self,
+        ttl: float,
+        max_sessions: int = MEMORY_MAX_SESSIONS,
+        max_bytes: int = MEMORY_MAX_BYTES,
+        history_cap: int = MEMORY_HISTORY_CAP,
+        on_evict: Optional[Callable[[str], None]] = None,
+    ):
+        self.ttl = ttl
+        self.max_sessions = max(1, max_sessions)
+        self.max_bytes = max_bytes
+        self.history_cap = max(1, history_cap)
+        self.on_evict = on_evict
+        self.nbytes = 0
+        self.evictions: Dict[str, int] = {}
+        self._exported = False
+        self._sessions: "OrderedDict[str, MemorySession]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def export_metrics(self):
+        """Report this instance's usage as the `honeypot_memory_*` metrics."""
+        MEMORY_SESSIONS.set_function(self.__len__)
+        MEMORY_BYTES.set_function(lambda: self.nbytes)
+        self._exported = True
+
+    def _expired(self, s: MemorySession, now: float) -> bool:
+        return s.touched < now - self.ttl
+
+    def get(self, session_id: str, now: Optional[float] = None) -> Optional[MemorySession]:
+        s = self._sessions.get(session_id)
+        if s is not None and self._expired(s, time.time() if now is None else now):
+            self._drop(session_id, "ttl")
+            return None
+        return s
+
+    def _resize(self, s: MemorySession, delta: int):
+        s.nbytes += delta
+        self.nbytes += delta
+
+    def _entry(self, session_id: str) -> MemorySession:
+        """The session to write to, created if needed and moved to the back
+        of the eviction order."""
+        now = time.time()
+        s = self.get(session_id, now)
+        if s is None:
+            s = self._sessions[session_id] = MemorySession()
+            self.nbytes += s.nbytes
+        else:
+            self._sessions.move_to_end(session_id)
+        s.touched = now
+        return s
+
+    def append(self, session_id: str, messages: List[Dict[str, Any]], now: float):
+        s = self._entry(session_id)
+        for m in messages:
+            size = _size(m)
+            s.history.append(m)
+            s.sizes.append(size)
+            self._resize(s, size)
+        s.total += len(messages)
+        while len(s.history) > self.history_cap:
+            s.history.popleft()
+            self._resize(s, -s.sizes.popleft())
+        s.last = now
+        self._enforce_limits()
+
+    def set_extracted(self, session_id: str, extracted: Dict[str, Any]):
+        s = self._entry(session_id)
+        self._resize(s, _size(extracted) - _size(s.extracted))
+        s.extracted = dict(extracted)
+        self._enforce_limits()
+
+    def set_watermark(self, session_id: str, watermark: Dict[str, Any]):
+        s = self._entry(session_id)
+        self._resize(s, _size(watermark) - _size(s.watermark))
+        s.watermark = dict(watermark)
+
+    def mark_finalized(self, session_id: str):
+        self._entry(session_id).finalized = True
+
+    def index(self) -> Iterator[Tuple[str, float]]:
+        """`(session_id, last_seen)` for live sessions that have history."""
+        now = time.time()
+        for sid, s in self._sessions.items():
+            if s.last > 0 and not self._expired(s, now):
+                yield sid, s.last
+
+    def _drop(self, session_id: str, reason: Optional[str] = None):
+        s = self._sessions.pop(session_id, None)
+        if s is None:
+            return
+        self.nbytes -= s.nbytes
+        if reason is not None:
+            self.evictions[reason] = self.evictions.get(reason, 0) + 1
+            if self._exported:
+                MEMORY_EVICTIONS.labels(reason=reason).inc()
+        if self.on_evict is not None:
+            self.on_evict(session_id)
+
+    def remove(self, session_id: str):
+        self._drop(session_id)
+
+    def _enforce_limits(self):
+        while len(self._sessions) > self.max_sessions:
+            self._drop(next(iter(self._sessions)), "capacity")
+        # never evict the entry being written, even if it alone is too big
+        while self.nbytes > self.max_bytes and len(self._sessions) > 1:
+            self._drop(next(iter(self._sessions)), "bytes")
+
+    def expire(self, cutoff: Optional[float] = None) -> int:
+        """Drop sessions last written before `cutoff` (default: now - ttl)."""
+        cutoff = time.time() - self.ttl if cutoff is None else cutoff
+        dropped = 0
+        # write order is touch order, so stale sessions are all at the front
+        while self._sessions:
+            sid, s = next(iter(self._sessions.items()))
+            if s.touched >= cutoff:
+                break
+            self._drop(sid, "ttl")
+            dropped += 1
+        return dropped
@@ -0,0 +1,109 @@
+"""Prometheus metrics for the HTTP API.
+
+Requests are labeled by route template (`/sessions/{session_id}`), never by
+the raw path, so the number of series stays fixed however many sessions
+exist. `/events` additionally records how long each processing stage took.
+"""
+import os
+import time
+from typing import Dict, Tuple
+
+from prometheus_client import Counter, Histogram
+from starlette.requests import Request
+from starlette.routing import Match
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _buckets(env: str, default: Tuple[float, ...] = DEFAULT_BUCKETS) -> Tuple[float, ...]:
+    raw = os.getenv(env, "")
+    try:
+        parsed = sorted(float(b) for b in raw.split(",") if b.strip())
+    except ValueError:
+        parsed = []
+    return tuple(parsed) or default
+
+
+# comma-separated upper bounds in seconds
+LATENCY_BUCKETS = _buckets("METRICS_LATENCY_BUCKETS")
+STAGE_BUCKETS = _buckets(
+    "METRICS_STAGE_BUCKETS", (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+)
+
+# label for requests that matched no route (404s, scanners)
+UNMATCHED = "unmatched"
+
+REQUESTS = Counter("honeypot_requests_total", "Total requests", ["endpoint", "method", "status"])
+LATENCY = Histogram(
+    "honeypot_request_latency_seconds", "Request latency in seconds", ["endpoint", "method"],
+    buckets=LATENCY_BUCKETS,
+)
+STAGE_LATENCY = Histogram(
+    "honeypot_event_stage_seconds", "Time spent in each /events processing stage", ["stage"],
+    buckets=STAGE_BUCKETS,
+)
+
+REPLY_CACHE_REQUESTS = Counter(
+    "honeypot_reply_cache_requests_total", "Agent reply cache lookups", ["result"]
+)
+
+# where agent replies came from: cache, llm, hedge (the hedged duplicate won),
+# canned; over_budget counts LLM calls that missed the reply budget
+AGENT_REPLIES = Counter("honeypot_agent_replies_total", "Agent replies by source", ["source"])
+
+# /events processing tier: full (detection, store, merge, agent) or light
+# (benign message in a session that was never flagged)
+EVENT_TIERS = Counter("honeypot_event_tier_total", "Events by processing tier", ["tier"])
+
+EVENT_STAGES = ("parse", "detect", "extract", "store", "agent", "serialize")
+_stage_children = {s: STAGE_LATENCY.labels(stage=s) for s in EVENT_STAGES}
+
+
+def route_template(request: Request) -> str:
+    """Path template of the route that handled `request`."""
+    route = request.scope.get("route")
+    if route is None:
+        # older Starlette does not record the matched route in the scope
+        router = getattr(request.app, "router", None)
+        for r in getattr(router, "routes", ()):
+            if r.matches(request.scope)[0] == Match.FULL:
+                route = r
+                break
+    return getattr(route, "path", None) or UNMATCHED
+
+
+def observe_request(request: Request, status: str, elapsed: float):
+    endpoint = route_template(request)
+    LATENCY.labels(endpoint=endpoint, method=request.method).observe(elapsed)
+    REQUESTS.labels(endpoint=endpoint, method=request.method, status=status).inc()
+
+
+class StageTimer:
+    """Attribute wall time between laps to named stages of one request.
+
+    `lap(stage)` charges the time since the previous lap to `stage`;
+    `skip()` discards it. Totals are observed once, by `observe()`, so a
+    stage entered twice (e.g. the store read and write) counts as one sample.
+    """
+
+    __slots__ = ("_last", "_spent")
+
+    def __init__(self):
+        self._last = time.perf_counter()
+        self._spent: Dict[str, float] = {}
+
+    def lap(self, stage: str):
+        now = time.perf_counter()
+        self._spent[stage] = self._spent.get(stage, 0.0) + (now - self._last)
+        self._last = now
+
+    def skip(self):
+        self._last = time.perf_counter()
+
+    def observe(self):
+        for stage, seconds in self._spent.items():
+            child = _stage_children.get(stage)
+            if child is None:
+                child = _stage_children[stage] = STAGE_LATENCY.labels(stage=stage)
+            child.observe(seconds)
+        self._spent.clear()
@@ -0,0 +1,194 @@
+"""Token-bucket rate limiting with a local lease tier.
+
+Each API key owns a token bucket (`capacity` tokens, refilled at
+`rate_per_sec`). With Redis the authoritative bucket lives in a hash updated
+atomically by a Lua script, but requests do not hit it one by one: a worker
+leases a small batch of tokens and spends them locally, so most checks are
+an in-process decrement. Tokens still unspent when a lease lapses are
+handed back with the next lease request. Without Redis (or when it fails) each process
+keeps its own buckets. Idle local state is evicted.
+"""
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+try:
+    import redis.asyncio as redis_async
+except Exception:
+    redis_async = None
+
+RATE_LIMIT = int(os.getenv("RATE_LIMIT_PER_MIN", "2000"))
+# bucket size; defaults to one minute's worth of requests
+RATE_LIMIT_BURST = int(os.getenv("RATE_LIMIT_BURST", str(RATE_LIMIT)))
+# tokens taken from Redis per lease, and how long an unspent lease is kept
+RATE_LIMIT_LEASE = int(os.getenv("RATE_LIMIT_LEASE", str(max(1, RATE_LIMIT // 100))))
+RATE_LIMIT_LEASE_TTL = float(os.getenv("RATE_LIMIT_LEASE_TTL", "1"))
+# local entries kept before the least recently used are evicted
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "10000"))
+
+_TOKEN_BUCKET_LUA = """
+local cap = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local want = tonumber(ARGV[4])
+local refund = tonumber(ARGV[6])
+local b = redis.call('HMGET', KEYS[1], 't', 'ts')
+local tokens = tonumber(b[1])
+local ts = tonumber(b[2])
+if tokens == nil or ts == nil then
+  tokens = cap
+  ts = now
+end
+tokens = math.min(cap, tokens + math.max(0, now - ts) * rate + refund)
+local granted = math.min(want, math.floor(tokens))
+tokens = tokens - granted
+redis.call('HSET', KEYS[1], 't', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], ARGV[5])
+return granted
+"""
+
+
+class _Bucket:
+    __slots__ = ("tokens", "ts", "lease_expires", "empty")
+
+    def __init__(self, tokens: float, ts: float):
+        self.tokens = tokens
+        self.ts = ts
+        self.lease_expires = 0.0
+        self.empty = False
+
+
+class RateLimiter:
+    def __init__(
+        self,
+        rate_per_min: int = RATE_LIMIT,
+        burst: int = RATE_LIMIT_BURST,
+        lease: int = RATE_LIMIT_LEASE,
+        lease_ttl: float = RATE_LIMIT_LEASE_TTL,
+        max_keys: int = RATE_LIMIT_MAX_KEYS,
+        url: Optional[str] = os.getenv("REDIS_URL"),
+    ):
+        self.rate = rate_per_min / 60.0
+        self.capacity = max(1, burst)
+        self.lease = max(1, min(lease, self.capacity))
+        self.lease_ttl = lease_ttl
+        self.max_keys = max_keys
+        # local buckets (no Redis) and leased token balances (Redis), LRU ordered
+        self._local: "OrderedDict[str, _Bucket]" = OrderedDict()
+        self._leases: "OrderedDict[str, _Bucket]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._waiting: Dict[str, int] = {}
+        self._calls = 0
+        self._use_redis = False
+        if url and redis_async is not None:
+            try:
+                self._r = redis_async.from_url(url)
+                self._script = self._r.register_script(_TOKEN_BUCKET_LUA)
+                self._use_redis = True
+            except Exception:
+                self._use_redis = False
+
+    def _touch(self, table: "OrderedDict[str, _Bucket]", key: str, bucket: _Bucket):
+        table[key] = bucket
+        table.move_to_end(key)
+        while len(table) > self.max_keys:
+            table.popitem(last=False)
+
+    def _allow_local(self, key: str, now: float) -> bool:
+        b = self._local.get(key)
+        if b is None:
+            b = _Bucket(self.capacity, now)
+        else:
+            b.tokens = min(self.capacity, b.tokens + (now - b.ts) * self.rate)
+            b.ts = now
+        self._touch(self._local, key, b)
+        if b.tokens >= 1:
+            b.tokens -= 1
+            return True
+        return False
+
+    async def _lease(self, key: str, now: float, want: int, refund: int = 0) -> int:
+        """Take up to `want` tokens from the shared bucket, first returning
+        `refund` unspent tokens of the previous lease."""
+        # idle buckets expire once they would have refilled completely
+        ttl = int(self.capacity / self.rate) + 60 if self.rate > 0 else 3600
+        granted = await self._script(
+            keys=[f"rate:{key}"],
+            args=[self.capacity, self.rate, now, want, ttl, refund],
+        )
+        return int(granted or 0)
+
+    async def allow(self, key: str) -> bool:
+        """Spend one token for `key`; False when the bucket is empty."""
+        now = time.time()
+        self._calls += 1
+        if self._calls % 1024 == 0:
+            self.evict_idle(now)
+        if not self._use_redis:
+            return self._allow_local(key, now)
+
+        # every pass either spends a token, sees an empty bucket, or fetches
+        # a lease that grants at least one token or marks the bucket empty
+        while True:
+            b = self._leases.get(key)
+            if b is not None and b.lease_expires > now:
+                if b.tokens >= 1:
+                    b.tokens -= 1
+                    self._leases.move_to_end(key)
+                    return True
+                if b.empty:
+                    # Redis had nothing left; deny locally until a token
+                    # could have refilled
+                    return False
+            # one lease request per key at a time; concurrent callers share it
+            fut = self._inflight.get(key)
+            if fut is not None:
+                self._waiting[key] = self._waiting.get(key, 0) + 1
+                try:
+                    await asyncio.shield(fut)
+                finally:
+                    self._waiting[key] -= 1
+                    if not self._waiting[key]:
+                        del self._waiting[key]
+                continue
+            fut = asyncio.get_running_loop().create_future()
+            self._inflight[key] = fut
+            # lease enough for the callers already queued behind this one
+            want = min(self.capacity, max(self.lease, 1 + self._waiting.get(key, 0)))
+            # an expired lease gives back what it did not spend
+            refund = int(b.tokens) if b is not None and b.lease_expires <= now else 0
+            if refund:
+                b.tokens -= refund
+            try:
+                granted = await self._lease(key, now, want, refund)
+            except Exception:
+                self._use_redis = False
+                return self._allow_local(key, now)
+            finally:
+                self._inflight.pop(key, None)
+                fut.set_result(None)
+            b = _Bucket(granted, now)
+            b.empty = granted == 0
+            if b.empty and self.rate > 0:
+                b.lease_expires = now + min(self.lease_ttl, 1.0 / self.rate)
+            else:
+                b.lease_expires = now + self.lease_ttl
+            self._touch(self._leases, key, b)
+
+    def evict_idle(self, now: Optional[float] = None) -> int:
+        """Drop local buckets that are full again and expired leases with
+        nothing left to refund (or whose shared bucket is full again)."""
+        now = time.time() if now is None else now
+        full_after = self.capacity / self.rate if self.rate > 0 else float("inf")
+        stale = [k for k, b in self._local.items() if now - b.ts >= full_after]
+        for k in stale:
+            del self._local[k]
+        expired = [
+            k for k, b in self._leases.items()
+            if b.lease_expires <= now and (b.tokens < 1 or now - b.ts >= full_after)
+        ]
+        for k in expired:
+            del self._leases[k]
+        return len(stale) + len(expired)
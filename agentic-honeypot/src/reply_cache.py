@@ -0,0 +1,138 @@
+"""Cache of LLM replies keyed on normalized conversation context.
+
+Scam campaigns reuse the same scripts with different numbers and links, so
+the key is a hash of the persona plus the last few messages with digits,
+URLs and UPI/e-mail handles replaced by placeholders and whitespace and case
+folded. Each key holds a few reply variants and a hit returns one at random.
+Entries live in a local LRU with TTL; with Redis they are also shared
+between workers.
+"""
+import hashlib
+import os
+import random
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+try:
+    import redis.asyncio as redis
+except Exception:
+    redis = None
+
+from .metrics import REPLY_CACHE_REQUESTS
+from .session_store import REDIS_URL
+
+REPLY_CACHE_ENABLED = os.getenv("REPLY_CACHE_ENABLED", "1") == "1"
+REPLY_CACHE_SIZE = int(os.getenv("REPLY_CACHE_SIZE", "2048"))
+REPLY_CACHE_TTL = int(os.getenv("REPLY_CACHE_TTL", "3600"))
+# trailing messages that make up the key
+REPLY_CACHE_CONTEXT = int(os.getenv("REPLY_CACHE_CONTEXT", "3"))
+# distinct replies kept per key
+REPLY_CACHE_VARIANTS = int(os.getenv("REPLY_CACHE_VARIANTS", "3"))
+
+_URL_RE = re.compile(r"https?://\S+|www\.\S+")
+_HANDLE_RE = re.compile(r"\b[\w.-]+@[\w.-]+\b")
+_DIGITS_RE = re.compile(r"\d+")
+_PUNCT_RE = re.compile(r"[^\w#<> ]+")
+_SPACE_RE = re.compile(r"\s+")
+# replies quoting a number, link or handle back are tied to one conversation
+_SPECIFIC_RE = re.compile(r"\d{3,}|@|https?://|www\.")
+
+
+def normalize(text: str) -> str:
+    text = _URL_RE.sub(" <url> ", text.lower())
+    text = _HANDLE_RE.sub(" <handle> ", text)
+    text = _DIGITS_RE.sub("#", text)
+    text = _PUNCT_RE.sub(" ", text)
+    return _SPACE_RE.sub(" ", text).strip()
+
+
+def context_key(messages: Sequence[Dict[str, Any]], persona: str = "", size: int = REPLY_CACHE_CONTEXT) -> str:
+    h = hashlib.blake2b(persona.encode("utf-8", "replace"), digest_size=16)
+    for m in messages[-size:] if size > 0 else []:
+        h.update(b"\x1e")
+        h.update(f"{m.get('sender', '')}\x1f{normalize(str(m.get('text', '')))}".encode("utf-8", "replace"))
+    return h.hexdigest()
+
+
+def cacheable(reply: str) -> bool:
+    return bool(reply) and not _SPECIFIC_RE.search(reply)
+
+
+class ReplyCache:
+    def __init__(
+        self,
+        max_keys: int = REPLY_CACHE_SIZE,
+        ttl: int = REPLY_CACHE_TTL,
+        variants: int = REPLY_CACHE_VARIANTS,
+        url: Optional[str] = REDIS_URL,
+    ):
+        self.max_keys = max_keys
+        self.ttl = ttl
+        self.variants = max(1, variants)
+        self._local: "OrderedDict[str, Tuple[float, List[str]]]" = OrderedDict()
+        self._use_redis = False
+        if url and redis is not None:
+            try:
+                self._r = redis.from_url(url)
+                self._use_redis = True
+            except Exception:
+                self._use_redis = False
+
+    def _local_get(self, key: str, now: float) -> Optional[List[str]]:
+        entry = self._local.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= now:
+            del self._local[key]
+            return None
+        self._local.move_to_end(key)
+        return entry[1]
+
+    def _local_set(self, key: str, variants: List[str], now: float):
+        self._local[key] = (now + self.ttl, variants)
+        self._local.move_to_end(key)
+        while len(self._local) > self.max_keys:
+            self._local.popitem(last=False)
+
+    async def variants_for(self, key: str) -> List[str]:
+        now = time.time()
+        found = self._local_get(key, now)
+        if found is None and self._use_redis:
+            try:
+                raw = await self._r.lrange(f"reply:{key}", 0, self.variants - 1)
+                found = [v.decode() if isinstance(v, bytes) else v for v in raw]
+                if found:
+                    self._local_set(key, found, now)
+            except Exception:
+                self._use_redis = False
+        return found or []
+
+    async def lookup(self, key: str) -> Tuple[Optional[str], bool]:
+        """A random cached variant for `key` (or None) and whether the key
+        has room for more variants. Counts the hit or miss."""
+        found = await self.variants_for(key)
+        REPLY_CACHE_REQUESTS.labels(result="hit" if found else "miss").inc()
+        return (random.choice(found) if found else None), len(found) < self.variants
+
+    async def put(self, key: str, reply: str) -> bool:
+        """Add `reply` as a variant of `key`; skipped if conversation-specific."""
+        if not cacheable(reply):
+            return False
+        now = time.time()
+        current = self._local_get(key, now) or []
+        if reply in current:
+            return False
+        # newest first; the oldest variant falls off
+        self._local_set(key, ([reply] + current)[: self.variants], now)
+        if self._use_redis:
+            try:
+                async with self._r.pipeline(transaction=True) as pipe:
+                    pipe.lpush(f"reply:{key}", reply)
+                    pipe.ltrim(f"reply:{key}", 0, self.variants - 1)
+                    pipe.expire(f"reply:{key}", self.ttl)
+                    await pipe.execute()
+            except Exception:
+                self._use_redis = False
+        return True
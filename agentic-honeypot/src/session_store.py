@@ -1,20 +1,127 @@
-import json
+import asyncio
+import contextlib
+import heapq
 import os
-from typing import List, Dict, Any
+import time
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple
 
 try:
     import redis.asyncio as redis
 except Exception:
     redis = None
 
+from prometheus_client import Gauge
+
+from . import codec
+from .memory_store import MemorySessions
+
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+SESSION_TTL = int(os.getenv("SESSION_TTL_SECONDS", str(7 * 24 * 3600)))
+# sorted set of session ids scored by last-seen time
+SESSION_INDEX_KEY = "sessions:index"
+# sorted set of unfinalized session ids scored by their next finalize check
+FINALIZE_DUE_KEY = "finalize:due"
+# messages kept in the Redis history list; older ones are moved into
+# compressed chunks under `session:{id}:archive` (0 keeps everything hot)
+HISTORY_HOT_WINDOW = int(os.getenv("HISTORY_HOT_WINDOW", "100"))
+# compaction waits until this many messages are past the window, so it
+# runs once per batch rather than on every append
+HISTORY_COMPACT_BATCH = int(os.getenv("HISTORY_COMPACT_BATCH", "50"))
+# write-behind: record_turn buffers in process and a background task
+# flushes to Redis every STORE_FLUSH_INTERVAL_MS
+STORE_WRITE_BEHIND = os.getenv("STORE_WRITE_BEHIND", "0") == "1"
+STORE_FLUSH_INTERVAL = float(os.getenv("STORE_FLUSH_INTERVAL_MS", "20")) / 1000.0
+# sessions written per pipeline
+STORE_FLUSH_BATCH = int(os.getenv("STORE_FLUSH_BATCH", "500"))
+# buffered sessions at which writers wait for a flush instead of adding more
+STORE_BUFFER_MAX = int(os.getenv("STORE_BUFFER_MAX", "5000"))
+
+WRITE_BEHIND_LAG = Gauge(
+    "honeypot_store_write_behind_lag_seconds", "Age of the oldest write not yet flushed to Redis"
+)
+WRITE_BEHIND_SESSIONS = Gauge(
+    "honeypot_store_write_behind_sessions", "Sessions with writes not yet flushed to Redis"
+)
+
+
+class PendingTurn:
+    """Writes to one session not yet sent to Redis, coalesced: messages
+    accumulate, the other fields keep their latest value."""
+
+    __slots__ = ("messages", "extracted", "watermark", "finalize_due", "last", "since")
+
+    def __init__(self, now: float):
+        self.messages: List[Dict[str, Any]] = []
+        self.extracted: Optional[Dict[str, Any]] = None
+        self.watermark: Optional[Dict[str, Any]] = None
+        self.finalize_due: Optional[float] = None
+        # last message time; None if no messages are buffered
+        self.last: Optional[float] = None
+        # first buffered write, for the lag gauge
+        self.since = now
+
+    def add(self, messages, extracted, watermark, finalize_due, now: float):
+        if messages:
+            self.messages.extend(messages)
+            self.last = now
+        if extracted is not None:
+            self.extracted = extracted
+        if watermark is not None:
+            self.watermark = watermark
+        if finalize_due is not None:
+            self.finalize_due = finalize_due
+
+
+def _decode(v) -> str:
+    return v.decode() if isinstance(v, bytes) else v
+
+
+def _total(count, length) -> int:
+    # sessions written before the counter existed only have the list length
+    return max(int(count or 0), int(length or 0))
+
+
+def encode_cursor(last_seen: float, session_id: str) -> str:
+    return f"{last_seen!r}:{session_id}"
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[Tuple[float, str]]:
+    if not cursor:
+        return None
+    score, _, session_id = cursor.partition(":")
+    try:
+        return float(score), session_id
+    except ValueError:
+        return None
+
+
+def _past_cursor(score: float, session_id: str, after: Optional[Tuple[float, str]], descending: bool) -> bool:
+    # index order is (score, member); ties on score sort by session id
+    if after is None:
+        return True
+    if descending:
+        return (score, session_id) < after
+    return (score, session_id) > after
 
 
 class SessionStore:
-    def __init__(self, url: str = REDIS_URL):
+    def __init__(self, url: str = REDIS_URL, write_behind: bool = STORE_WRITE_BEHIND):
         self._use_redis = False
-        self._in_memory: Dict[str, List[Dict[str, Any]]] = {}
-        self._in_memory_extracted: Dict[str, Dict[str, Any]] = {}
+        # fallback storage when Redis is unavailable (bounded, with TTL)
+        self._mem = MemorySessions(ttl=SESSION_TTL, on_evict=self._forget_due)
+        # in-memory finalize schedule: heap of (due, session) with lazy
+        # deletion against `_due` holding each session's current due time
+        self._due: Dict[str, float] = {}
+        self._due_heap: List[Tuple[float, str]] = []
+        self.write_behind = write_behind
+        # write-behind buffer, in write order; `_flushing` is the batch being
+        # written. Flushes hold `_flush_lock`, as do reads of buffered
+        # sessions, so a read never sees a batch both in Redis and in memory
+        self._pending: "OrderedDict[str, PendingTurn]" = OrderedDict()
+        self._flushing: Dict[str, PendingTurn] = {}
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._flusher: Optional[asyncio.Task] = None
         if redis is not None:
             try:
                 self._r = redis.from_url(url)
@@ -24,86 +131,566 @@ class SessionStore:
                 self._use_redis = False
 
     async def append_message(self, session_id: str, message: Dict[str, Any]):
-        key = f"session:{session_id}:history"
+        state = await self.load_turn(session_id)
+        due = self._finalize_due(state["total"] + 1, state["extracted"], time.time())
+        await self.record_turn(session_id, [message], finalize_due=due)
+
+    def _finalize_due(self, total: int, extracted: Dict[str, Any], last_seen: float) -> float:
+        """Re-score a session for writers that don't compute the schedule
+        themselves, the way the event path does."""
+        # auto_finalizer imports this module
+        from .auto_finalizer import next_finalize_due, notify_due
+
+        due = next_finalize_due(total, extracted, last_seen)
+        if due <= time.time():
+            notify_due()
+        return due
+
+    async def record_turn(
+        self,
+        session_id: str,
+        messages: List[Dict[str, Any]],
+        extracted: Optional[Dict[str, Any]] = None,
+        watermark: Optional[Dict[str, Any]] = None,
+        finalize_due: Optional[float] = None,
+    ):
+        """Persist everything one event writes in a single MULTI/EXEC round trip.
+
+        Appends `messages` to the history, bumps last-seen and, when given,
+        replaces the extracted intelligence and extraction watermark and
+        re-scores the session in the finalize schedule. Once the history
+        list grows a batch past `HISTORY_HOT_WINDOW` the overflow is
+        compacted into the archive.
+
+        In write-behind mode the turn is only buffered; reads through this
+        store see it immediately and it reaches Redis with the next flush.
+        """
+        now = time.time()
+        if self._use_redis and self._flusher is not None:
+            turn = self._pending.get(session_id)
+            if turn is None:
+                turn = self._pending[session_id] = PendingTurn(now)
+            turn.add(messages, extracted, watermark, finalize_due, now)
+            if len(self._pending) >= STORE_BUFFER_MAX:
+                await self.flush()
+            return
+        if self._pending:
+            # Redis went away with writes still buffered: keep them in order
+            await self.flush()
+        turn = PendingTurn(now)
+        turn.add(messages, extracted, watermark, finalize_due, now)
         if self._use_redis:
             try:
-                await self._r.rpush(key, json.dumps(message))
-                await self._r.expire(key, 7 * 24 * 3600)
-                # update last seen time
-                await self._r.set(f"session:{session_id}:last", json.dumps({"ts": __import__("time").time()}))
+                await self._write_turns({session_id: turn})
                 return
             except Exception:
                 self._use_redis = False
-        # fallback in-memory
-        self._in_memory.setdefault(session_id, []).append(message)
-        # update last seen time
-        self._in_memory.setdefault("_last", {})
-        self._in_memory["_last"][session_id] = __import__("time").time()
+        self._apply_in_memory(session_id, turn)
 
-    async def get_history(self, session_id: str) -> List[Dict[str, Any]]:
+    async def _write_turns(self, turns: Dict[str, PendingTurn]):
+        """Write turns of one or more sessions in a single MULTI/EXEC."""
+        appended: List[Tuple[str, int]] = []
+        async with self._r.pipeline(transaction=True) as pipe:
+            for session_id, t in turns.items():
+                if t.messages:
+                    key = f"session:{session_id}:history"
+                    count_key = f"session:{session_id}:count"
+                    appended.append((session_id, len(pipe)))
+                    pipe.rpush(key, *[codec.encode(m) for m in t.messages])
+                    pipe.expire(key, SESSION_TTL)
+                    pipe.incrby(count_key, len(t.messages))
+                    pipe.expire(count_key, SESSION_TTL)
+                    # update last seen time
+                    pipe.set(f"session:{session_id}:last", codec.encode({"ts": t.last}))
+                    pipe.zadd(SESSION_INDEX_KEY, {session_id: t.last})
+                if t.extracted is not None:
+                    pipe.set(f"session:{session_id}:extracted", codec.encode(t.extracted), ex=SESSION_TTL)
+                if t.watermark is not None:
+                    pipe.set(f"session:{session_id}:watermark", codec.encode(t.watermark), ex=SESSION_TTL)
+                if t.finalize_due is not None:
+                    pipe.zadd(FINALIZE_DUE_KEY, {session_id: t.finalize_due})
+            res = await pipe.execute()
+        for session_id, pos in appended:
+            length, count = int(res[pos]), int(res[pos + 2])
+            if count < length:
+                # history from before the counter: seed it once
+                await self._r.incrby(f"session:{session_id}:count", length - count)
+            await self._compact(session_id, length)
+
+    def _apply_in_memory(self, session_id: str, t: PendingTurn):
+        if t.messages:
+            self._mem.append(session_id, t.messages, t.last)
+        if t.extracted is not None:
+            self._mem.set_extracted(session_id, t.extracted)
+        if t.watermark is not None:
+            self._mem.set_watermark(session_id, t.watermark)
+        if t.finalize_due is not None:
+            self._schedule_in_memory(session_id, t.finalize_due)
+
+    async def start(self):
+        """Export the in-memory store's metrics and start the write-behind
+        flusher, if enabled and Redis is in use (app lifespan)."""
+        self._mem.export_metrics()
+        if not (self.write_behind and self._use_redis) or self._flusher is not None:
+            return
+        self._flush_lock = asyncio.Lock()
+        self._flusher = asyncio.ensure_future(self._flush_loop())
+        WRITE_BEHIND_LAG.set_function(self.buffer_lag)
+        WRITE_BEHIND_SESSIONS.set_function(lambda: len(self._pending) + len(self._flushing))
+
+    async def aclose(self):
+        """Stop the flusher and write out everything still buffered."""
+        if self._flusher is not None:
+            # never cancel the flusher in the middle of writing a batch
+            async with self._flush_lock:
+                self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        await self.flush()
+
+    def buffer_lag(self) -> float:
+        """Seconds the oldest unflushed write has been waiting."""
+        oldest = [t.since for t in self._flushing.values()]
+        if self._pending:
+            oldest.append(next(iter(self._pending.values())).since)
+        return time.time() - min(oldest) if oldest else 0.0
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(STORE_FLUSH_INTERVAL)
+            if self._pending:
+                await self.flush()
+
+    async def flush(self):
+        """Write every buffered turn now; falls back to memory if Redis fails."""
+        if not self._pending:
+            return
+        async with self._flush_lock or contextlib.nullcontext():
+            while self._pending:
+                batch: Dict[str, PendingTurn] = {}
+                while self._pending and len(batch) < max(1, STORE_FLUSH_BATCH):
+                    session_id, t = self._pending.popitem(last=False)
+                    batch[session_id] = t
+                self._flushing = batch
+                try:
+                    if self._use_redis:
+                        try:
+                            await self._write_turns(batch)
+                            continue
+                        except Exception:
+                            self._use_redis = False
+                    for session_id, t in batch.items():
+                        self._apply_in_memory(session_id, t)
+                finally:
+                    self._flushing = {}
+
+    def _read_lock(self, *session_ids: str):
+        """Lock to hold while reading sessions from Redis: the flush lock if
+        any of them has buffered writes, so none are flushed mid-read and
+        `_pending` can be applied on top of the result."""
+        if self._flush_lock is not None and any(
+            s in self._pending or s in self._flushing for s in session_ids
+        ):
+            return self._flush_lock
+        return contextlib.nullcontext()
+
+    async def _compact(self, session_id: str, length: int):
+        """Move history past the hot window into a compressed archive chunk.
+
+        Appends only ever go to the right of the list, so trimming the
+        messages just read from the left is safe without WATCH; a short
+        lock keeps two writers from archiving the same messages twice.
+        """
+        overflow = length - HISTORY_HOT_WINDOW
+        if HISTORY_HOT_WINDOW <= 0 or overflow < max(1, HISTORY_COMPACT_BATCH):
+            return
         key = f"session:{session_id}:history"
+        lock = f"session:{session_id}:compacting"
+        if not await self._r.set(lock, "1", nx=True, ex=30):
+            return
+        try:
+            items = await self._r.lrange(key, 0, overflow - 1)
+            if not items:
+                return
+            archive = f"session:{session_id}:archive"
+            async with self._r.pipeline(transaction=True) as pipe:
+                pipe.rpush(archive, codec.encode_chunk(codec.decode_many(items)))
+                pipe.expire(archive, SESSION_TTL)
+                pipe.ltrim(key, len(items), -1)
+                await pipe.execute()
+        finally:
+            await self._r.delete(lock)
+
+    async def load_turn(
+        self, session_id: str, include_history: bool = False, history_limit: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """Fetch the per-event read set in one pipelined round trip.
+
+        Returns `extracted`, `watermark`, `total` (message count) and, if
+        `include_history` is set, the decoded `history` (else an empty list):
+        the last `history_limit` messages, or all of them when not given.
+        """
         if self._use_redis:
             try:
-                items = await self._r.lrange(key, 0, -1)
-                return [json.loads(x) for x in items] if items else []
+                async with self._read_lock(session_id):
+                    async with self._r.pipeline(transaction=True) as pipe:
+                        pipe.get(f"session:{session_id}:extracted")
+                        pipe.get(f"session:{session_id}:watermark")
+                        pipe.get(f"session:{session_id}:count")
+                        pipe.llen(f"session:{session_id}:history")
+                        if include_history:
+                            start = -history_limit if history_limit else 0
+                            pipe.lrange(f"session:{session_id}:history", start, -1)
+                            if not history_limit:
+                                pipe.lrange(f"session:{session_id}:archive", 0, -1)
+                        res = await pipe.execute()
+                    total = _total(res[2], res[3])
+                    history: List[Dict[str, Any]] = []
+                    if include_history:
+                        history = codec.decode_many(res[4])
+                        if not history_limit:
+                            history = [m for chunk in res[5] or [] for m in codec.decode_chunk(chunk)] + history
+                        elif len(history) < min(history_limit, total):
+                            # the hot window is smaller than the request
+                            history = await self._recent(session_id, history_limit)
+                    state = {
+                        "extracted": codec.decode(res[0]) or {},
+                        "watermark": codec.decode(res[1]) or {},
+                        "total": total,
+                        "history": history,
+                    }
+                    t = self._pending.get(session_id)
+                if t is not None:
+                    state["total"] += len(t.messages)
+                    if t.extracted is not None:
+                        state["extracted"] = t.extracted
+                    if t.watermark is not None:
+                        state["watermark"] = t.watermark
+                    if include_history:
+                        history = history + t.messages
+                        state["history"] = history[-history_limit:] if history_limit else history
+                return state
             except Exception:
                 self._use_redis = False
-        return list(self._in_memory.get(session_id, []))
+        m = self._mem.get(session_id)
+        if m is None:
+            return {"extracted": {}, "watermark": {}, "total": 0, "history": []}
+        history = []
+        if include_history:
+            history = list(m.history)[-history_limit:] if history_limit else list(m.history)
+        return {
+            "extracted": m.extracted,
+            "watermark": dict(m.watermark),
+            "total": m.total,
+            "history": history,
+        }
+
+    async def get_history(self, session_id: str) -> List[Dict[str, Any]]:
+        """The full stored history: archived chunks followed by the hot list."""
+        if self._use_redis:
+            try:
+                async with self._read_lock(session_id):
+                    async with self._r.pipeline(transaction=True) as pipe:
+                        pipe.lrange(f"session:{session_id}:archive", 0, -1)
+                        pipe.lrange(f"session:{session_id}:history", 0, -1)
+                        chunks, items = await pipe.execute()
+                    t = self._pending.get(session_id)
+                history = [m for chunk in chunks or [] for m in codec.decode_chunk(chunk)]
+                return history + codec.decode_many(items) + (t.messages if t else [])
+            except Exception:
+                self._use_redis = False
+        m = self._mem.get(session_id)
+        return list(m.history) if m else []
+
+    async def get_recent(self, session_id: str, n: int) -> List[Dict[str, Any]]:
+        """The last `n` messages, reading the archive only if the hot window
+        holds fewer than that."""
+        if n <= 0:
+            return []
+        if self._use_redis:
+            try:
+                async with self._read_lock(session_id):
+                    recent = await self._recent(session_id, n)
+                    t = self._pending.get(session_id)
+                return (recent + t.messages)[-n:] if t else recent
+            except Exception:
+                self._use_redis = False
+        m = self._mem.get(session_id)
+        return list(m.history)[-n:] if m else []
+
+    async def _recent(self, session_id: str, n: int) -> List[Dict[str, Any]]:
+        archive = f"session:{session_id}:archive"
+        # the hot tail and archive length as of one instant: compaction only
+        # appends chunks, so the chunks before that length stay where they are
+        async with self._r.pipeline(transaction=True) as pipe:
+            pipe.lrange(f"session:{session_id}:history", -n, -1)
+            pipe.llen(archive)
+            items, chunks = await pipe.execute()
+        recent = codec.decode_many(items)
+        idx = int(chunks) - 1
+        while len(recent) < n and idx >= 0:
+            chunk = await self._r.lindex(archive, idx)
+            if chunk is None:
+                break
+            recent = codec.decode_chunk(chunk)[-(n - len(recent)):] + recent
+            idx -= 1
+        return recent
 
     async def get_total_messages(self, session_id: str) -> int:
-        hist = await self.get_history(session_id)
-        return len(hist)
+        if self._use_redis:
+            try:
+                async with self._read_lock(session_id):
+                    async with self._r.pipeline(transaction=False) as pipe:
+                        pipe.get(f"session:{session_id}:count")
+                        pipe.llen(f"session:{session_id}:history")
+                        count, length = await pipe.execute()
+                    t = self._pending.get(session_id)
+                return _total(count, length) + (len(t.messages) if t else 0)
+            except Exception:
+                self._use_redis = False
+        m = self._mem.get(session_id)
+        return m.total if m else 0
+
+    async def get_session_summaries(
+        self, sessions: List[Tuple[str, float]]
+    ) -> List[Dict[str, Any]]:
+        """Dashboard summaries for a page of `(session_id, last_seen)` rows.
+
+        One pipelined round trip of MGETs for the message counters and the
+        extracted intelligence (plus LLENs for sessions that predate the
+        counters); histories are never loaded.
+        """
+        ids = [s for s, _ in sessions]
+        totals: List[int] = [0] * len(ids)
+        extracted: List[Dict[str, Any]] = [{} for _ in ids]
+        if ids and self._use_redis:
+            try:
+                async with self._read_lock(*ids):
+                    async with self._r.pipeline(transaction=False) as pipe:
+                        pipe.mget([f"session:{s}:count" for s in ids])
+                        pipe.mget([f"session:{s}:extracted" for s in ids])
+                        counts, exts = await pipe.execute()
+                    missing = [i for i, c in enumerate(counts) if c is None]
+                    lengths = {}
+                    if missing:
+                        async with self._r.pipeline(transaction=False) as pipe:
+                            for i in missing:
+                                pipe.llen(f"session:{ids[i]}:history")
+                            lengths = dict(zip(missing, await pipe.execute()))
+                    buffered = [self._pending.get(s) for s in ids]
+                totals = [_total(c, lengths.get(i)) for i, c in enumerate(counts)]
+                extracted = [codec.decode(v) or {} for v in exts]
+                for i, t in enumerate(buffered):
+                    if t is not None:
+                        totals[i] += len(t.messages)
+                        if t.extracted is not None:
+                            extracted[i] = t.extracted
+            except Exception:
+                self._use_redis = False
+        if not self._use_redis:
+            entries = [self._mem.get(s) for s in ids]
+            totals = [m.total if m else 0 for m in entries]
+            extracted = [m.extracted if m else {} for m in entries]
+        return [
+            {
+                "sessionId": s,
+                "totalMessages": total,
+                "lastSeen": last,
+                "extractedCount": sum(len(v) for v in ext.values() if isinstance(v, list)),
+            }
+            for (s, last), total, ext in zip(sessions, totals, extracted)
+        ]
 
-    async def list_sessions(self) -> List[str]:
-        sessions = set()
+    async def list_sessions(self, since: Optional[float] = None, until: Optional[float] = None) -> List[str]:
+        """All indexed session ids, optionally limited to a last-seen range."""
         if self._use_redis:
             try:
-                keys = await self._r.keys("session:*:history")
-                for k in keys:
-                    s = k.decode() if isinstance(k, bytes) else k
-                    # s = session:SESSIONID:history
-                    parts = s.split(":")
-                    if len(parts) >= 3:
-                        sessions.add(parts[1])
+                lo = since if since is not None else "-inf"
+                hi = until if until is not None else "+inf"
+                members = await self._r.zrangebyscore(SESSION_INDEX_KEY, lo, hi)
+                return [_decode(m) for m in members]
             except Exception:
                 self._use_redis = False
-        # include in-memory sessions
-        for k in list(self._in_memory.keys()):
-            if k == "_last":
-                continue
-            sessions.add(k)
-        return list(sessions)
+        return [s for s, _ in self._in_memory_index(since, until)]
 
-    async def get_last_seen(self, session_id: str) -> float:
+    async def scan_sessions(
+        self,
+        cursor: Optional[str] = None,
+        limit: int = 100,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+        descending: bool = True,
+    ) -> Tuple[List[Tuple[str, float]], Optional[str]]:
+        """Page through the session index ordered by last-seen time.
+
+        Returns `([(session_id, last_seen), ...], next_cursor)`; `next_cursor`
+        is None once the range is exhausted. Cursors encode the last
+        (last_seen, session_id) returned, so pages stay stable while other
+        sessions are being updated.
+        """
+        limit = max(1, int(limit))
+        after = decode_cursor(cursor)
+        page: List[Tuple[str, float]] = []
         if self._use_redis:
             try:
-                v = await self._r.get(f"session:{session_id}:last")
-                if v:
-                    return json.loads(v).get("ts", 0.0)
+                lo = since if since is not None else "-inf"
+                hi = until if until is not None else "+inf"
+                if after is not None:
+                    if descending:
+                        hi = after[0] if until is None else min(after[0], until)
+                    else:
+                        lo = after[0] if since is None else max(after[0], since)
+                offset = 0
+                while len(page) < limit:
+                    # over-fetch a little to step over ties with the cursor
+                    num = limit - len(page) + 16
+                    if descending:
+                        rows = await self._r.zrevrangebyscore(SESSION_INDEX_KEY, hi, lo, start=offset, num=num, withscores=True)
+                    else:
+                        rows = await self._r.zrangebyscore(SESSION_INDEX_KEY, lo, hi, start=offset, num=num, withscores=True)
+                    offset += len(rows)
+                    for member, score in rows:
+                        sid = _decode(member)
+                        if _past_cursor(score, sid, after, descending):
+                            page.append((sid, float(score)))
+                            if len(page) >= limit:
+                                break
+                    if len(rows) < num:
+                        break
             except Exception:
                 self._use_redis = False
-        return self._in_memory.get("_last", {}).get(session_id, 0.0)
+                page = []
+        if not self._use_redis:
+            rows = self._in_memory_index(since, until, descending)
+            page = [(s, ts) for s, ts in rows if _past_cursor(ts, s, after, descending)][:limit]
+        next_cursor = encode_cursor(page[-1][1], page[-1][0]) if len(page) >= limit else None
+        return page, next_cursor
 
-    async def set_extracted(self, session_id: str, extracted: Dict[str, Any]):
-        key = f"session:{session_id}:extracted"
+    def _in_memory_index(self, since=None, until=None, descending=False) -> List[Tuple[str, float]]:
+        rows = [
+            (s, ts)
+            for s, ts in self._mem.index()
+            if (since is None or ts >= since) and (until is None or ts <= until)
+        ]
+        rows.sort(key=lambda r: (r[1], r[0]), reverse=descending)
+        return rows
+
+    async def prune_sessions(self, older_than: Optional[float] = None) -> int:
+        """Drop index entries (and in-memory data) not seen since `older_than`.
+
+        Defaults to the session TTL, i.e. sessions whose Redis keys have
+        already expired. Returns the number of sessions removed.
+        """
+        cutoff = older_than if older_than is not None else time.time() - SESSION_TTL
         if self._use_redis:
             try:
-                await self._r.set(key, json.dumps(extracted))
-                await self._r.expire(key, 7 * 24 * 3600)
-                return
+                return int(await self._r.zremrangebyscore(SESSION_INDEX_KEY, "-inf", f"({cutoff!r}"))
             except Exception:
                 self._use_redis = False
-        self._in_memory_extracted[session_id] = extracted
+        return self._mem.expire(cutoff)
+
+    async def rebuild_session_index(self, batch: int = 500) -> int:
+        """Backfill the index from existing history keys (one-off migration).
+
+        Uses incremental SCAN rather than KEYS, so other clients are not
+        blocked while it runs. Returns the number of sessions indexed.
+        """
+        if not self._use_redis:
+            return 0
+        count = 0
+        ids: List[str] = []
+        try:
+            async for k in self._r.scan_iter(match="session:*:history", count=batch):
+                parts = _decode(k).split(":")
+                if len(parts) >= 3:
+                    ids.append(":".join(parts[1:-1]))
+                if len(ids) >= batch:
+                    count += await self._index_batch(ids)
+                    ids = []
+            if ids:
+                count += await self._index_batch(ids)
+        except Exception:
+            self._use_redis = False
+        return count
+
+    async def _index_batch(self, ids: List[str]) -> int:
+        async with self._r.pipeline(transaction=False) as pipe:
+            for s in ids:
+                pipe.get(f"session:{s}:last")
+            lasts = await pipe.execute()
+        now = time.time()
+        mapping = {}
+        for s, v in zip(ids, lasts):
+            try:
+                mapping[s] = float(codec.decode(v).get("ts", now)) if v else now
+            except Exception:
+                mapping[s] = now
+        await self._r.zadd(SESSION_INDEX_KEY, mapping)
+        return len(mapping)
+
+    def _buffered(self, session_id: str, field: str) -> Any:
+        """Latest unflushed value of one of the replace-only fields of a
+        session (`extracted`, `watermark`, `last`), or None."""
+        for turns in (self._pending, self._flushing):
+            t = turns.get(session_id)
+            if t is not None and getattr(t, field) is not None:
+                return getattr(t, field)
+        return None
+
+    async def get_last_seen(self, session_id: str) -> float:
+        buffered = self._buffered(session_id, "last")
+        if buffered is not None:
+            return buffered
+        if self._use_redis:
+            try:
+                v = await self._r.get(f"session:{session_id}:last")
+                if v:
+                    return codec.decode(v).get("ts", 0.0)
+            except Exception:
+                self._use_redis = False
+        m = self._mem.get(session_id)
+        return m.last if m else 0.0
+
+    async def set_extracted(self, session_id: str, extracted: Dict[str, Any]):
+        state = await self.load_turn(session_id)
+        last_seen = await self.get_last_seen(session_id) or time.time()
+        due = self._finalize_due(state["total"], extracted, last_seen)
+        await self.record_turn(session_id, [], extracted=extracted, finalize_due=due)
 
     async def mark_finalized(self, session_id: str):
+        # a buffered turn must not put the session back on the schedule when
+        # it is flushed; holding the flush lock keeps one from being mid-write
+        async with self._read_lock(session_id):
+            t = self._pending.get(session_id)
+            if t is not None:
+                t.finalize_due = None
+            if self._use_redis:
+                try:
+                    async with self._r.pipeline(transaction=True) as pipe:
+                        pipe.set(f"session:{session_id}:finalized", "1")
+                        pipe.zrem(FINALIZE_DUE_KEY, session_id)
+                        await pipe.execute()
+                    return
+                except Exception:
+                    self._use_redis = False
+        self._mem.mark_finalized(session_id)
+        self._due.pop(session_id, None)
+
+    async def is_engaged(self, session_id: str) -> bool:
+        """Whether the session has been through full event processing, i.e.
+        has stored extraction state."""
+        if self._buffered(session_id, "extracted") is not None:
+            return True
         if self._use_redis:
             try:
-                await self._r.set(f"session:{session_id}:finalized", "1")
-                return
+                return bool(await self._r.exists(f"session:{session_id}:extracted"))
             except Exception:
                 self._use_redis = False
-        self._in_memory_extracted.setdefault(session_id, {})
-        self._in_memory_extracted[session_id]["_finalized"] = True
+        m = self._mem.get(session_id)
+        return bool(m and m.extracted)
 
     async def is_finalized(self, session_id: str) -> bool:
         if self._use_redis:
@@ -112,14 +699,139 @@ class SessionStore:
                 return bool(v)
             except Exception:
                 self._use_redis = False
-        return bool(self._in_memory_extracted.get(session_id, {}).get("_finalized", False))
+        m = self._mem.get(session_id)
+        return bool(m and m.finalized)
 
     async def get_extracted(self, session_id: str) -> Dict[str, Any]:
         key = f"session:{session_id}:extracted"
+        buffered = self._buffered(session_id, "extracted")
+        if buffered is not None:
+            return buffered
+        if self._use_redis:
+            try:
+                v = await self._r.get(key)
+                return codec.decode(v) or {}
+            except Exception:
+                self._use_redis = False
+        m = self._mem.get(session_id)
+        return m.extracted if m else {}
+
+    async def get_watermark(self, session_id: str) -> Dict[str, Any]:
+        """Extraction watermark: how far into the history extraction has run."""
+        key = f"session:{session_id}:watermark"
+        buffered = self._buffered(session_id, "watermark")
+        if buffered is not None:
+            return dict(buffered)
         if self._use_redis:
             try:
                 v = await self._r.get(key)
-                return json.loads(v) if v else {}
+                return codec.decode(v) or {}
+            except Exception:
+                self._use_redis = False
+        m = self._mem.get(session_id)
+        return dict(m.watermark) if m else {}
+
+    async def set_watermark(self, session_id: str, watermark: Dict[str, Any]):
+        await self.record_turn(session_id, [], watermark=watermark)
+
+    async def get_finalize_state(self, session_id: str) -> Dict[str, Any]:
+        """Everything the auto-finalizer needs about a session, in one round trip."""
+        if self._use_redis:
+            try:
+                async with self._read_lock(session_id):
+                    async with self._r.pipeline(transaction=False) as pipe:
+                        pipe.get(f"session:{session_id}:finalized")
+                        pipe.get(f"session:{session_id}:extracted")
+                        pipe.get(f"session:{session_id}:count")
+                        pipe.llen(f"session:{session_id}:history")
+                        pipe.get(f"session:{session_id}:last")
+                        finalized, extracted, count, length, last = await pipe.execute()
+                    t = self._pending.get(session_id)
+                state = {
+                    "finalized": bool(finalized),
+                    "extracted": codec.decode(extracted) or {},
+                    "total": _total(count, length),
+                    "last_seen": codec.decode(last).get("ts", 0.0) if last else 0.0,
+                }
+                if t is not None:
+                    state["total"] += len(t.messages)
+                    if t.extracted is not None:
+                        state["extracted"] = t.extracted
+                    if t.last is not None:
+                        state["last_seen"] = t.last
+                return state
+            except Exception:
+                self._use_redis = False
+        m = self._mem.get(session_id)
+        if m is None:
+            return {"finalized": False, "extracted": {}, "total": 0, "last_seen": 0.0}
+        return {
+            "finalized": m.finalized,
+            "extracted": m.extracted,
+            "total": m.total,
+            "last_seen": m.last,
+        }
+
+    async def schedule_finalize(self, session_id: str, due_at: float, only_if_absent: bool = False):
+        """(Re)schedule the next auto-finalize check for a session."""
+        if self._use_redis:
+            try:
+                await self._r.zadd(FINALIZE_DUE_KEY, {session_id: due_at}, nx=only_if_absent)
+                return
+            except Exception:
+                self._use_redis = False
+        if only_if_absent and session_id in self._due:
+            return
+        self._schedule_in_memory(session_id, due_at)
+
+    def _forget_due(self, session_id: str):
+        # evicted from memory: nothing left to finalize
+        self._due.pop(session_id, None)
+
+    def _schedule_in_memory(self, session_id: str, due_at: float):
+        self._due[session_id] = due_at
+        heapq.heappush(self._due_heap, (due_at, session_id))
+
+    async def claim_due_sessions(self, now: Optional[float] = None, limit: int = 100) -> List[str]:
+        """Remove and return up to `limit` sessions whose check is due.
+
+        With Redis, a session is only returned to the caller whose ZREM
+        succeeded, so concurrent finalizer loops never claim the same one.
+        """
+        now = time.time() if now is None else now
+        if any(t.finalize_due is not None and t.finalize_due <= now for t in self._pending.values()):
+            # buffered schedule entries that are already due
+            await self.flush()
+        if self._use_redis:
+            try:
+                ids = await self._r.zrangebyscore(FINALIZE_DUE_KEY, "-inf", now, start=0, num=limit)
+                if not ids:
+                    return []
+                async with self._r.pipeline(transaction=False) as pipe:
+                    for sid in ids:
+                        pipe.zrem(FINALIZE_DUE_KEY, sid)
+                    removed = await pipe.execute()
+                return [_decode(sid) for sid, ok in zip(ids, removed) if ok]
+            except Exception:
+                self._use_redis = False
+        claimed: List[str] = []
+        while self._due_heap and len(claimed) < limit and self._due_heap[0][0] <= now:
+            due_at, sid = heapq.heappop(self._due_heap)
+            if self._due.get(sid) == due_at:
+                del self._due[sid]
+                claimed.append(sid)
+        return claimed
+
+    async def next_finalize_due(self) -> Optional[float]:
+        """Earliest scheduled finalize check, or None when nothing is scheduled."""
+        if self._use_redis:
+            try:
+                rows = await self._r.zrange(FINALIZE_DUE_KEY, 0, 0, withscores=True)
+                dues = [float(rows[0][1])] if rows else []
+                dues += [t.finalize_due for t in self._pending.values() if t.finalize_due is not None]
+                return min(dues) if dues else None
             except Exception:
                 self._use_redis = False
-        return self._in_memory_extracted.get(session_id, {})
+        while self._due_heap and self._due.get(self._due_heap[0][1]) != self._due_heap[0][0]:
+            heapq.heappop(self._due_heap)
+        return self._due_heap[0][0] if self._due_heap else None
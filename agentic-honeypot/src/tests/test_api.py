@@ -45,7 +45,7 @@ async def test_finalize_endpoint_calls_callback(monkeypatch):
     async def fake_send(payload):
         return {"status": "sent", "status_code": 200}
 
-    monkeypatch.setattr(main_module, "send_final_callback", fake_send)
+    monkeypatch.setattr(main_module, "post_final_callback", fake_send)
     session_id = "test-session-async-1"
     body = {"scamDetected": True, "totalMessagesExchanged": 2, "agentNotes": "note"}
     transport = ASGITransport(app=app)
@@ -55,3 +55,45 @@ async def test_finalize_endpoint_calls_callback(monkeypatch):
         j = r.json()
         assert j["status"] == "callback_attempted"
         assert j["result"]["status"] == "sent"
+
+
+@pytest.mark.asyncio
+async def test_failed_finalize_callback_is_queued_after_one_attempt(monkeypatch):
+    attempts = []
+
+    async def failing_send(payload, url=None):
+        attempts.append(payload["sessionId"])
+        return {"status": "failed", "error": "receiver down"}
+
+    monkeypatch.setattr(main_module, "post_final_callback", failing_send)
+    session_id = "test-session-finalize-queued"
+    body = {"scamDetected": True, "totalMessagesExchanged": 2, "agentNotes": "note"}
+    transport = ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        r = await client.post(f"/sessions/{session_id}/finalize", json=body, headers={"x-api-key": API_KEY})
+    assert r.status_code == 200
+    j = r.json()
+    assert j["result"]["status"] == "failed" and j["queued"] is True
+    # no retries on the request path; the outbox owns them
+    assert attempts == [session_id]
+
+
+@pytest.mark.asyncio
+async def test_incoming_message_is_stored_before_the_agent_replies(monkeypatch):
+    session_id = "test-session-persist-first"
+    seen = {}
+
+    async def fake_reply(event_id, history, meta):
+        # the store already has the message and its extraction
+        seen["history"] = [m["text"] for m in await main_module.session_store.get_history(event_id)]
+        seen["extracted"] = await main_module.session_store.get_extracted(event_id)
+        return {"sender": "agent", "text": "Which bank is this?", "timestamp": "2026-01-21T10:15:31Z"}
+
+    monkeypatch.setattr(main_module.agent, "generate_reply", fake_reply)
+    text = "Your account is blocked. Pay to scammer@upi urgently"
+    r = await post_event({"sessionId": session_id, "message": {"sender": "scammer", "text": text}})
+    assert r.status_code == 200
+    assert seen["history"] == [text]
+    assert "scammer@upi" in seen["extracted"]["upiIds"]
+    history = await main_module.session_store.get_history(session_id)
+    assert [m["text"] for m in history] == [text, "Which bank is this?"]
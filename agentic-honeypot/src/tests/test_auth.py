@@ -0,0 +1,146 @@
+import sys
+import asyncio
+import pathlib
+import pytest
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+import src.auth as auth
+from src.auth import API_KEYS_CHANNEL, KeyVerifier
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+class _CountingRedis:
+    """Proxy that records every Redis command issued through it."""
+
+    def __init__(self, inner):
+        self.inner = inner
+        self.calls = []
+
+    def __getattr__(self, name):
+        self.calls.append(name)
+        return getattr(self.inner, name)
+
+
+@pytest.fixture
+def env_keys(monkeypatch):
+    monkeypatch.setenv("API_KEYS", "old-key")
+    monkeypatch.setattr(auth, "_cached_env_str", "old-key")
+    saved = set(auth.LOCAL_KEYS)
+    auth.LOCAL_KEYS.clear()
+    auth.LOCAL_KEYS.add("old-key")
+    yield
+    auth.LOCAL_KEYS.clear()
+    auth.LOCAL_KEYS.update(saved)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    c = _Clock()
+    monkeypatch.setattr(auth, "time", c)
+    return c
+
+
+def _verifier(server, ttl=30.0):
+    v = KeyVerifier(url=None, ttl=ttl)
+    v._r = fakeredis.aioredis.FakeRedis(server=server)
+    return v
+
+
+async def _wait_for(cond, timeout=2.0):
+    for _ in range(int(timeout / 0.01)):
+        if cond():
+            return True
+        await asyncio.sleep(0.01)
+    return cond()
+
+
+async def _subscribed(r):
+    for _ in range(200):
+        if dict(await r.pubsub_numsub(API_KEYS_CHANNEL)).get(API_KEYS_CHANNEL.encode()):
+            return
+        await asyncio.sleep(0.01)
+
+
+@pytest.mark.asyncio
+async def test_cached_keys_are_checked_without_io(env_keys, clock):
+    server = fakeredis.FakeServer()
+    v = _verifier(server)
+    await v.start()
+    await v.stop()
+    proxy = v._r = _CountingRedis(v._r)
+
+    assert all(v.is_valid("old-key") for _ in range(100))
+    assert not v.is_valid("unknown")
+    assert proxy.calls == []
+    assert v._refreshing is None
+
+
+@pytest.mark.asyncio
+async def test_refreshes_from_redis_after_ttl(env_keys, clock):
+    server = fakeredis.FakeServer()
+    v = _verifier(server, ttl=30.0)
+    await v.start()
+    await v.stop()
+    # env keys are added to the shared set on start
+    assert await v._r.smembers("api_keys") == {b"old-key"}
+
+    await v._r.sadd("api_keys", "added-elsewhere")
+    clock.now += 29
+    assert not v.is_valid("added-elsewhere")
+    assert v._refreshing is None
+
+    clock.now += 2
+    # the expired lookup answers from the stale set and refreshes in the background
+    assert not v.is_valid("added-elsewhere")
+    await v._refreshing
+    assert v.is_valid("added-elsewhere")
+
+
+@pytest.mark.asyncio
+async def test_rotation_message_invalidates_other_instances(env_keys, clock):
+    server = fakeredis.FakeServer()
+    listener = _verifier(server)
+    other = fakeredis.aioredis.FakeRedis(server=server)
+    await listener.start()
+    try:
+        await _subscribed(other)
+        await other.sadd("api_keys", "rotated-in")
+        assert not listener.is_valid("rotated-in")
+        await other.publish(API_KEYS_CHANNEL, "1")
+        assert await _wait_for(lambda: listener.is_valid("rotated-in"))
+    finally:
+        await listener.stop()
+
+
+@pytest.mark.asyncio
+async def test_revoked_key_is_rejected_after_rotation(env_keys, clock, monkeypatch):
+    server = fakeredis.FakeServer()
+    rotating = _verifier(server)
+    peer = _verifier(server)
+    monkeypatch.setattr(auth, "key_verifier", rotating)
+    await peer.start()
+    # the rotating instance only needs the shared set, not a subscription
+    await rotating.refresh()
+    try:
+        await _subscribed(peer._r)
+        assert peer.is_valid("old-key") and rotating.is_valid("old-key")
+
+        assert await auth.set_api_keys(["new-key"])
+
+        assert not rotating.is_valid("old-key")
+        assert rotating.is_valid("new-key")
+        assert await rotating._r.smembers("api_keys") == {b"new-key"}
+        # the peer drops the revoked key once it sees the announcement
+        assert await _wait_for(lambda: not peer.is_valid("old-key"))
+        assert peer.is_valid("new-key")
+    finally:
+        await peer.stop()
@@ -0,0 +1,213 @@
+import sys
+import time
+import asyncio
+import pathlib
+import pytest
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+import src.auto_finalizer as auto_finalizer
+import src.callback_outbox as callback_outbox
+from src.callback_outbox import CallbackOutbox
+from src.session_store import SessionStore
+
+
+def _memory_store():
+    store = SessionStore()
+    store._use_redis = False
+    return store
+
+
+@pytest.fixture
+def outbox(monkeypatch):
+    box = CallbackOutbox()
+    box._use_redis = False
+    monkeypatch.setattr(auto_finalizer, "outbox", box)
+    return box
+
+
+async def _run_finalizer(store, until, timeout=5.0):
+    stop_event, task = auto_finalizer.start_background_loop(asyncio.get_running_loop(), store)
+    try:
+        deadline = time.time() + timeout
+        while not await until() and time.time() < deadline:
+            await asyncio.sleep(0.01)
+    finally:
+        stop_event.set()
+        await task
+
+
+@pytest.mark.asyncio
+async def test_only_due_sessions_are_finalized(monkeypatch, outbox):
+    sent = []
+
+    async def fake_send(payload, url=None):
+        sent.append(payload)
+        return {"status": "sent", "status_code": 200}
+
+    monkeypatch.setattr(auto_finalizer, "post_final_callback", fake_send)
+    store = _memory_store()
+    now = time.time()
+
+    intel = {"upiIds": ["scammer@upi"]}
+    await store.record_turn("due-now", [{"text": "pay scammer@upi"}], intel,
+                            finalize_due=auto_finalizer.next_finalize_due(1, intel, now))
+    await store.record_turn("quiet", [{"text": "hello"}], {},
+                            finalize_due=auto_finalizer.next_finalize_due(1, {}, now))
+
+    await _run_finalizer(store, lambda: store.is_finalized("due-now"))
+
+    assert [p["sessionId"] for p in sent] == ["due-now"]
+    assert sent[0]["agentNotes"] == "Auto-finalized by heuristic: extracted items found"
+    assert not await store.is_finalized("quiet")
+    # the quiet session stays queued for its idle deadline
+    assert await store.next_finalize_due() == pytest.approx(now + auto_finalizer.IDLE_SECONDS_TO_FINALIZE)
+    # delivered keys are not queued again
+    assert not await outbox.enqueue("due-now", {"sessionId": "due-now"})
+
+
+@pytest.mark.asyncio
+async def test_failed_callback_is_retried_then_dead_lettered(monkeypatch, outbox):
+    attempts = []
+
+    async def failing_send(payload, url=None):
+        attempts.append(payload["sessionId"])
+        return {"status": "failed", "error": "boom"}
+
+    monkeypatch.setattr(auto_finalizer, "post_final_callback", failing_send)
+    monkeypatch.setattr(callback_outbox, "OUTBOX_BACKOFF", 0.01)
+    outbox.max_attempts = 3
+    store = _memory_store()
+    await store.record_turn("retry-me", [{"text": "x"}], {"phoneNumbers": ["9876543210"]},
+                            finalize_due=time.time())
+
+    async def dead_lettered():
+        return bool(await outbox.dead_letters())
+
+    await _run_finalizer(store, dead_lettered)
+
+    assert attempts == ["retry-me"] * 3
+    assert not await store.is_finalized("retry-me")
+    dead = await outbox.dead_letters()
+    assert dead[0]["key"] == "retry-me" and dead[0]["error"] == "boom"
+
+    assert await outbox.replay() == 1
+    assert await outbox.pending_count() == 1
+    assert await outbox.dead_letters() == []
+
+
+@pytest.mark.asyncio
+async def test_slow_receiver_does_not_block_other_callbacks():
+    from src.callback_worker import CallbackDispatcher
+
+    release = asyncio.Event()
+    delivered = []
+
+    async def send(payload, url):
+        if "slow" in url:
+            await release.wait()
+        delivered.append(payload["sessionId"])
+        return {"status": "sent"}
+
+    dispatcher = CallbackDispatcher(send=send, concurrency=4, per_host=1, max_pending_per_host=2)
+    assert dispatcher.submit("a", {"sessionId": "a"}, url="http://slow.example/cb")
+    assert dispatcher.submit("b", {"sessionId": "b"}, url="http://slow.example/cb")
+    # per-host backpressure: a third pending callback for the slow host is refused
+    assert not dispatcher.submit("c", {"sessionId": "c"}, url="http://slow.example/cb")
+    release.set()
+    await dispatcher.drain(timeout=5)
+    assert sorted(delivered) == ["a", "b"]
+    await dispatcher.stop()
+
+
+@pytest.mark.asyncio
+async def test_hung_host_backlog_does_not_delay_other_hosts():
+    from src.callback_worker import CallbackDispatcher
+
+    release = asyncio.Event()
+    delivered = []
+
+    async def send(payload, url):
+        if "hung" in url:
+            await release.wait()
+        delivered.append(payload["sessionId"])
+        return {"status": "sent"}
+
+    # more callbacks queued for the hung host than there are workers
+    dispatcher = CallbackDispatcher(send=send, concurrency=2, per_host=1, max_pending_per_host=10)
+    for i in range(5):
+        assert dispatcher.submit(f"h{i}", {"sessionId": f"h{i}"}, url="http://hung.example/cb")
+    for i in range(3):
+        assert dispatcher.submit(f"f{i}", {"sessionId": f"f{i}"}, url="http://fast.example/cb")
+    for _ in range(20):
+        if len(delivered) == 3:
+            break
+        await asyncio.sleep(0.01)
+    assert delivered == ["f0", "f1", "f2"]
+    release.set()
+    await dispatcher.drain(timeout=5)
+    assert sorted(delivered) == ["f0", "f1", "f2", "h0", "h1", "h2", "h3", "h4"]
+    await dispatcher.stop()
+
+
+@pytest.mark.asyncio
+async def test_delivered_keys_are_forgotten_after_ttl_or_cap(monkeypatch, outbox):
+    monkeypatch.setattr(callback_outbox, "OUTBOX_DONE_MAX", 3)
+    for i in range(5):
+        await outbox.ack({"key": f"k{i}"})
+    assert list(outbox._done) == ["k2", "k3", "k4"]
+
+    # entries past the session TTL are dropped on the next ack
+    later = time.time() + callback_outbox.SESSION_TTL + 1
+    monkeypatch.setattr(callback_outbox.time, "time", lambda: later)
+    await outbox.ack({"key": "k5"})
+    assert list(outbox._done) == ["k5"]
+    assert await outbox.enqueue("k4", {"sessionId": "k4"})
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("backend", ["memory", "redis"])
+async def test_enqueue_replace_swaps_the_queued_payload(backend):
+    box = CallbackOutbox()
+    box._use_redis = False
+    if backend == "redis":
+        fakeredis = pytest.importorskip("fakeredis")
+        box._r = fakeredis.aioredis.FakeRedis()
+        box._enqueue_script = box._r.register_script(callback_outbox._ENQUEUE_LUA)
+        box._claim_script = box._r.register_script(callback_outbox._CLAIM_LUA)
+        box._use_redis = True
+
+    assert await box.enqueue("s1", {"agentNotes": "auto"})
+    # without replace the queued job is kept
+    assert not await box.enqueue("s1", {"agentNotes": "ignored"})
+    assert await box.enqueue("s1", {"agentNotes": "manual"}, replace=True)
+    assert await box.pending_count() == 1
+    jobs = await box.claim_due(now=time.time() + 1)
+    assert [j["payload"]["agentNotes"] for j in jobs] == ["manual"]
+
+    # delivered keys are never queued again, replace or not
+    await box.ack(jobs[0])
+    assert not await box.enqueue("s1", {"agentNotes": "late"}, replace=True)
+    # the Redis case never fell back to memory
+    assert box._use_redis == (backend == "redis")
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("backend", ["memory", "redis"])
+async def test_wrappers_keep_the_finalize_schedule(backend):
+    store = _memory_store()
+    if backend == "redis":
+        fakeredis = pytest.importorskip("fakeredis")
+        store._r = fakeredis.aioredis.FakeRedis()
+        store._use_redis = True
+
+    before = time.time()
+    await store.append_message("wrapped", {"text": "hello"})
+    due = await store.next_finalize_due()
+    assert due >= before + auto_finalizer.IDLE_SECONDS_TO_FINALIZE
+    assert await store.claim_due_sessions(now=time.time()) == []
+
+    # new intelligence makes the session due at its last message
+    await store.set_extracted("wrapped", {"upiIds": ["scammer@upi"]})
+    assert await store.next_finalize_due() < due
+    assert await store.claim_due_sessions(now=time.time()) == ["wrapped"]
+    assert store._use_redis == (backend == "redis")
@@ -0,0 +1,49 @@
+import sys
+import json
+import zlib
+import pathlib
+import pytest
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+from src import codec
+
+MSG = {"sender": "scammer", "text": "share your upi id", "timestamp": "2026-01-21T10:15:30Z"}
+
+
+@pytest.mark.parametrize("fmt", ["json", "msgpack"])
+def test_round_trip_is_tagged(monkeypatch, fmt):
+    if fmt == "msgpack":
+        pytest.importorskip("msgpack")
+    monkeypatch.setattr(codec, "STORE_CODEC", fmt)
+    raw = codec.encode(MSG)
+    assert raw[0] == (codec.TAG_MSGPACK if fmt == "msgpack" else codec.TAG_JSON)
+    assert codec.decode(raw) == MSG
+    assert codec.decode_many([raw] * 3) == [MSG] * 3
+
+
+def test_legacy_json_is_still_readable():
+    legacy = json.dumps(MSG)
+    assert codec.decode(legacy) == MSG
+    assert codec.decode(None) is None
+    tagged = codec.encode({"text": "new"})
+    assert codec.decode_many([legacy.encode(), tagged]) == [MSG, {"text": "new"}]
+    # archive chunks written before the codec were bare zlib JSON
+    assert codec.decode_chunk(zlib.compress(json.dumps([MSG]).encode())) == [MSG]
+
+
+def test_mixed_formats_decode_per_item(monkeypatch):
+    pytest.importorskip("msgpack")
+    monkeypatch.setattr(codec, "STORE_CODEC", "msgpack")
+    packed = codec.encode(MSG)
+    assert codec.decode_many([json.dumps(MSG), packed]) == [MSG, MSG]
+
+
+@pytest.mark.parametrize("compression", ["zlib", "zstd"])
+def test_chunk_round_trip(monkeypatch, compression):
+    if compression == "zstd":
+        pytest.importorskip("zstandard")
+    monkeypatch.setattr(codec, "STORE_COMPRESSION", compression)
+    blob = codec.encode_chunk([MSG] * 50)
+    assert blob[0] == (codec.TAG_ZSTD if compression == "zstd" else codec.TAG_ZLIB)
+    assert len(blob) < len(json.dumps([MSG] * 50))
+    assert codec.decode_chunk(blob) == [MSG] * 50
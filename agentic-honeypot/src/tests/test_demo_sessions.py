@@ -15,7 +15,7 @@ async def test_multi_turn_aggregation_and_finalize(monkeypatch):
     async def fake_send(payload):
         return {"status": "sent", "status_code": 200, "payload": payload}
 
-    monkeypatch.setattr(main_module, "send_final_callback", fake_send)
+    monkeypatch.setattr(main_module, "post_final_callback", fake_send)
 
     transport = ASGITransport(app=app)
     async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
@@ -49,3 +49,39 @@ async def test_multi_turn_aggregation_and_finalize(monkeypatch):
         rf = await client.post(f"/sessions/{session_id}/finalize", json=body, headers={"x-api-key": "secret-key"})
         assert rf.status_code == 200
         assert rf.json()["result"]["status"] == "sent"
+
+
+@pytest.mark.asyncio
+async def test_sessions_listing_is_paginated():
+    transport = ASGITransport(app=app)
+    headers = {"x-api-key": "secret-key"}
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        ids = [f"page-demo-{i}" for i in range(3)]
+        for sid in ids:
+            payload = {"sessionId": sid, "message": {"sender": "scammer", "text": "hello there"}}
+            r = await client.post("/events", json=payload, headers=headers)
+            assert r.status_code == 200
+
+        seen = []
+        summaries = {}
+        cursor = None
+        while True:
+            params = {"limit": 2, "sort": "lastSeen"}
+            if cursor:
+                params["cursor"] = cursor
+            r = await client.get("/sessions", params=params, headers=headers)
+            assert r.status_code == 200
+            j = r.json()
+            assert len(j["sessions"]) <= 2
+            seen.extend(s["sessionId"] for s in j["sessions"])
+            summaries.update((s["sessionId"], s) for s in j["sessions"])
+            cursor = j["nextCursor"]
+            if not cursor:
+                break
+        assert len(seen) == len(set(seen))
+        # ascending by last-seen, so the demo sessions appear in send order
+        assert [s for s in seen if s in ids] == ids
+        assert summaries[ids[-1]]["totalMessages"] == 1
+
+        r = await client.get("/sessions", params={"sort": "bogus"}, headers=headers)
+        assert r.status_code == 400
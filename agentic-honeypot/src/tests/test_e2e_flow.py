@@ -24,7 +24,7 @@ async def test_end_to_end_flow(monkeypatch):
     async def fake_send(payload):
         return {"status": "sent", "status_code": 200}
 
-    monkeypatch.setattr(main_module, "send_final_callback", fake_send)
+    monkeypatch.setattr(main_module, "post_final_callback", fake_send)
 
     transport = ASGITransport(app=app)
     async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
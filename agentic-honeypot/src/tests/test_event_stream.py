@@ -0,0 +1,110 @@
+import os
+import sys
+import json
+import asyncio
+import pathlib
+import pytest
+import httpx
+from httpx import ASGITransport
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+from src.main import app
+import src.main as main_module
+from src.agent import AgentOrchestrator
+from src.llm import LLMBackend
+from src.reply_cache import ReplyCache
+from src.metrics import StageTimer
+
+API_KEY = os.getenv("API_KEY", "secret-key")
+
+
+class ChunkedBackend(LLMBackend):
+    def __init__(self, chunks, stall_after=None):
+        super().__init__(timeout=5)
+        self.chunks = chunks
+        self.stall_after = stall_after
+
+    async def _complete(self, messages, max_tokens, temperature):
+        return "".join(self.chunks)
+
+    async def _stream(self, messages, max_tokens, temperature):
+        for i, chunk in enumerate(self.chunks):
+            if i == self.stall_after:
+                await asyncio.sleep(60)
+            yield chunk
+
+
+def _events(raw: str):
+    out = []
+    for block in raw.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        out.append((lines["event"], json.loads(lines["data"])))
+    return out
+
+
+async def _stream_event(session_id, text):
+    transport = ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        r = await client.post(
+            "/events?stream=true",
+            json={"sessionId": session_id, "message": {"sender": "scammer", "text": text}},
+            headers={"x-api-key": API_KEY},
+        )
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("text/event-stream")
+    return _events(r.text)
+
+
+@pytest.mark.asyncio
+async def test_stream_emits_analysis_tokens_then_done(monkeypatch):
+    backend = ChunkedBackend(["Oh dear, ", "which ", "button?"])
+    monkeypatch.setattr(main_module, "agent", AgentOrchestrator(backend=backend, reply_cache=ReplyCache(url=None)))
+
+    events = await _stream_event("stream-1", "urgent: share your upi id scammer@upi")
+
+    assert events[0][0] == "analysis"
+    assert events[0][1]["scamDetected"] is True
+    assert "scammer@upi" in events[0][1]["extractedIntelligence"]["upiIds"]
+    assert [d["text"] for e, d in events if e == "token"] == ["Oh dear, ", "which ", "button?"]
+    kind, done = events[-1]
+    assert kind == "done" and done["fallback"] is False
+    assert done["reply"] == "Oh dear, which button?"
+    history = await main_module.session_store.get_history("stream-1")
+    assert [m["text"] for m in history][-1] == "Oh dear, which button?"
+
+
+@pytest.mark.asyncio
+async def test_stalled_stream_falls_back_to_canned_reply(monkeypatch):
+    backend = ChunkedBackend(["Let me ", "see"], stall_after=1)
+    agent = AgentOrchestrator(backend=backend, reply_cache=ReplyCache(url=None))
+    monkeypatch.setattr(main_module, "agent", agent)
+    real_stream = agent.stream_reply
+
+    def fast_stall(*args, **kwargs):
+        return real_stream(*args, stall_timeout=0.05, **kwargs)
+
+    monkeypatch.setattr(agent, "stream_reply", fast_stall)
+
+    events = await _stream_event("stream-2", "verify now or your account will be blocked")
+
+    kind, done = events[-1]
+    assert kind == "done" and done["fallback"] is True
+    assert done["reply"] and done["reply"] != "Let me see"
+
+
+@pytest.mark.asyncio
+async def test_abandoned_stream_is_persisted_by_a_tracked_task():
+    body = {"sessionId": "stream-abandoned", "message": {"sender": "scammer", "text": "hello, who is this?"}}
+    response = await main_module.stream_event_logic(body, API_KEY, StageTimer())
+    events = response.body_iterator
+    assert (await events.__anext__()).startswith(b"event: analysis")
+    # the client disconnects before `done`
+    await events.aclose()
+
+    assert len(main_module._stream_writes) == 1
+    # what the lifespan drains on shutdown
+    await main_module._settle_stream_writes()
+    await main_module._settle_light_writes()
+    assert not main_module._stream_writes
+    history = await main_module.session_store.get_history("stream-abandoned")
+    assert [m["text"] for m in history] == ["hello, who is this?"]
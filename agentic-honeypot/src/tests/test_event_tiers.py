@@ -0,0 +1,89 @@
+import os
+import sys
+import pathlib
+import pytest
+import httpx
+from httpx import ASGITransport
+from prometheus_client import REGISTRY
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+from src.main import app, session_store
+import src.main as main_module
+
+API_KEY = os.getenv("API_KEY", "secret-key")
+
+
+def _tier(tier):
+    return REGISTRY.get_sample_value("honeypot_event_tier_total", {"tier": tier}) or 0.0
+
+
+async def _send(client, session_id, text):
+    r = await client.post(
+        "/events",
+        json={"sessionId": session_id, "message": {"sender": "scammer", "text": text}},
+        headers={"x-api-key": API_KEY},
+    )
+    assert r.status_code == 200
+    return r.json()
+
+
+@pytest.mark.asyncio
+async def test_benign_message_takes_light_tier():
+    before = _tier("light")
+    transport = ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        data = await _send(client, "tier-benign", "hello, how are you today?")
+    assert _tier("light") - before == 1
+    assert data["scamDetected"] is False
+    assert data["extractedIntelligence"] == {k: [] for k in main_module.INTEL_KEYS}
+
+    await main_module._settle_light_writes()
+    assert [m["text"] for m in await session_store.get_history("tier-benign")] == ["hello, how are you today?"]
+    assert await session_store.is_engaged("tier-benign") is False
+
+
+@pytest.mark.asyncio
+async def test_flagged_session_stays_on_full_tier():
+    transport = ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        await _send(client, "tier-engaged", "good morning")
+        await _send(client, "tier-engaged", "urgent: share your upi id scammer@upi")
+        before = _tier("full")
+        data = await _send(client, "tier-engaged", "ok thanks")
+    assert _tier("full") - before == 1
+    # earlier intelligence is still reported on a benign follow-up
+    assert "scammer@upi" in data["extractedIntelligence"]["upiIds"]
+    history = [m["text"] for m in await session_store.get_history("tier-engaged")]
+    assert history[0] == "good morning" and history[-1] == "ok thanks"
+
+
+@pytest.mark.asyncio
+async def test_scam_history_with_benign_latest_message_takes_full_tier():
+    before = _tier("light")
+    history = [
+        {"sender": "scammer", "text": "Send the fee to fraud@okaxis now", "timestamp": 1769776085000},
+        {"sender": "user", "text": "Who is this?", "timestamp": 1769776115000},
+        {"sender": "scammer", "text": "Call 9876543210, your account is blocked", "timestamp": 1769776145000},
+    ]
+    transport = ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        r = await client.post(
+            "/events",
+            json={
+                "sessionId": "tier-history-scam",
+                "message": {"sender": "scammer", "text": "ok thanks", "timestamp": 1769776175000},
+                "conversationHistory": history,
+            },
+            headers={"x-api-key": API_KEY},
+        )
+    assert r.status_code == 200
+    data = r.json()
+    assert _tier("light") == before
+    intel = data["extractedIntelligence"]
+    assert "fraud@okaxis" in intel["upiIds"]
+    assert any("9876543210" in p for p in intel["phoneNumbers"])
+    assert data["agentNotes"] != "No flags detected."
+    assert data["engagementMetrics"]["engagementDurationSeconds"] == 90
+    # stored for the auto-finalizer, with the history marked as scanned
+    assert "fraud@okaxis" in (await session_store.get_extracted("tier-history-scam"))["upiIds"]
+    assert await session_store.is_engaged("tier-history-scam")
@@ -0,0 +1,39 @@
+import os
+import sys
+import json
+import pathlib
+import pytest
+import httpx
+from httpx import ASGITransport
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+from src import fastjson
+from src.main import app
+
+API_KEY = os.getenv("API_KEY", "secret-key")
+VALUE = {"text": "पैसे भेजो", "n": [1, 2.5, None, True], "nested": {"k": "v"}}
+
+
+@pytest.mark.parametrize("use_orjson", [True, False])
+def test_dumps_matches_stdlib_compact_output(monkeypatch, use_orjson):
+    if use_orjson:
+        pytest.importorskip("orjson")
+    else:
+        monkeypatch.setattr(fastjson, "orjson", None)
+    expected = json.dumps(VALUE, ensure_ascii=False, separators=(",", ":")).encode()
+    assert fastjson.dumps(VALUE) == expected
+    assert fastjson.loads(expected) == VALUE
+
+
+@pytest.mark.asyncio
+async def test_events_body_is_parsed_and_rendered():
+    transport = ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        r = await client.post(
+            "/events",
+            content=fastjson.dumps({"sessionId": "fj-1", "message": {"sender": "scammer", "text": "send otp to 9876543210"}}),
+            headers={"x-api-key": API_KEY, "content-type": "application/json"},
+        )
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("application/json")
+    assert "9876543210" in r.json()["extractedIntelligence"]["phoneNumbers"]
@@ -0,0 +1,74 @@
+import sys
+import pathlib
+import pytest
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+from src.session_store import HISTORY_COMPACT_BATCH, HISTORY_HOT_WINDOW, SessionStore
+
+fakeredis = pytest.importorskip("fakeredis.aioredis")
+
+
+def _store():
+    store = SessionStore()
+    store._r = fakeredis.FakeRedis()
+    store._use_redis = True
+    return store
+
+
+@pytest.mark.asyncio
+async def test_compacted_history_reads_back_in_order():
+    store = _store()
+    sid = "compact-1"
+    # enough for several archive chunks on top of a full hot window
+    n = HISTORY_HOT_WINDOW + 3 * HISTORY_COMPACT_BATCH + 7
+    msgs = [{"sender": "scammer" if i % 2 == 0 else "agent", "text": f"m{i}"} for i in range(n)]
+    for i in range(0, n, 2):
+        await store.record_turn(sid, msgs[i:i + 2])
+
+    hot = await store._r.llen(f"session:{sid}:history")
+    assert await store._r.llen(f"session:{sid}:archive") >= 3
+    assert hot < HISTORY_HOT_WINDOW + HISTORY_COMPACT_BATCH
+
+    assert await store.get_history(sid) == msgs
+    assert await store.get_total_messages(sid) == n
+    state = await store.load_turn(sid)
+    assert state["total"] == n
+
+    # tails that fit in the hot list, reach one archive chunk, and span all of it
+    for k in (5, hot + 3, hot + HISTORY_COMPACT_BATCH + 3, n, n + 10):
+        assert await store.get_recent(sid, k) == msgs[-k:]
+        state = await store.load_turn(sid, include_history=True, history_limit=k)
+        assert state["history"] == msgs[-k:]
+    state = await store.load_turn(sid, include_history=True)
+    assert state["history"] == msgs
+
+    summary = (await store.get_session_summaries([(sid, 0.0)]))[0]
+    assert summary["totalMessages"] == n
+
+
+@pytest.mark.asyncio
+async def test_recent_read_is_consistent_when_compaction_runs_midway():
+    store = _store()
+    sid = "compact-2"
+    n = HISTORY_HOT_WINDOW + HISTORY_COMPACT_BATCH + 5
+    msgs = [{"text": f"m{i}"} for i in range(n)]
+    for i in range(0, n, 5):
+        await store.record_turn(sid, msgs[i:i + 5])
+    hot = await store._r.llen(f"session:{sid}:history")
+    k = hot + 3
+
+    real_lindex = store._r.lindex
+    more = [{"text": f"late{i}"} for i in range(HISTORY_COMPACT_BATCH)]
+
+    async def lindex_after_compaction(key, index):
+        # another writer appends and compacts between the hot-list read
+        # and the first archive read
+        if more:
+            batch = list(more)
+            more.clear()
+            await store.record_turn(sid, batch)
+            assert await store._r.llen(f"session:{sid}:archive") == 2
+        return await real_lindex(key, index)
+
+    store._r.lindex = lindex_after_compaction
+    assert await store.get_recent(sid, k) == msgs[-k:]
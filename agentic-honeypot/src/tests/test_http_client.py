@@ -0,0 +1,83 @@
+import sys
+import json
+import asyncio
+import pathlib
+import httpx
+import pytest
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+import src.auto_finalizer as auto_finalizer
+import src.callback_worker as callback_worker
+import src.logging_setup as logging_setup
+import src.main as main
+
+
+@pytest.fixture
+def built(monkeypatch):
+    """Replace the pooled client's transport and record every client built."""
+    clients = []
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(200, text="ok")
+
+    def build():
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        clients.append(client)
+        return client
+
+    monkeypatch.setattr(callback_worker, "_build_client", build)
+    monkeypatch.setattr(callback_worker, "_client", None)
+    yield clients, requests
+    # the lifespan stops the log writer on shutdown
+    logging_setup.configure_logging()
+
+
+@pytest.mark.asyncio
+async def test_lifespan_shares_one_client_and_closes_it(built):
+    clients, requests = built
+    async with main.lifespan(main.app):
+        assert len(clients) == 1
+        shared = clients[0]
+        assert callback_worker.get_http_client() is shared
+
+        # manual finalize and the auto-finalizer both deliver through it
+        results = await asyncio.gather(
+            main.post_final_callback({"sessionId": "m"}, "http://cb.example/final"),
+            auto_finalizer._deliver({"sessionId": "a"}, "http://cb.example/final"),
+            *(callback_worker.post_final_callback({"sessionId": f"s{i}"}, "http://cb.example/final")
+              for i in range(5)),
+        )
+        assert all(r["status"] == "sent" for r in results)
+        # the background finalizer may deliver sessions left by other tests too
+        sent = {json.loads(r.content)["sessionId"] for r in requests}
+        assert {"m", "a", "s0", "s4"} <= sent
+        assert len(clients) == 1
+        assert not shared.is_closed
+
+    assert shared.is_closed
+    assert callback_worker._client is None
+
+
+@pytest.mark.asyncio
+async def test_next_lifespan_cycle_builds_a_fresh_client(built):
+    clients, _ = built
+    async with main.lifespan(main.app):
+        pass
+    async with main.lifespan(main.app):
+        assert len(clients) == 2
+        assert callback_worker.get_http_client() is clients[1]
+        assert clients[0].is_closed and not clients[1].is_closed
+    assert clients[1].is_closed
+
+
+@pytest.mark.asyncio
+async def test_client_is_created_lazily_outside_the_lifespan(built):
+    clients, requests = built
+    result = await callback_worker.post_final_callback({"sessionId": "x"}, "http://cb.example/final")
+    assert result["status"] == "sent"
+    await callback_worker.post_final_callback({"sessionId": "y"}, "http://cb.example/final")
+    assert len(clients) == 1 and len(requests) == 2
+    await callback_worker.close_http_client()
+    assert clients[0].is_closed
@@ -0,0 +1,39 @@
+import os
+import sys
+import json
+import pathlib
+import subprocess
+
+# generous enough for a cold CI runner; importing transformers alone
+# takes several seconds
+IMPORT_BUDGET = float(os.getenv("IMPORT_BUDGET_SECONDS", "3"))
+HEAVY_MODULES = ["openai", "transformers", "torch"]
+
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import src.main
+print(json.dumps({
+    "seconds": time.perf_counter() - start,
+    "loaded": [m for m in %r if m in sys.modules],
+}))
+""" % (HEAVY_MODULES,)
+
+
+def test_app_import_is_fast_and_skips_optional_backends():
+    env = dict(os.environ)
+    for k in ("LLM_PROVIDER", "OPENAI_API_KEY"):
+        env.pop(k, None)
+    # a fresh interpreter, so nothing is already imported
+    out = subprocess.run(
+        [sys.executable, "-c", _PROBE],
+        cwd=str(pathlib.Path(__file__).resolve().parents[2]),
+        env=env,
+        capture_output=True,
+        text=True,
+        timeout=60,
+    )
+    assert out.returncode == 0, out.stderr
+    result = json.loads(out.stdout.strip().splitlines()[-1])
+    assert result["loaded"] == []
+    assert result["seconds"] < IMPORT_BUDGET, result
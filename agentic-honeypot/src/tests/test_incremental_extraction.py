@@ -0,0 +1,48 @@
+import sys
+import pathlib
+import pytest
+import httpx
+from httpx import ASGITransport
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+from src.main import app, extract_from_messages, make_watermark, resume_index
+
+TURNS = [
+    "Hello, this is your bank. Your account will be blocked.",
+    "Verify now by paying to refund.desk@okaxis",
+    "Or call +91 98765 43210 immediately",
+    "Use account 123456789012 for the transfer",
+    "Open http://kyc-update.example/login to verify",
+]
+
+
+def test_resume_index_detects_rewritten_history():
+    texts = TURNS[:3]
+    wm = make_watermark(texts)
+    assert resume_index(TURNS, wm) == 3
+    assert resume_index(TURNS[:2], wm) == 0
+    assert resume_index(["something else"] + TURNS[1:], make_watermark(["x"])) == 0
+
+
+@pytest.mark.asyncio
+async def test_incremental_matches_full_rescan():
+    transport = ASGITransport(app=app)
+    history = []
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        for text in TURNS:
+            payload = {
+                "sessionId": "incremental-extract-1",
+                "message": {"sender": "scammer", "text": text},
+                "conversationHistory": list(history),
+            }
+            r = await client.post("/events", json=payload, headers={"x-api-key": "secret-key"})
+            assert r.status_code == 200
+            j = r.json()
+            history.append({"sender": "scammer", "text": text})
+            if j.get("agentReply"):
+                history.append(j["agentReply"])
+
+    full = extract_from_messages([m["text"] for m in history])
+    got = j["extractedIntelligence"]
+    for k, v in full.items():
+        assert sorted(got[k]) == sorted(v)
@@ -0,0 +1,34 @@
+import sys
+import pathlib
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+from src.keyword_engine import KeywordEngine
+from src.main import SCAM_KEYWORDS, detect_scam
+
+
+def test_overlapping_hits_and_positions():
+    engine = KeywordEngine(["verify", "verify now", "bank account", "account blocked"])
+    text = "Please VERIFY NOW or your bank account blocked"
+    hits = engine.scan(text)
+    found = {(m.keyword, m.start, m.end) for m in hits}
+    assert ("verify", 7, 13) in found
+    assert ("verify now", 7, 17) in found
+    assert ("bank account", 26, 38) in found
+    assert ("account blocked", 31, 46) in found
+    for m in hits:
+        assert text.lower()[m.start:m.end] == m.keyword
+
+
+def test_matches_substring_semantics_of_keyword_list():
+    text = "URGENT: your account will be blocked. Verify now and share your UPI ID."
+    expected = [k for k in SCAM_KEYWORDS if k in text.lower()]
+    assert detect_scam(text)["matched_keywords"] == expected
+
+
+def test_reload_and_weights():
+    engine = KeywordEngine({"otp": 2.0, "refund": 0.5})
+    assert engine.matched("Send the OTP for your refund") == ["otp", "refund"]
+    assert engine.score("otp otp refund") == 2.5
+    engine.reload(["lottery"])
+    assert engine.matched("Send the OTP") == []
+    assert engine.matched("You won the lottery") == ["lottery"]
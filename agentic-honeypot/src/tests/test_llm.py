@@ -0,0 +1,257 @@
+import sys
+import types
+import contextlib
+import asyncio
+import pathlib
+import pytest
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+from src.llm import LLMBackend, LocalLLMBackend, OpenAIBackend, get_backend
+from src.agent import AgentOrchestrator
+from src.reply_cache import ReplyCache
+import src.agent as agent_module
+
+
+class SlowBackend(LLMBackend):
+    name = "slow"
+
+    def __init__(self, delay, **kwargs):
+        super().__init__(**kwargs)
+        self.delay = delay
+        self.active = 0
+        self.peak = 0
+        self.cancelled = 0
+
+    async def _complete(self, messages, max_tokens, temperature):
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            await asyncio.sleep(self.delay)
+            return "  hello dear  "
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        finally:
+            self.active -= 1
+
+
+@pytest.mark.asyncio
+async def test_timeout_cancels_the_call():
+    backend = SlowBackend(delay=5, timeout=0.05)
+    assert await backend.complete([{"role": "user", "content": "hi"}]) is None
+    assert backend.cancelled == 1 and backend.active == 0
+
+
+@pytest.mark.asyncio
+async def test_concurrency_is_limited_per_backend():
+    backend = SlowBackend(delay=0.02, concurrency=2, timeout=5)
+    results = await asyncio.gather(*(backend.complete([]) for _ in range(6)))
+    assert results == ["  hello dear  "] * 6
+    assert backend.peak == 2
+
+
+@pytest.mark.asyncio
+async def test_agent_falls_back_when_backend_times_out():
+    agent = AgentOrchestrator(backend=SlowBackend(delay=5, timeout=0.05))
+    reply = await agent.generate_reply("s1", [{"sender": "scammer", "text": "send your upi"}], {})
+    assert reply["sender"] == "agent" and reply["text"]
+
+
+def test_backend_must_implement_complete():
+    with pytest.raises(TypeError):
+        type("Incomplete", (LLMBackend,), {})()
+
+
+def test_openai_client_is_closed_when_the_loop_changes():
+    closed = []
+
+    class FakeAsyncOpenAI:
+        def __init__(self, http_client=None, **kwargs):
+            self.http_client = http_client
+
+        async def close(self):
+            closed.append(self)
+            await self.http_client.aclose()
+
+    backend = OpenAIBackend(api_key="test")
+    backend._sdk = types.SimpleNamespace(AsyncOpenAI=FakeAsyncOpenAI)
+
+    async def get_client():
+        return backend._get_client()
+
+    async def rebuild_then_close():
+        client = backend._get_client()
+        await backend.aclose()
+        return client
+
+    first = asyncio.run(get_client())
+    second = asyncio.run(rebuild_then_close())
+    assert second is not first
+    assert {id(c) for c in closed} == {id(first), id(second)}
+    assert first.http_client.is_closed
+
+
+def test_mock_provider_has_no_backend():
+    assert get_backend("mock", api_key="sk-test") is None
+    assert get_backend("", api_key=None) is None
+
+
+class ScriptedBackend(LLMBackend):
+    """The n-th call sleeps delays[n] seconds and returns replies[n]."""
+
+    def __init__(self, delays, replies, hedge_after=0.02):
+        super().__init__(timeout=5)
+        self.delays = delays
+        self.replies = replies
+        self.hedge_after = hedge_after
+        self.calls = 0
+
+    def hedge_delay(self):
+        return self.hedge_after
+
+    async def _complete(self, messages, max_tokens, temperature):
+        n = self.calls
+        self.calls += 1
+        await asyncio.sleep(self.delays[n])
+        return self.replies[n]
+
+
+@pytest.mark.asyncio
+async def test_hedged_request_wins_when_first_is_slow(monkeypatch):
+    monkeypatch.setattr(agent_module, "LLM_HEDGE", True)
+    backend = ScriptedBackend([1.0, 0.01], ["Slow reply, dear.", "Quick reply, dear."])
+    agent = AgentOrchestrator(backend=backend, reply_cache=ReplyCache(url=None))
+    reply = await agent.generate_reply("h1", [{"sender": "scammer", "text": "pay now"}], {})
+    assert reply["text"] == "Quick reply, dear."
+    assert backend.calls == 2
+    await agent.aclose()
+
+
+@pytest.mark.asyncio
+async def test_budget_returns_canned_reply_and_caches_late_result():
+    backend = ScriptedBackend([0.2], ["Which bank was it again?"])
+    agent = AgentOrchestrator(backend=backend, reply_cache=ReplyCache(url=None, variants=1))
+    convo = [{"sender": "scammer", "text": "verify your bank account"}]
+    started = asyncio.get_running_loop().time()
+    reply = await agent.generate_reply("b1", convo, {"replyDeadlineMs": 80})
+    assert asyncio.get_running_loop().time() - started < 0.15
+    assert reply["text"] != "Which bank was it again?"
+
+    # the late LLM reply lands in the cache and serves the next turn
+    await asyncio.gather(*agent._fill_tasks)
+    reply = await agent.generate_reply("b2", convo, {"replyDeadlineMs": 80})
+    assert reply["text"] == "Which bank was it again?"
+    assert backend.calls == 1
+    await agent.aclose()
+
+
+class FakeLocalBackend(LocalLLMBackend):
+    def __init__(self, **kwargs):
+        super().__init__(model_name="fake", **kwargs)
+        self._installed = True
+        self.batches = []
+
+    def _load(self):
+        return object(), object()
+
+    def _generate_batch(self, prompts, max_tokens, temperature):
+        self.batches.append(len(prompts))
+        return [f"reply {i}" for i in range(len(prompts))]
+
+
+@pytest.mark.asyncio
+async def test_local_backend_micro_batches_concurrent_prompts():
+    backend = FakeLocalBackend(batch_window_ms=50, max_batch=8)
+    await backend.start()
+    messages = [{"role": "system", "content": "persona"}, {"role": "user", "content": "hi"}]
+    results = await asyncio.gather(*(backend.complete(messages) for _ in range(6)))
+    assert sorted(results) == sorted(f"reply {i}" for i in range(6))
+    # the warm-up generation, then the six prompts in one batch
+    assert backend.batches == [1, 6]
+    await backend.aclose()
+
+
+class _Ids(list):
+    """The slice of a 2-D tensor `_generate_batch` uses: `.shape` and `[:, n:]`."""
+
+    @property
+    def shape(self):
+        return (len(self), len(self[0]) if self else 0)
+
+    def __getitem__(self, index):
+        if isinstance(index, tuple):
+            rows, cols = index
+            return _Ids(row[cols] for row in list.__getitem__(self, rows))
+        return list.__getitem__(self, index)
+
+
+class _WordTokenizer:
+    """One token per whitespace-separated word, honouring padding/truncation sides."""
+
+    padding_side = "right"
+    truncation_side = "right"
+    pad_token = None
+    eos_token = "<eos>"
+    pad_token_id = 0
+
+    def __call__(self, prompts, return_tensors=None, padding=False, truncation=False, max_length=None):
+        rows = []
+        for p in prompts:
+            ids = p.split()
+            if truncation and max_length and len(ids) > max_length:
+                ids = ids[-max_length:] if self.truncation_side == "left" else ids[:max_length]
+            rows.append(ids)
+        width = max(len(r) for r in rows)
+        if self.padding_side == "left":
+            rows = [["<pad>"] * (width - len(r)) + r for r in rows]
+        else:
+            rows = [r + ["<pad>"] * (width - len(r)) for r in rows]
+        return {"input_ids": _Ids(rows)}
+
+    def batch_decode(self, rows, skip_special_tokens=True):
+        return [" ".join(r) for r in rows]
+
+
+class _EchoModel:
+    def __init__(self):
+        self.inputs = None
+
+    def to(self, device):
+        return self
+
+    def eval(self):
+        return self
+
+    def generate(self, input_ids, max_new_tokens, pad_token_id, **sampling):
+        self.inputs = input_ids
+        # reply with the last word the model was shown
+        return _Ids(row + [f"re:{row[-2]}"] for row in input_ids)
+
+
+def test_long_local_prompts_keep_their_end(monkeypatch):
+    model = _EchoModel()
+    fake_torch = types.SimpleNamespace(set_num_threads=lambda n: None, no_grad=contextlib.nullcontext)
+    fake_transformers = types.SimpleNamespace(
+        AutoTokenizer=types.SimpleNamespace(from_pretrained=lambda name: _WordTokenizer()),
+        AutoModelForCausalLM=types.SimpleNamespace(from_pretrained=lambda name: model),
+    )
+    monkeypatch.setitem(sys.modules, "torch", fake_torch)
+    monkeypatch.setitem(sys.modules, "transformers", fake_transformers)
+
+    backend = LocalLLMBackend(model_name="fake")
+    backend._model = backend._load()
+    old = " ".join(f"old{i}" for i in range(600))
+    long_prompt = backend._prompt([
+        {"role": "system", "content": "persona"},
+        {"role": "user", "content": old + " newest-scammer-message"},
+    ])
+    short_prompt = backend._prompt([{"role": "user", "content": "hi"}])
+    assert len(long_prompt.split()) > backend.max_prompt_tokens
+
+    replies = backend._generate_batch([long_prompt, short_prompt], max_tokens=5, temperature=0)
+
+    long_ids = [t for t in model.inputs[0] if t != "<pad>"]
+    assert len(long_ids) == backend.max_prompt_tokens
+    assert long_ids[-2:] == ["newest-scammer-message", "Martha:"]
+    assert model.inputs[1][-2:] == ["hi", "Martha:"]
+    assert replies == ["re:newest-scammer-message", "re:hi"]
@@ -0,0 +1,68 @@
+import io
+import sys
+import json
+import queue
+import logging
+import pathlib
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+import src.logging_setup as logging_setup
+from src.logging_setup import JsonFormatter, _DroppingQueueHandler, sample_body
+
+
+def _record(msg, *args, **extra):
+    record = logging.LogRecord("agentic-honeypot", logging.INFO, __file__, 1, msg, args, None)
+    record.__dict__.update(extra)
+    return record
+
+
+def test_json_formatter_includes_extra_fields():
+    line = JsonFormatter().format(_record("hello %s", "world", path="/events", status="200"))
+    out = json.loads(line)
+    assert out["msg"] == "hello world"
+    assert out["level"] == "INFO"
+    assert out["path"] == "/events" and out["status"] == "200"
+
+
+def test_full_queue_drops_instead_of_blocking():
+    handler = _DroppingQueueHandler(queue.Queue(maxsize=1))
+    before = _DroppingQueueHandler.dropped
+    handler.handle(_record("first"))
+    handler.handle(_record("second"))
+    assert handler.queue.qsize() == 1
+    assert _DroppingQueueHandler.dropped == before + 1
+
+
+def test_sample_body_respects_level_rate_and_cap(monkeypatch):
+    logger = logging.getLogger("test-sample-body")
+    logger.setLevel(logging.INFO)
+    monkeypatch.setattr(logging_setup, "LOG_BODY_SAMPLE_RATE", 1.0)
+    assert sample_body(b"{}", logger) is None
+
+    logger.setLevel(logging.DEBUG)
+    monkeypatch.setattr(logging_setup, "LOG_BODY_MAX_BYTES", 4)
+    assert sample_body(b"abcdefgh", logger) == "abcd...[4 more]"
+
+    monkeypatch.setattr(logging_setup, "LOG_BODY_SAMPLE_RATE", 0.0)
+    assert sample_body(b"abcdefgh", logger) is None
+
+
+def test_logging_restarts_after_stop(monkeypatch):
+    logger = logging.getLogger("test-logging-restart")
+    out = io.StringIO()
+    # one lifespan cycle has ended
+    logging_setup.stop_logging()
+    try:
+        logger.warning("between cycles")
+        monkeypatch.setattr(sys, "stdout", out)
+        # the next cycle starts the writer again on the same queue
+        logging_setup.configure_logging()
+        logger.warning("second cycle")
+        logging_setup.stop_logging()
+        lines = out.getvalue().splitlines()
+        assert len(lines) == 2
+        assert lines[0].endswith("between cycles") and lines[1].endswith("second cycle")
+    finally:
+        logging_setup.stop_logging()
+        monkeypatch.undo()
+        logging_setup.configure_logging()
@@ -0,0 +1,96 @@
+import sys
+import time
+import pathlib
+import pytest
+from prometheus_client import REGISTRY
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+from src.memory_store import MemorySessions
+from src.session_store import SessionStore
+
+
+def _msg(i, size=10):
+    return {"sender": "scammer", "text": str(i) * size}
+
+
+def test_history_cap_keeps_total_count():
+    mem = MemorySessions(ttl=60, history_cap=3)
+    mem.append("s", [_msg(i) for i in range(5)], time.time())
+    s = mem.get("s")
+    assert [m["text"][0] for m in s.history] == ["2", "3", "4"]
+    assert s.total == 5
+    assert mem.nbytes == s.nbytes
+
+
+def test_least_recently_written_sessions_are_evicted():
+    evicted = []
+    mem = MemorySessions(ttl=60, max_sessions=2, on_evict=evicted.append)
+    now = time.time()
+    mem.append("a", [_msg(1)], now)
+    mem.append("b", [_msg(2)], now)
+    mem.append("a", [_msg(3)], now)
+    mem.append("c", [_msg(4)], now)
+    assert evicted == ["b"]
+    assert mem.get("b") is None and mem.get("a") is not None
+
+
+def test_byte_budget_evicts_oldest():
+    mem = MemorySessions(ttl=60, max_bytes=3000)
+    now = time.time()
+    for sid in ("a", "b", "c"):
+        mem.append(sid, [_msg(1, size=800)], now)
+    assert mem.get("a") is None
+    assert mem.nbytes <= 3000
+
+
+def test_only_the_exported_store_reports_metrics():
+    def evictions():
+        return REGISTRY.get_sample_value("honeypot_memory_evictions_total", {"reason": "capacity"}) or 0.0
+
+    app_store = MemorySessions(ttl=60, max_sessions=1)
+    other = MemorySessions(ttl=60, max_sessions=1)
+    app_store.export_metrics()
+    before = evictions()
+    now = time.time()
+    app_store.append("a", [_msg(1)], now)
+    for i in range(5):
+        other.append(f"o{i}", [_msg(i)], now)
+    assert other.evictions == {"capacity": 4}
+    assert evictions() == before
+    assert REGISTRY.get_sample_value("honeypot_memory_sessions") == 1
+    assert REGISTRY.get_sample_value("honeypot_memory_bytes") == app_store.nbytes
+
+    app_store.append("b", [_msg(2)], now)
+    assert evictions() == before + 1
+
+
+def test_ttl_expiry():
+    mem = MemorySessions(ttl=60)
+    mem.append("old", [_msg(1)], time.time())
+    mem.get("old").touched -= 120
+    mem.append("new", [_msg(2)], time.time())
+    assert mem.expire() == 1
+    assert [sid for sid, _ in mem.index()] == ["new"]
+
+
+@pytest.mark.asyncio
+async def test_store_forgets_finalize_schedule_of_evicted_sessions():
+    store = SessionStore()
+    store._use_redis = False
+    store._mem.max_sessions = 1
+    now = time.time()
+    await store.record_turn("first", [_msg(1)], {"upiIds": ["a@upi"]}, finalize_due=now)
+    await store.record_turn("second", [_msg(2)], {}, finalize_due=now)
+    assert await store.get_total_messages("first") == 0
+    assert await store.claim_due_sessions(now + 1) == ["second"]
+
+
+@pytest.mark.asyncio
+async def test_recent_reads_only_the_tail():
+    store = SessionStore()
+    store._use_redis = False
+    await store.record_turn("tail", [_msg(i, size=1) for i in range(12)], {})
+    assert [m["text"] for m in await store.get_recent("tail", 3)] == ["9", "10", "11"]
+    state = await store.load_turn("tail", include_history=True, history_limit=8)
+    assert state["total"] == 12 and len(state["history"]) == 8
+    assert len((await store.load_turn("tail", include_history=True))["history"]) == 12
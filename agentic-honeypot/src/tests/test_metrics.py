@@ -0,0 +1,49 @@
+import os
+import sys
+import pathlib
+import pytest
+import httpx
+from httpx import ASGITransport
+from prometheus_client import REGISTRY
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+from src.main import app
+
+API_KEY = os.getenv("API_KEY", "secret-key")
+
+
+def _sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+@pytest.mark.asyncio
+async def test_requests_are_labeled_by_route_template():
+    before = _sample("honeypot_requests_total", endpoint="/sessions/{session_id}", method="GET", status="200")
+    transport = ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        for sid in ("metrics-a", "metrics-b", "metrics-c"):
+            await client.get(f"/sessions/{sid}", headers={"x-api-key": API_KEY})
+        await client.get("/no-such-route")
+
+    after = _sample("honeypot_requests_total", endpoint="/sessions/{session_id}", method="GET", status="200")
+    assert after - before == 3
+    assert _sample("honeypot_requests_total", endpoint="/sessions/metrics-a", method="GET", status="200") == 0
+    assert _sample("honeypot_requests_total", endpoint="unmatched", method="GET", status="404") >= 1
+    assert _sample("honeypot_request_latency_seconds_count", endpoint="/sessions/{session_id}", method="GET") >= 3
+
+
+@pytest.mark.asyncio
+async def test_events_records_stage_timings():
+    stages = ("parse", "detect", "extract", "store", "agent", "serialize")
+    before = {s: _sample("honeypot_event_stage_seconds_count", stage=s) for s in stages}
+    transport = ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        r = await client.post(
+            "/events",
+            json={"sessionId": "metrics-stages", "message": {"sender": "scammer", "text": "urgent: verify now"}},
+            headers={"x-api-key": API_KEY},
+        )
+    assert r.status_code == 200
+    for s in stages:
+        # one sample per request, even for stages entered more than once
+        assert _sample("honeypot_event_stage_seconds_count", stage=s) - before[s] == 1
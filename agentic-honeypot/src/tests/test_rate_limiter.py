@@ -0,0 +1,79 @@
+import sys
+import time
+import random
+import pathlib
+import pytest
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+from src.rate_limiter import RateLimiter
+import src.rate_limiter as rate_limiter_module
+
+
+@pytest.mark.asyncio
+async def test_token_bucket_limits_bursts_and_refills():
+    limiter = RateLimiter(rate_per_min=60, burst=5, url=None)
+    results = [await limiter.allow("k") for _ in range(7)]
+    assert results == [True] * 5 + [False] * 2
+    # other keys have their own bucket
+    assert await limiter.allow("other")
+
+    # one token per second refills
+    limiter._local["k"].ts -= 2.0
+    assert await limiter.allow("k")
+    assert await limiter.allow("k")
+    assert not await limiter.allow("k")
+
+
+@pytest.mark.asyncio
+async def test_idle_buckets_are_evicted():
+    limiter = RateLimiter(rate_per_min=60, burst=5, max_keys=3, url=None)
+    for i in range(5):
+        await limiter.allow(f"k{i}")
+    # LRU cap
+    assert list(limiter._local) == ["k2", "k3", "k4"]
+    assert limiter.evict_idle(time.time() + 10) == 3
+    assert not limiter._local
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+
+def _shared_limiters(monkeypatch, n, **kwargs):
+    fakeredis = pytest.importorskip("fakeredis")
+    clock = _Clock()
+    monkeypatch.setattr(rate_limiter_module, "time", clock)
+    server = fakeredis.FakeServer()
+    limiters = []
+    for _ in range(n):
+        limiter = RateLimiter(url=None, **kwargs)
+        limiter._r = fakeredis.aioredis.FakeRedis(server=server)
+        limiter._script = limiter._r.register_script(rate_limiter_module._TOKEN_BUCKET_LUA)
+        limiter._use_redis = True
+        limiters.append(limiter)
+    return clock, limiters
+
+
+@pytest.mark.asyncio
+async def test_leases_return_unspent_tokens(monkeypatch):
+    # 5 workers sharing a 2000/min limit, ~10 rps arriving at random workers:
+    # well under the limit, so nothing may be denied
+    clock, limiters = _shared_limiters(monkeypatch, 5, rate_per_min=2000, burst=2000, lease=20, lease_ttl=1)
+    rnd = random.Random(1)
+    denied = 0
+    for _ in range(3000):
+        clock.now += rnd.expovariate(10)
+        denied += not await limiters[rnd.randrange(5)].allow("k")
+    assert denied == 0
+
+
+@pytest.mark.asyncio
+async def test_empty_lease_recovers_once_tokens_refill(monkeypatch):
+    clock, (limiter,) = _shared_limiters(monkeypatch, 1, rate_per_min=60, burst=2, lease=2, lease_ttl=30)
+    assert [await limiter.allow("k") for _ in range(3)] == [True, True, False]
+    clock.now += 1.1
+    assert await limiter.allow("k")
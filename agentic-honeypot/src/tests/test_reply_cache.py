@@ -0,0 +1,72 @@
+import sys
+import asyncio
+import pathlib
+import pytest
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+from src.reply_cache import ReplyCache, context_key
+from src.llm import LLMBackend
+from src.agent import AgentOrchestrator, SYSTEM_PROMPT
+
+
+def _cache(**kwargs):
+    return ReplyCache(url=None, **kwargs)
+
+
+class CountingBackend(LLMBackend):
+    def __init__(self, replies):
+        super().__init__(timeout=5)
+        self.replies = list(replies)
+        self.calls = 0
+
+    async def _complete(self, messages, max_tokens, temperature):
+        self.calls += 1
+        return self.replies[(self.calls - 1) % len(self.replies)]
+
+
+def test_campaign_variants_share_a_key():
+    a = [{"sender": "scammer", "text": "Your account 12345678 is blocked! Pay to fraud@upi via http://x.io/a"}]
+    b = [{"sender": "scammer", "text": "your account 99887766 is BLOCKED.  Pay to other@okbank via https://y.co/b"}]
+    c = [{"sender": "scammer", "text": "Your account is fine"}]
+    assert context_key(a, "persona") == context_key(b, "persona")
+    assert context_key(a, "persona") != context_key(c, "persona")
+    assert context_key(a, "persona") != context_key(a, "other persona")
+
+
+@pytest.mark.asyncio
+async def test_lru_ttl_and_specific_replies():
+    cache = _cache(max_keys=2, ttl=60, variants=2)
+    assert not await cache.put("k", "Please read me the 10 digit number 9876543210 again")
+    assert await cache.put("k1", "Can you say that again, dear?")
+    assert await cache.put("k2", "Which app do I open?")
+    assert await cache.put("k3", "My glasses are missing.")
+    # least recently used key evicted
+    assert await cache.variants_for("k1") == []
+    assert await cache.put("k3", "Hold on, the cat is on the keyboard.")
+    assert len(await cache.variants_for("k3")) == 2
+    cache.ttl = -1
+    await cache.put("k4", "Oh dear.")
+    assert await cache.variants_for("k4") == []
+
+
+@pytest.mark.asyncio
+async def test_agent_serves_cached_reply_and_fills_variants():
+    backend = CountingBackend(["What was the next step, dear?", "Is it the blue button?"])
+    agent = AgentOrchestrator(backend=backend, reply_cache=_cache(variants=2))
+    first = [{"sender": "scammer", "text": "Send Rs 500 to scam1@upi now"}]
+    second = [{"sender": "scammer", "text": "Send Rs 900 to scam2@upi now"}]
+
+    r1 = await agent.generate_reply("s1", first, {})
+    assert r1["text"] == "What was the next step, dear?" and backend.calls == 1
+
+    r2 = await agent.generate_reply("s2", second, {})
+    assert r2["text"] == "What was the next step, dear?"
+    # the hit was served from cache; a second variant is generated in the background
+    await asyncio.gather(*agent._fill_tasks)
+    assert backend.calls == 2
+    assert len(await agent.reply_cache.variants_for(context_key(first, SYSTEM_PROMPT))) == 2
+
+    r3 = await agent.generate_reply("s3", second, {})
+    assert r3["text"] in ("What was the next step, dear?", "Is it the blue button?")
+    assert backend.calls == 2
+    await agent.aclose()
@@ -0,0 +1,131 @@
+import sys
+import pathlib
+import pytest
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+import src.memory_store as memory_store
+import src.session_store as session_store_module
+from src.session_store import SESSION_INDEX_KEY, SessionStore
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    c = _Clock()
+    monkeypatch.setattr(session_store_module, "time", c)
+    monkeypatch.setattr(memory_store, "time", c)
+    return c
+
+
+@pytest.fixture(params=["memory", "redis"])
+def backend(request):
+    return request.param
+
+
+@pytest.fixture
+def store(backend):
+    s = SessionStore()
+    s._use_redis = False
+    if backend == "redis":
+        fakeredis = pytest.importorskip("fakeredis.aioredis")
+        s._r = fakeredis.FakeRedis()
+        s._use_redis = True
+    return s
+
+
+async def _seen_at(store, clock, session_id, ts):
+    clock.now = ts
+    await store.record_turn(session_id, [{"text": f"from {session_id}"}])
+
+
+async def _all_pages(store, **kwargs):
+    rows, cursor, pages = [], None, 0
+    while True:
+        page, cursor = await store.scan_sessions(cursor=cursor, limit=2, **kwargs)
+        assert len(page) <= 2
+        rows.extend(page)
+        pages += 1
+        if cursor is None:
+            return rows, pages
+        assert pages < 20
+
+
+@pytest.mark.asyncio
+async def test_pages_step_over_equal_scores(store, backend, clock):
+    for sid in ["s3", "s0", "s4", "s1", "s2"]:
+        await _seen_at(store, clock, sid, 1000.0)
+    await _seen_at(store, clock, "later", 1001.0)
+
+    rows, pages = await _all_pages(store)
+    assert rows == [("later", 1001.0)] + [(f"s{i}", 1000.0) for i in (4, 3, 2, 1, 0)]
+    assert pages >= 3
+
+    rows, _ = await _all_pages(store, descending=False)
+    assert [sid for sid, _ in rows] == ["s0", "s1", "s2", "s3", "s4", "later"]
+    # the Redis case never fell back to memory
+    assert store._use_redis == (backend == "redis")
+
+
+@pytest.mark.asyncio
+async def test_since_and_until_bound_the_range(store, clock):
+    for i, ts in enumerate([1000.0, 1010.0, 1020.0, 1030.0]):
+        await _seen_at(store, clock, f"t{i}", ts)
+
+    rows, _ = await _all_pages(store, since=1010.0, until=1020.0)
+    assert rows == [("t2", 1020.0), ("t1", 1010.0)]
+    rows, _ = await _all_pages(store, since=1015.0, descending=False)
+    assert [sid for sid, _ in rows] == ["t2", "t3"]
+    rows, _ = await _all_pages(store, until=1005.0)
+    assert [sid for sid, _ in rows] == ["t0"]
+
+
+@pytest.mark.asyncio
+async def test_prune_removes_stale_index_entries(store, backend, clock):
+    await _seen_at(store, clock, "stale", 1000.0)
+    await _seen_at(store, clock, "fresh", 2000.0)
+
+    assert await store.prune_sessions(older_than=1500.0) == 1
+    rows, _ = await _all_pages(store)
+    assert rows == [("fresh", 2000.0)]
+    if backend == "redis":
+        assert await store._r.zscore(SESSION_INDEX_KEY, "stale") is None
+    else:
+        assert await store.get_history("stale") == []
+
+
+@pytest.mark.asyncio
+async def test_rebuild_indexes_existing_sessions(clock):
+    fakeredis = pytest.importorskip("fakeredis.aioredis")
+    store = SessionStore()
+    store._r = fakeredis.FakeRedis()
+    store._use_redis = True
+    for i in range(7):
+        await _seen_at(store, clock, f"r{i}", 1000.0 + i)
+    # a session written before the index existed, without a last-seen key
+    await store._r.rpush("session:legacy:history", b'{"text": "old"}')
+    await store._r.delete(SESSION_INDEX_KEY)
+    assert await store.scan_sessions() == ([], None)
+
+    clock.now = 5000.0
+    assert await store.rebuild_session_index(batch=3) == 8
+    rows, _ = await _all_pages(store)
+    assert rows[0] == ("legacy", 5000.0)
+    assert rows[1:] == [(f"r{i}", 1000.0 + i) for i in reversed(range(7))]
+    assert store._use_redis
+
+
+@pytest.mark.asyncio
+async def test_rebuild_is_a_no_op_without_redis(clock):
+    store = SessionStore()
+    store._use_redis = False
+    await _seen_at(store, clock, "m0", 1000.0)
+    assert await store.rebuild_session_index() == 0
+    # the in-memory index is always complete
+    assert await store.scan_sessions() == ([("m0", 1000.0)], None)
@@ -0,0 +1,78 @@
+import sys
+import time
+import asyncio
+import pathlib
+import pytest
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+from src.session_store import FINALIZE_DUE_KEY, SessionStore
+
+fakeredis = pytest.importorskip("fakeredis.aioredis")
+
+
+async def _store():
+    store = SessionStore(write_behind=True)
+    store._r = fakeredis.FakeRedis()
+    store._use_redis = True
+    await store.start()
+    return store
+
+
+@pytest.mark.asyncio
+async def test_buffered_writes_are_visible_before_flush():
+    store = await _store()
+    await store.record_turn("wb-1", [{"text": "hi"}], {"upiIds": ["a@upi"]}, {"n": 1})
+    assert await store._r.llen("session:wb-1:history") == 0
+    state = await store.load_turn("wb-1", include_history=True, history_limit=8)
+    assert state["total"] == 1 and state["history"] == [{"text": "hi"}]
+    assert state["extracted"] == {"upiIds": ["a@upi"]}
+    assert store.buffer_lag() > 0
+
+    await store.flush()
+    assert await store._r.llen("session:wb-1:history") == 1
+    # nothing is counted twice once it is in Redis
+    assert await store.get_total_messages("wb-1") == 1
+    assert store.buffer_lag() == 0
+    await store.aclose()
+
+
+@pytest.mark.asyncio
+async def test_reads_racing_a_flush_count_each_message_once():
+    store = await _store()
+    await store.record_turn("wb-2", [{"text": "a"}, {"text": "b"}])
+    totals = await asyncio.gather(
+        store.get_total_messages("wb-2"), store.flush(), store.get_total_messages("wb-2")
+    )
+    assert totals[0] == totals[2] == 2
+    await store.aclose()
+
+
+@pytest.mark.asyncio
+async def test_close_flushes_and_due_sessions_are_claimable():
+    store = await _store()
+    now = time.time()
+    await store.record_turn("wb-3", [{"text": "x"}], finalize_due=now - 1)
+    assert await store.claim_due_sessions(now) == ["wb-3"]
+    await store.record_turn("wb-4", [{"text": "y"}])
+    await store.aclose()
+    assert await store._r.llen("session:wb-4:history") == 1
+
+
+@pytest.mark.asyncio
+async def test_finalized_session_is_not_requeued_by_a_later_flush():
+    store = await _store()
+    now = time.time()
+    await store.record_turn("wb-5", [{"text": "first"}], finalize_due=now + 60)
+    await store.flush()
+    # a second turn is still buffered when the session is finalized
+    await store.record_turn("wb-5", [{"text": "second"}], finalize_due=now - 1)
+    await store.mark_finalized("wb-5")
+    assert await store.next_finalize_due() is None
+
+    await store.flush()
+    assert await store._r.zscore(FINALIZE_DUE_KEY, "wb-5") is None
+    assert await store.claim_due_sessions(now + 120) == []
+    # the buffered messages themselves still reach Redis
+    assert await store._r.llen("session:wb-5:history") == 2
+    assert await store.is_finalized("wb-5")
+    await store.aclose()
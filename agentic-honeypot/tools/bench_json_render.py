@@ -0,0 +1,85 @@
+"""Microbenchmark: stdlib JSON vs `src.fastjson` on `/events` payloads.
+
+Times parsing a request body and rendering a response for the sample
+payload in `verify_locally.py`, with its conversation history padded to
+`--history` messages.
+
+Usage:
+  python tools/bench_json_render.py [--history 20] [--number 20000]
+"""
+import os
+import sys
+import json
+import timeit
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from starlette.responses import JSONResponse  # noqa: E402
+
+from src import fastjson  # noqa: E402
+from src.fastjson import FastJSONResponse  # noqa: E402
+from verify_locally import PAYLOAD  # noqa: E402
+
+TURNS = [
+    "Your bank account will be blocked today. Verify immediately.",
+    "Oh dear, which bank is this? I have two accounts.",
+    "Share your UPI id and the OTP we sent to confirm your identity.",
+    "I am not very good with these phones. Where do I find the OTP?",
+    "Click http://secure-kyc-update.example/verify and enter your card details.",
+]
+
+
+def build_request(history: int) -> bytes:
+    body = dict(PAYLOAD)
+    body["conversationHistory"] = [
+        {
+            "sender": "scammer" if i % 2 == 0 else "user",
+            "text": TURNS[i % len(TURNS)],
+            "timestamp": 1769776085000 + i * 30000,
+        }
+        for i in range(history)
+    ]
+    return json.dumps(body).encode("utf-8")
+
+
+def build_response(history: int) -> dict:
+    return {
+        "status": "success",
+        "reply": "Oh dear, my grandson usually helps me with this. Which button do I press?",
+        "scamDetected": True,
+        "engagementMetrics": {"engagementDurationSeconds": history * 30, "totalMessagesExchanged": history + 1},
+        "extractedIntelligence": {
+            "bankAccounts": ["123456789012"],
+            "upiIds": ["verify.kyc@okaxis"],
+            "phishingLinks": ["http://secure-kyc-update.example/verify"],
+            "phoneNumbers": ["+919876543210"],
+            "suspiciousKeywords": ["blocked", "verify", "otp", "upi", "urgent"],
+        },
+        "agentNotes": "Matched keywords: blocked, verify, otp; Extracted possible intelligence items.",
+    }
+
+
+def bench(label: str, baseline, fast, number: int):
+    base = min(timeit.repeat(baseline, number=number, repeat=3)) / number * 1e6
+    quick = min(timeit.repeat(fast, number=number, repeat=3)) / number * 1e6
+    print(f"{label:<16} stdlib {base:8.2f} us   fastjson {quick:8.2f} us   x{base / quick:5.2f}")
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--history", type=int, default=20, help="messages in conversationHistory")
+    p.add_argument("--number", type=int, default=20000, help="iterations per measurement")
+    args = p.parse_args()
+
+    raw = build_request(args.history)
+    response = build_response(args.history)
+    backend = "orjson" if fastjson.orjson is not None else "stdlib fallback"
+    print(f"fastjson backend: {backend}; request {len(raw)} bytes, history {args.history}")
+    bench("parse body", lambda: json.loads(raw), lambda: fastjson.loads(raw), args.number)
+    bench("render reply", lambda: JSONResponse(response), lambda: FastJSONResponse(response), args.number)
+
+
+if __name__ == "__main__":
+    main()
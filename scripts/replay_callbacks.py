@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""Inspect and replay dead-lettered final-result callbacks.
+
+Usage:
+  python scripts/replay_callbacks.py --url http://127.0.0.1:8000 --admin-key KEY list
+  python scripts/replay_callbacks.py --url http://127.0.0.1:8000 --admin-key KEY replay [SESSION_ID ...]
+
+`list` calls GET /admin/callbacks; `replay` calls POST /admin/callbacks/replay,
+re-queueing the given sessions (or every dead letter when none are given).
+"""
+import argparse
+import json
+import sys
+import requests
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--url", required=True, help="Base URL of backend (e.g. http://127.0.0.1:8000)")
+    p.add_argument("--admin-key", required=True, help="Currently valid API key")
+    p.add_argument("command", choices=["list", "replay"])
+    p.add_argument("keys", nargs='*', help="Session ids to replay (default: all dead letters)")
+    args = p.parse_args()
+
+    base = args.url.rstrip('/')
+    headers = {'x-api-key': args.admin_key, 'Content-Type': 'application/json'}
+    try:
+        if args.command == "list":
+            r = requests.get(base + '/admin/callbacks', headers=headers, timeout=10)
+        else:
+            payload = {'keys': args.keys or None}
+            r = requests.post(base + '/admin/callbacks/replay', headers=headers, data=json.dumps(payload), timeout=10)
+        print('status:', r.status_code)
+        print(r.text)
+        r.raise_for_status()
+    except Exception as e:
+        print('failed:', e)
+        sys.exit(2)
+
+
+if __name__ == '__main__':
+    main()